@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Measure the test time saved by stopping tests once throughput is stable.
+
+Runs loopback tests against a local ``iperf3 -s`` with a fixed duration and
+with :meth:`iperf3.Client.run_until_stable`, and compares the wall clock
+time and the measured throughput. Requires the iperf3 binary and libiperf
+3.10 or later.
+"""
+
+import subprocess
+import time
+
+import iperf3
+
+PORT = 5299
+DURATION = 20
+RUNS = 3
+
+
+def client():
+    client = iperf3.Client()
+    client.server_hostname = '127.0.0.1'
+    client.port = PORT
+    client.duration = DURATION
+    return client
+
+
+def measure(run):
+    start = time.time()
+    result = run()
+    return time.time() - start, result
+
+
+if __name__ == '__main__':
+    server = subprocess.Popen(['iperf3', '-s', '-p', str(PORT)],
+                              stdout=subprocess.DEVNULL)
+    time.sleep(.3)  # give the server some time to start
+
+    try:
+        for label, run in (
+                ('fixed duration', lambda: client().run()),
+                ('run_until_stable', lambda: client().run_until_stable()),
+        ):
+            elapsed = []
+            for _ in range(RUNS):
+                seconds, result = measure(run)
+                time.sleep(.2)  # let the server get ready for the next test
+                elapsed.append(seconds)
+                print('{0:<18} {1:6.2f} s {2:10.1f} Mbps  stopped early: '
+                      '{3}'.format(label, seconds, result.sent_Mbps,
+                                   result.stopped_early))
+            print('{0:<18} mean {1:6.2f} s\n'.format(
+                label, sum(elapsed) / len(elapsed)))
+    finally:
+        server.kill()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Measure the size and throughput of the binary result archive.
+
+Writes the results of long tests with per second intervals, as json
+lines and as an :class:`iperf3.ArchiveWriter` archive, then reads them
+back with json.loads and with :class:`iperf3.ArchiveReader`.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import iperf3
+
+RESULTS = 1000
+INTERVALS = 600
+
+
+def long_result():
+    path = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                        'results.json')
+    with open(path) as f:
+        document = json.load(f)
+
+    interval = document['intervals'][0]
+    intervals = []
+    for second in range(INTERVALS):
+        copy = json.loads(json.dumps(interval))
+        for record in [copy['sum']] + copy['streams']:
+            record['start'] = float(second)
+            record['end'] = second + 1.00004
+            record['bytes'] += second * 1461
+        intervals.append(copy)
+    document['intervals'] = intervals
+    return json.dumps(document, indent=4)
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    text = long_result()
+    result = iperf3.TestResult(text)
+    directory = tempfile.mkdtemp()
+    json_path = os.path.join(directory, 'results.jsonl')
+    archive_path = os.path.join(directory, 'results.ipa')
+
+    def write_json():
+        with open(json_path, 'w') as f:
+            for _ in range(RESULTS):
+                f.write(json.dumps(json.loads(text)) + '\n')
+
+    def write_archive():
+        with iperf3.ArchiveWriter(archive_path) as archive:
+            for _ in range(RESULTS):
+                archive.write(result)
+
+    def read_json():
+        with open(json_path) as f:
+            for line in f:
+                iperf3.TestResult(line).intervals
+
+    def read_archive():
+        with iperf3.ArchiveReader(archive_path) as archive:
+            for result in archive:
+                pass
+
+    def scan_archive():
+        with iperf3.ArchiveReader(archive_path) as archive:
+            iperf3.ResultSet(archive.results(intervals=False))
+
+    print('{0} results of {1} intervals, numpy: {2}'.format(
+        RESULTS, INTERVALS, iperf3.iperf3.numpy is not None))
+    for name, function, path in (
+            ('json write', write_json, json_path),
+            ('archive write', write_archive, archive_path),
+            ('json read', read_json, json_path),
+            ('archive read', read_archive, archive_path),
+            ('archive scan', scan_archive, archive_path)):
+        seconds = timed(function)
+        print('{0:14} {1:7.3f}s {2:8.0f} results/s {3:8.1f} MB'.format(
+            name, seconds, RESULTS / seconds,
+            os.path.getsize(path) / 1e6))
+
+    os.remove(json_path)
+    os.remove(archive_path)
+    os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
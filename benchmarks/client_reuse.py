@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Measure the per-test setup cost of new clients against cached clients.
+
+Compares creating and configuring a :class:`iperf3.Client` for every test
+with taking a configured client from a :class:`iperf3.ClientCache` and
+resetting its iperf_test struct, which is what running a test on a cached
+client adds. Also prints the open file descriptors before and after.
+"""
+
+import os
+import timeit
+
+import iperf3
+
+CONFIG = {'server_hostname': '127.0.0.1', 'port': 5201, 'duration': 1,
+          'num_streams': 4, 'blksize': 1400, 'protocol': 'udp'}
+
+
+def new_client():
+    client = iperf3.Client()
+    for name, value in CONFIG.items():
+        setattr(client, name, value)
+    client.close()
+
+
+def cached_client(cache):
+    client = cache.acquire(CONFIG)
+    client._reset()
+    cache.release(client)
+
+
+if __name__ == '__main__':
+    number = 2000
+    cache = iperf3.ClientCache()
+    fds = len(os.listdir('/proc/self/fd'))
+
+    for label, func in (('new client per test', new_client),
+                        ('cached client', lambda: cached_client(cache))):
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print('{0:<22} {1:10.1f} us/test'.format(
+            label, seconds / number * 1e6))
+
+    cache.close()
+    print('open file descriptors: {0} before, {1} after'.format(
+        fds, len(os.listdir('/proc/self/fd'))))
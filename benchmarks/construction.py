@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""Measure the cost of constructing :class:`iperf3.Client` objects.
+
+Compares the shared, process-wide libiperf bindings against resolving,
+loading and declaring the library prototypes for every instance, which is
+what every ``IPerf3.__init__`` did before the bindings were cached.
+"""
+
+from ctypes import util, cdll
+import timeit
+
+import iperf3
+from iperf3 import iperf3 as _iperf3
+
+
+def legacy_bindings():
+    lib_name = util.find_library('libiperf') or 'libiperf.so.0'
+    lib = cdll.LoadLibrary(lib_name)
+    for name, restype, argtypes in _iperf3._PROTOTYPES:
+        function = getattr(lib, name)
+        function.restype = restype
+        function.argtypes = argtypes
+    return lib
+
+
+def shared_bindings():
+    return _iperf3.load_library()
+
+
+def construct_client():
+    return iperf3.Client()
+
+
+if __name__ == '__main__':
+    number = 200
+
+    for label, func in (('per instance bindings', legacy_bindings),
+                        ('shared bindings', shared_bindings),
+                        ('Client() construction', construct_client)):
+        seconds = min(timeit.repeat(func, number=number, repeat=3))
+        print('{0:<24} {1:10.1f} us/object'.format(
+            label, seconds / number * 1e6))
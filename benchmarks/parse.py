@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Measure reading and parsing the json output of long tests.
+
+Compares, for a result with per second intervals of several streams:
+
+- copying the output out of a C buffer with c_char_p(...).value and
+  decoding it, as before, against a single ctypes.string_at copy
+- parsing the whole document with the json module, as before, against
+  the parser used by :class:`iperf3.TestResult` (orjson or ujson when
+  installed)
+- reading a summary attribute of a new TestResult, which skips parsing
+  the intervals
+"""
+
+import ctypes
+import json
+import os
+import time
+
+import iperf3
+from iperf3.iperf3 import _load_json, orjson, ujson
+
+INTERVALS = 3600
+STREAMS = 4
+REPEAT = 20
+
+
+def long_result():
+    path = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                        'results.json')
+    with open(path) as f:
+        document = json.load(f)
+
+    interval = document['intervals'][0]
+    interval['streams'] = interval['streams'] * STREAMS
+    intervals = []
+    for second in range(INTERVALS):
+        copy = json.loads(json.dumps(interval))
+        for record in [copy['sum']] + copy['streams']:
+            record['start'] = float(second)
+            record['end'] = second + 1.00004
+        intervals.append(copy)
+    document['intervals'] = intervals
+
+    # formatted like libiperf formats it
+    return json.dumps(document, indent='\t').encode('utf-8')
+
+
+def timed(function):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        function()
+    return (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    data = long_result()
+    buffer = ctypes.create_string_buffer(data)
+    address = ctypes.addressof(buffer)
+    text = data.decode('utf-8')
+
+    parser = 'orjson' if orjson else 'ujson' if ujson else 'json'
+    print('{0:.1f} MB document, {1} intervals of {2} streams, parser: '
+          '{3}'.format(len(data) / 1e6, INTERVALS, STREAMS, parser))
+
+    for name, function in (
+            ('c_char_p + decode', lambda: ctypes.c_char_p(
+                ctypes.c_char_p(address).value).value.decode('utf-8')),
+            ('string_at', lambda: ctypes.string_at(address)),
+            ('json.loads', lambda: json.loads(text)),
+            ('_load_json', lambda: _load_json(data)),
+            ('_load_json summary', lambda: _load_json(data, False)),
+            ('TestResult summary', lambda: iperf3.TestResult(data).sent_bps),
+            ('TestResult intervals',
+             lambda: iperf3.TestResult(data).intervals)):
+        print('{0:22} {1:8.2f} ms'.format(name, timed(function) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Measure how fast libiperf output is captured from a pipe.
+
+A writer thread pushes a synthetic multi-MB output through an os.pipe, the
+way libiperf writes its (interval) output to stdout, while the output is
+captured with:
+
+- the original loop, which appends 1 KiB at a time to a bytes object and
+  calls select() before every read
+- :class:`iperf3.iperf3.PipeReader`
+"""
+
+import os
+import select
+import threading
+import time
+
+from iperf3.iperf3 import PipeReader
+
+
+def write_output(pipe_in, size):
+    line = b'{"start": 0, "end": 1, "bits_per_second": 9.5e+08},\n'
+    chunk = line * (64 * 1024 // len(line))
+    written = 0
+    while written < size:
+        written += os.write(pipe_in, chunk[:size - written])
+
+
+def legacy_capture(pipe_out, size):
+    out = b''
+    while len(out) < size:
+        r, _, _ = select.select([pipe_out], [], [], 0)
+        if r:
+            out += os.read(pipe_out, 1024)
+    return out
+
+
+def reader_capture(reader, writer):
+    reader.start()
+    writer.join()
+    return reader.stop()
+
+
+if __name__ == '__main__':
+    for megabytes in (1, 2, 4):
+        size = megabytes * 1024 * 1024
+
+        for label in ('legacy read_pipe', 'PipeReader'):
+            pipe_out, pipe_in = os.pipe()
+            reader = PipeReader(pipe_out)
+
+            writer = threading.Thread(target=write_output,
+                                      args=(pipe_in, size))
+            start = time.time()
+            writer.start()
+            if label == 'PipeReader':
+                data = reader_capture(reader, writer)
+            else:
+                data = legacy_capture(pipe_out, size)
+                writer.join()
+            elapsed = time.time() - start
+
+            assert len(data) == size
+            os.close(pipe_out)
+            os.close(pipe_in)
+
+            print('{0:>3} MB {1:<18} {2:8.3f} s {3:10.1f} MB/s'.format(
+                megabytes, label, elapsed, megabytes / elapsed))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Measure the memory held by many :class:`iperf3.TestResult` objects.
+
+Compares, for results of long tests with per second intervals:
+
+- the previous TestResult, which kept the raw text, the parsed json and a
+  __dict__ with every summary attribute
+- TestResult, parsed on first access, keeping the raw text
+- TestResult with the raw text dropped, keeping compact interval columns
+- TestResult with the raw text dropped, keeping the summary only
+"""
+
+import json
+import os
+import tracemalloc
+
+import iperf3
+
+RESULTS = 500
+INTERVALS = 600
+
+
+class LegacyTestResult(object):
+    """Holds the same data as the TestResult before it became lazy"""
+
+    def __init__(self, text):
+        self.text = text
+        self.json = json.loads(text)
+        summary = iperf3.TestResult(text)
+        for name in ('error', 'time', 'timesecs', 'system_info', 'version',
+                     'local_host', 'local_port', 'remote_host', 'remote_port',
+                     'tcp_mss_default', 'protocol', 'num_streams', 'blksize',
+                     'omit', 'duration', 'local_cpu_total', 'local_cpu_user',
+                     'local_cpu_system', 'remote_cpu_total',
+                     'remote_cpu_user', 'remote_cpu_system', 'sent_bytes',
+                     'sent_bps', 'received_bytes', 'received_bps',
+                     'retransmits', 'sent_kbps', 'sent_Mbps', 'sent_kB_s',
+                     'sent_MB_s', 'received_kbps', 'received_Mbps',
+                     'received_kB_s', 'received_MB_s'):
+            setattr(self, name, getattr(summary, name))
+
+
+def long_result():
+    path = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                        'results.json')
+    with open(path) as f:
+        document = json.load(f)
+
+    interval = document['intervals'][0]
+    intervals = []
+    for second in range(INTERVALS):
+        interval = json.loads(json.dumps(interval))
+        for entry in interval['streams'] + [interval['sum']]:
+            entry['start'] = float(second)
+            entry['end'] = float(second + 1)
+        intervals.append(interval)
+    document['intervals'] = intervals
+    return json.dumps(document, indent='\t')
+
+
+def measure(build, template):
+    """Memory held by RESULTS results, including their raw text if kept"""
+    tracemalloc.start()
+    # Every result gets its own copy of the text, like real results
+    texts = [template.replace('1498663888', str(1498663888 + index))
+             for index in range(RESULTS)]
+    results = [build(text) for text in texts]
+    for result in results:
+        result.sent_bps  # make sure lazy results have been parsed
+    del texts
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+if __name__ == '__main__':
+    template = long_result()
+    print('{0} results of {1} intervals, {2:.1f} kB of json each\n'.format(
+        RESULTS, INTERVALS, len(template) / 1024.))
+
+    for label, build in (
+            ('previous TestResult', LegacyTestResult),
+            ('TestResult', iperf3.TestResult),
+            ('dropped text, intervals',
+             lambda text: iperf3.TestResult(text, keep_text=False)),
+            ('dropped text, summary only',
+             lambda text: iperf3.TestResult(text, keep_text=False,
+                                            keep_intervals=False)),
+    ):
+        current = measure(build, template)
+        print('{0:<28} {1:10.1f} kB/result'.format(
+            label, current / 1024. / RESULTS))
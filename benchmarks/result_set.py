@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Aggregate a million test results with :class:`iperf3.ResultSet`.
+
+Compares grouping the results per remote host and stream count and
+computing the mean, percentiles and confidence interval of the throughput
+per group, for:
+
+- a list of per result dicts, aggregated with plain Python
+- a ResultSet built from columns
+"""
+
+import math
+import random
+import time
+
+import iperf3
+
+RESULTS = 1000000
+HOSTS = ['10.0.0.{0}'.format(i) for i in range(1, 21)]
+STREAMS = [1, 2, 4, 8]
+
+
+def rows():
+    random.seed(0)
+    return [{
+        'remote_host': random.choice(HOSTS),
+        'num_streams': random.choice(STREAMS),
+        'protocol': 'TCP',
+        'sent_bps': random.gauss(9e8, 5e7),
+    } for _ in range(RESULTS)]
+
+
+def aggregate_rows(results):
+    groups = {}
+    for result in results:
+        key = result['remote_host'], result['num_streams']
+        groups.setdefault(key, []).append(result['sent_bps'] / 1e6)
+
+    summary = {}
+    for key, values in groups.items():
+        values.sort()
+        mean = math.fsum(values) / len(values)
+        std = math.sqrt(math.fsum((v - mean) ** 2 for v in values) /
+                        (len(values) - 1))
+        margin = 1.959964 * std / math.sqrt(len(values))
+        summary[key] = (mean, [values[int((len(values) - 1) * q / 100.)]
+                               for q in (5, 50, 95)],
+                        (mean - margin, mean + margin))
+    return summary
+
+
+def aggregate_set(results):
+    summary = {}
+    for key, group in results.groupby('remote_host', 'num_streams').items():
+        summary[key] = (group.mean('sent_Mbps'),
+                        group.percentile('sent_Mbps', [5, 50, 95]),
+                        group.confidence_interval('sent_Mbps'))
+    return summary
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    data = rows()
+    _, seconds = timed(aggregate_rows, data)
+    print('list of dicts:   {0:7.3f}s'.format(seconds))
+
+    columns = dict((name, [row[name] for row in data])
+                   for name in data[0])
+    results, build = timed(lambda: iperf3.ResultSet.from_columns(**columns))
+    _, seconds = timed(aggregate_set, results)
+    print('ResultSet:       {0:7.3f}s (+{1:.3f}s to build, numpy: {2})'.format(
+        seconds, build, iperf3.iperf3.numpy is not None))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Measure the tests per minute a :class:`iperf3.ServerFarm` serves.
+
+Runs a farm on 1, 2, 4 and 8 loopback ports, with one ``iperf3`` client
+process per port running short tests back to back for a fixed amount of
+time, and prints the tests per minute the farm reported. A single server
+serves one test at a time, so the rate should grow with the number of
+ports until the CPUs are saturated.
+
+Needs libiperf and the iperf3 command line client.
+"""
+
+import subprocess
+import threading
+import time
+
+import iperf3
+
+BASE_PORT = 5301
+TEST_DURATION = 1
+SECONDS = 20
+
+
+def client_loop(port, deadline):
+    while time.monotonic() < deadline:
+        subprocess.call(
+            ['iperf3', '-c', '127.0.0.1', '-p', str(port),
+             '-t', str(TEST_DURATION), '-b', '100M', '-J'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+
+def measure(count):
+    ports = range(BASE_PORT, BASE_PORT + count)
+    served = [0]
+    with iperf3.ServerFarm(ports, bind_address='127.0.0.1') as farm:
+        consumer = threading.Thread(target=lambda: served.__setitem__(
+            0, sum(1 for _, result in farm.results() if not result.error)))
+        consumer.start()
+        farm.wait_ready(5)
+
+        deadline = time.monotonic() + SECONDS
+        clients = [threading.Thread(target=client_loop, args=(port, deadline))
+                   for port in ports]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        time.sleep(.5)  # let the last results come in
+
+    consumer.join()
+    return served[0] * 60. / SECONDS
+
+
+def main():
+    for count in (1, 2, 4, 8):
+        print('{0} ports: {1:6.1f} tests/minute'.format(count, measure(count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Measure the configuration throughput of :class:`iperf3.Client`.
+
+Compares reading and writing settings through libiperf on every access,
+which is what every property did before the settings were mirrored in
+Python, against the mirrored settings written in one ``apply()``. Each
+round configures a client from a dict and reads the settings back a few
+times, like orchestration code building labels and records does.
+"""
+
+import timeit
+
+import iperf3
+
+CONFIG = {'server_hostname': '10.0.0.1', 'port': 5201, 'duration': 10,
+          'num_streams': 4, 'blksize': 1400, 'bandwidth': 100000000,
+          'omit': 1, 'reverse': True}
+READS = 10
+
+
+def round_trips(client):
+    lib, test = client.lib, client._test
+    lib.iperf_set_test_server_hostname(test, b'10.0.0.1')
+    lib.iperf_set_test_server_port(test, 5201)
+    lib.iperf_set_test_duration(test, 10)
+    lib.iperf_set_test_num_streams(test, 4)
+    lib.iperf_set_test_blksize(test, 1400)
+    lib.iperf_set_test_rate(test, 100000000)
+    lib.iperf_set_test_omit(test, 1)
+    lib.iperf_set_test_reverse(test, 1)
+    for _ in range(READS):
+        (lib.iperf_get_test_server_hostname(test),
+         lib.iperf_get_test_server_port(test),
+         lib.iperf_get_test_duration(test),
+         lib.iperf_get_test_num_streams(test),
+         lib.iperf_get_test_blksize(test),
+         lib.iperf_get_test_rate(test),
+         lib.iperf_get_test_omit(test),
+         lib.iperf_get_test_reverse(test))
+
+
+def mirrored(client):
+    for name, value in CONFIG.items():
+        setattr(client, name, value)
+    client.apply()
+    for _ in range(READS):
+        (client.server_hostname, client.port, client.duration,
+         client.num_streams, client.blksize, client.bandwidth, client.omit,
+         client.reverse)
+
+
+if __name__ == '__main__':
+    number = 20000
+    client = iperf3.Client()
+
+    for label, func in (('libiperf round trips', round_trips),
+                        ('mirrored settings', mirrored)):
+        seconds = min(timeit.repeat(lambda: func(client), number=number,
+                                    repeat=3))
+        print('{0:<22} {1:10.0f} configurations/s'.format(
+            label, number / seconds))
+
+    seconds = min(timeit.repeat(
+        lambda: iperf3.Client.from_config(CONFIG).close(), number=2000,
+        repeat=3))
+    print('{0:<22} {1:10.0f} clients/s'.format('Client.from_config',
+                                               2000 / seconds))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Measure the memory of :class:`iperf3.SoakTest` over a long soak.
+
+Feeds a simulated day of one second intervals, with a throughput collapse
+every few hours, into a soak test with 1 minute, 10 minute and 1 hour
+windows reporting every minute, and prints the traced memory along the
+way. Memory should stay flat once the longest window has filled.
+"""
+
+import random
+import time
+import tracemalloc
+
+import iperf3
+
+HOURS = 24
+
+
+def main():
+    now = [0.]
+    collapses = []
+
+    def report(summary):
+        hour = summary['windows'][3600]
+        minute = summary['windows'][60]
+        if minute['p5_bits_per_second'] < .5 * hour['median_bits_per_second']:
+            collapses.append(now[0])
+
+    soak = iperf3.SoakTest(None, on_report=report, clock=lambda: now[0])
+    random.seed(0)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for second in range(HOURS * 3600):
+        now[0] = second
+        bps = random.gauss(9e8, 3e7)
+        if second % (4 * 3600) > 4 * 3600 - 300:
+            bps = random.gauss(1e7, 1e6)  # five minute collapse
+        soak.add({'sum': {'seconds': 1., 'bytes': int(bps / 8),
+                          'bits_per_second': bps, 'retransmits': 0}})
+        if second % (3 * 3600) == 3600 - 1:
+            current, _ = tracemalloc.get_traced_memory()
+            print('{0:3d}h {1:8.1f} kB traced'.format(
+                (second + 1) // 3600, current / 1e3))
+
+    seconds = time.perf_counter() - start
+    tracemalloc.stop()
+    print('{0} intervals in {1:.1f}s, {2} reports flagged a collapse'.format(
+        soak.intervals, seconds, len(collapses)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Measure the memory used to follow a long test through its json stream.
+
+Feeds the json stream events of an 8 hour test with 0.1 second intervals
+through the stream parser used by :meth:`iperf3.Client.run`, keeping the
+intervals as before, and folding them into an
+:class:`iperf3.IntervalAggregate` without keeping them. Tracing the
+allocations makes this take a few minutes.
+"""
+
+import json
+import os
+import time
+import tracemalloc
+
+import iperf3
+from iperf3.iperf3 import _JSONStream
+
+INTERVALS = 8 * 3600 * 10
+CHUNK = 64 * 1024
+
+
+def events():
+    path = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                        'results.json')
+    with open(path) as f:
+        document = json.load(f)
+
+    yield json.dumps({'event': 'start', 'data': document['start']})
+    interval = document['intervals'][0]
+    for index in range(INTERVALS):
+        for record in [interval['sum']] + interval['streams']:
+            record['start'] = index / 10.
+            record['end'] = (index + 1) / 10.
+        yield json.dumps({'event': 'interval', 'data': interval})
+    yield json.dumps({'event': 'end', 'data': document['end']})
+
+
+def chunks():
+    """The stream as read from the FIFO, in chunks"""
+    buffer = []
+    size = 0
+    for event in events():
+        buffer.append(event.encode('utf-8') + b'\n')
+        size += len(buffer[-1])
+        if size >= CHUNK:
+            data = b''.join(buffer)
+            for position in range(0, len(data), CHUNK):
+                yield data[position:position + CHUNK]
+            buffer = []
+            size = 0
+    yield b''.join(buffer)
+
+
+def measure(keep_intervals):
+    aggregate = iperf3.IntervalAggregate()
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    stream = _JSONStream(aggregate, keep_intervals)
+    for chunk in chunks():
+        stream.feed(chunk)
+    result = iperf3.TestResult(stream.text)
+    result.sent_bps
+
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, aggregate
+
+
+def main():
+    print('{0} intervals'.format(INTERVALS))
+    for name, keep_intervals in (('keep intervals', True),
+                                 ('aggregate only', False)):
+        seconds, peak, aggregate = measure(keep_intervals)
+        print('{0:15} {1:7.2f}s  peak {2:9.1f} MB  mean {3:.0f} bps'.format(
+            name, seconds, peak / 1e6, aggregate.mean_bits_per_second))
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,5 @@
-from .iperf3 import Client, Server, TestResult, IPerf3
+from .iperf3 import Client, Server, TestResult, IPerf3, ClientPool, \
+    ClientProcessPool, IntervalStream, StopTest, Intervals, Streams, \
+    ResultSet, ArchiveWriter, ArchiveReader, JSONLinesWriter, \
+    JSONLinesReader, IntervalAggregate, SoakTest, QuantileSketch, \
+    Capabilities, ServerFarm, ClientCache
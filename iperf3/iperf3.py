@@ -5,9 +5,11 @@ classes, :class:`Client` and :class:`Server`, that inherit from the base class
 :class:`IPerf3`. They provide a nice (if i say so myself) and pythonic way to
 interact with the iperf3 utility.
 
-At the moment the module redirects stdout and stderr to a pipe and returns the
-received data back after each ``client.run()`` or ``server.run()`` call. In
-later releases there will be an option to toggle this on or off.
+The json output of libiperf is captured and returned after each
+``client.run()`` or ``server.run()`` call. Recent libiperf versions write the
+output of every test to a file of its own, which allows several tests to run
+in one process at the same time. On older versions stdout is redirected to a
+pipe while a test runs, so only one test runs at a time.
 
 A user should never have to utilise the :class:`IPerf3` class directly, this
 class provides common settings for the :class:`Client` and :class:`Server`
@@ -18,17 +20,58 @@ To get started quickly see the :ref:`examples` page.
 .. moduleauthor:: Mathijs Mortimer <mathijs@mortimer.nl>
 """
 
-from ctypes import util, cdll, c_char_p, c_int, c_char, c_void_p, c_uint64
+from ctypes import util, cdll, c_char_p, c_int, c_char, c_byte, c_void_p, \
+    c_uint64, addressof, cast, string_at, CFUNCTYPE
+import io
+import math
+import mmap
 import os
+import random
 import select
 import json
+import shutil
+import tempfile
+import multiprocessing
+import operator
+import re
 import threading
+import socket
+import struct
+import sys
+import time
 from socket import SOCK_DGRAM, SOCK_STREAM
+from collections import deque, OrderedDict
+from array import array
 
 try:
-    from queue import Queue
+    from queue import Queue, Empty
 except ImportError:
-    from Queue import Queue  # Python2 compatibility
+    from Queue import Queue, Empty  # Python2 compatibility
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None  # Python2 compatibility
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # NumPy is optional, array.array is used instead
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # orjson is optional, speeds up parsing the json output
+
+try:
+    import ujson
+except ImportError:
+    ujson = None  # ujson is optional, used when orjson isn't installed
+
+try:
+    from statistics import NormalDist
+except ImportError:
+    NormalDist = None  # Python < 3.8
 
 
 __version__ = '0.1.11'
@@ -36,6 +79,324 @@ __version__ = '0.1.11'
 
 MAX_UDP_BULKSIZE = (65535 - 8 - 20)
 
+NAN = float('nan')
+
+# array.array type code of 64 bit integers, 'q' isn't available in Python2
+try:
+    array('q')
+    _INT_TYPECODE = 'q'
+except ValueError:
+    _INT_TYPECODE = 'l'
+
+# Two-sided z scores of common confidence levels, for Pythons without
+# statistics.NormalDist
+_Z_SCORES = {.8: 1.2815516, .9: 1.6448536, .95: 1.9599640, .99: 2.5758293}
+
+# The top level intervals and end sections of the json output, which
+# libiperf indents with tabs. Cutting out the text between them skips
+# parsing the intervals.
+_INTERVALS_MARKER = b'\n\t"intervals":'
+_END_MARKER = b'\n\t"end":'
+
+# iperf_get_test_state values from the moment a client connected until its
+# test has been served, see iperf.h
+_BUSY_STATES = frozenset(range(1, 15))
+
+# iperf_get_test_state value of a server listening for a client
+IPERF_START = 15
+
+# Seconds between checks whether a server listens for a client
+SERVER_READY_POLL_INTERVAL = .001
+
+# Seconds between attempts to stop a test that ran past its max_runtime
+WATCHDOG_RETRY_INTERVAL = .1
+
+# Seconds an idle server worker thread waits for the next test before it
+# exits
+SERVER_WORKER_IDLE_TIMEOUT = 60
+
+# Seconds between checks for the result of a served test, an untimed wait
+# can't be interrupted by Ctrl+C in Python2
+SERVER_RESULT_POLL_INTERVAL = .1
+
+# Clock of soak tests and server workers, time.monotonic isn't available
+# in Python2
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# libiperf error number of a server that is busy running another test
+IEACCESSDENIED = 121
+
+# Amount of bytes read from a pipe per system call
+PIPE_CHUNK_SIZE = 64 * 1024
+
+
+# C prototypes of the libiperf functions used by this module, in the form
+# (function name, restype, argtypes)
+_PROTOTYPES = (
+    ('iperf_client_end', c_int, (c_void_p,)),
+    ('iperf_free_test', None, (c_void_p,)),
+    ('iperf_new_test', c_void_p, None),
+    ('iperf_defaults', c_int, (c_void_p,)),
+    ('iperf_get_test_role', c_char, (c_void_p,)),
+    ('iperf_set_test_role', None, (c_void_p, c_char,)),
+    ('iperf_get_test_bind_address', c_char_p, (c_void_p,)),
+    ('iperf_set_test_bind_address', None, (c_void_p, c_char_p,)),
+    ('iperf_get_test_server_port', c_int, (c_void_p,)),
+    ('iperf_set_test_server_port', None, (c_void_p, c_int,)),
+    ('iperf_get_test_json_output', c_int, (c_void_p,)),
+    ('iperf_set_test_json_output', None, (c_void_p, c_int,)),
+    ('iperf_get_verbose', c_int, (c_void_p,)),
+    ('iperf_set_verbose', None, (c_void_p, c_int)),
+    ('iperf_strerror', c_char_p, (c_int,)),
+    ('iperf_get_test_server_hostname', c_char_p, (c_void_p,)),
+    ('iperf_set_test_server_hostname', None, (c_void_p, c_char_p,)),
+    ('iperf_get_test_protocol_id', c_int, (c_void_p,)),
+    ('set_protocol', c_int, (c_void_p, c_int,)),
+    ('iperf_get_test_omit', c_int, (c_void_p,)),
+    ('iperf_set_test_omit', None, (c_void_p, c_int,)),
+    ('iperf_get_test_duration', c_int, (c_void_p,)),
+    ('iperf_set_test_duration', None, (c_void_p, c_int,)),
+    ('iperf_get_test_rate', c_uint64, (c_void_p,)),
+    ('iperf_set_test_rate', None, (c_void_p, c_uint64,)),
+    ('iperf_get_test_blksize', c_int, (c_void_p,)),
+    ('iperf_set_test_blksize', None, (c_void_p, c_int,)),
+    ('iperf_get_test_num_streams', c_int, (c_void_p,)),
+    ('iperf_set_test_num_streams', None, (c_void_p, c_int,)),
+    ('iperf_has_zerocopy', c_int, None),
+    ('iperf_set_test_zerocopy', None, (c_void_p, c_int,)),
+    ('iperf_get_test_reverse', c_int, (c_void_p,)),
+    ('iperf_set_test_reverse', None, (c_void_p, c_int,)),
+    ('iperf_run_client', c_int, (c_void_p,)),
+    ('iperf_run_server', c_int, (c_void_p,)),
+    ('iperf_reset_test', None, (c_void_p,)),
+)
+
+# Prototypes that are only available in some libiperf releases
+_OPTIONAL_PROTOTYPES = (
+    # Only available from iperf v3.1 and onwards
+    ('iperf_get_test_json_output_string', c_void_p, (c_void_p,)),
+    ('iperf_set_test_logfile', None, (c_void_p, c_char_p,)),
+    ('iperf_open_logfile', c_int, (c_void_p,)),
+    ('iperf_get_test_outfile', c_void_p, (c_void_p,)),
+    ('iperf_get_control_socket', c_int, (c_void_p,)),
+    ('iperf_get_test_state', c_byte, (c_void_p,)),
+    ('iperf_set_test_state', None, (c_void_p, c_byte,)),
+    ('iperf_get_test_congestion_control', c_char_p, (c_void_p,)),
+    ('iperf_set_test_congestion_control', None, (c_void_p, c_char_p,)),
+    # Only available from iperf v3.7 and onwards
+    ('iperf_get_test_bidirectional', c_int, (c_void_p,)),
+    ('iperf_set_test_bidirectional', None, (c_void_p, c_int,)),
+    # Only available from iperf v3.10 and onwards
+    ('iperf_set_test_json_stream', None, (c_void_p, c_int,)),
+    ('iperf_get_test_connect_timeout', c_int, (c_void_p,)),
+    ('iperf_set_test_connect_timeout', None, (c_void_p, c_int,)),
+    # Only available from iperf v3.17 and onwards
+    ('iperf_set_test_json_callback', None, (c_void_p, c_void_p,)),
+)
+
+# void (*json_callback)(struct iperf_test *, char *)
+_JSON_CALLBACK = CFUNCTYPE(None, c_void_p, c_char_p)
+
+# Functions needed to let libiperf write the output of a test to a file of
+# its own instead of the process wide stdout, and to close the file again
+# when libiperf replaces it
+_OWN_OUTPUT_FUNCTIONS = (
+    'iperf_set_test_logfile',
+    'iperf_open_logfile',
+    'iperf_get_test_outfile',
+    'iperf_get_test_json_output_string',
+)
+
+# Optional features of libiperf, (Capabilities attribute, functions needed)
+_CAPABILITY_FUNCTIONS = (
+    ('json_output_string', ('iperf_get_test_json_output_string',)),
+    ('own_output', _OWN_OUTPUT_FUNCTIONS),
+    ('control_socket', ('iperf_get_control_socket',)),
+    ('test_state', ('iperf_get_test_state', 'iperf_set_test_state')),
+    ('json_stream', ('iperf_set_test_json_stream',)),
+    ('json_callback', ('iperf_set_test_json_stream',
+                       'iperf_set_test_json_callback')),
+    ('bidirectional', ('iperf_get_test_bidirectional',
+                       'iperf_set_test_bidirectional')),
+    ('congestion_control', ('iperf_get_test_congestion_control',
+                            'iperf_set_test_congestion_control')),
+    ('connect_timeout', ('iperf_get_test_connect_timeout',
+                         'iperf_set_test_connect_timeout')),
+)
+
+# Serialises tests that capture libiperf output by redirecting stdout
+_stdout_lock = threading.Lock()
+
+# Serialises access to the static buffer used by iperf_strerror
+_strerror_lock = threading.Lock()
+
+# Loaded libraries, keyed by the lib_name they were requested with
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+# Capabilities of the loaded libraries, keyed by library
+_capabilities = {}
+
+# The C library, loaded the first time _fclose needs it
+_libc = None
+
+
+def load_library(lib_name=None):
+    """Load libiperf and declare its C prototypes
+
+    The library is resolved, loaded and prepared only once per ``lib_name``.
+    All :class:`IPerf3` instances requesting the same ``lib_name`` share the
+    returned library object and its bound functions.
+
+    :param lib_name: optional name and path for libiperf.so.0 library
+    :rtype: ctypes.CDLL
+    """
+    try:
+        return _libraries[lib_name]
+    except KeyError:
+        pass
+
+    with _libraries_lock:
+        # Another thread may have loaded it while we waited for the lock
+        if lib_name in _libraries:
+            return _libraries[lib_name]
+
+        path = lib_name
+        if path is None:
+            path = util.find_library('libiperf')
+            if path is None:
+                # If we still couldn't find it lets try the manual approach
+                path = 'libiperf.so.0'
+
+        try:
+            lib = cdll.LoadLibrary(path)
+        except OSError:
+            raise OSError(
+                "Couldn't find shared library {}, is iperf3 installed?".format(
+                    path
+                )
+            )
+
+        # Set the appropriate C types.
+        for name, restype, argtypes in _PROTOTYPES:
+            function = getattr(lib, name)
+            function.restype = restype
+            function.argtypes = argtypes
+
+        for name, restype, argtypes in _OPTIONAL_PROTOTYPES:
+            try:
+                function = getattr(lib, name)
+            except AttributeError:
+                continue
+            function.restype = restype
+            function.argtypes = argtypes
+
+        _capabilities[lib] = Capabilities(lib)
+        _libraries[lib_name] = lib
+        return lib
+
+
+def _fclose(stream):
+    """Close a FILE stream opened by libiperf
+
+    :param stream: the FILE pointer
+    """
+    global _libc
+    if _libc is None:
+        libc = cdll.LoadLibrary(util.find_library('c'))
+        libc.fclose.restype = c_int
+        libc.fclose.argtypes = (c_void_p,)
+        _libc = libc
+    _libc.fclose(stream)
+
+
+class Capabilities(object):
+    """The version and optional features of a loaded libiperf.
+
+    Probed once per library when it is loaded and shared by all
+    :class:`IPerf3` instances using it, see :attr:`IPerf3.capabilities`.
+
+    Basic Usage::
+
+      >>> client.capabilities.version_info
+      (3, 17, 1)
+      >>> client.capabilities.streaming
+      'callback'
+
+    :param version: the version string, like 'iperf 3.17.1', None when the
+        library doesn't export it
+    :param version_info: the version as tuple of ints, empty when unknown
+    :param json_output_string: the json output can be read back from
+        libiperf (3.1+)
+    :param own_output: every test can write its output to a FIFO of its
+        own, so tests can run in parallel threads (3.1+)
+    :param control_socket: the control socket can be read, which is needed
+        to stop a running test (3.1+)
+    :param test_state: the state of a running test can be read and
+        reset, which tells a listening server from one serving a test
+    :param json_stream: the json output can be streamed (3.10+)
+    :param json_callback: the json stream can be handed to a callback
+        (3.17+)
+    :param bidirectional: bidirectional tests are supported (3.7+)
+    :param congestion_control: the TCP congestion control algorithm can be
+        set
+    :param connect_timeout: the control connection timeout can be set
+    :param streaming: how intervals are streamed while a test runs:
+        'callback', 'fifo', or None when they only arrive after the test
+    """
+
+    def __init__(self, lib):
+        """Probe a library
+
+        :param lib: the library as loaded by ctypes
+        """
+        self.version = _library_version(lib)
+        self.version_info = _parse_version(self.version)
+
+        for attribute, functions in _CAPABILITY_FUNCTIONS:
+            setattr(self, attribute,
+                    all(hasattr(lib, name) for name in functions))
+
+        if self.json_callback:
+            self.streaming = 'callback'
+        elif self.json_stream and self.own_output:
+            self.streaming = 'fifo'
+        else:
+            self.streaming = None
+
+    def __repr__(self):
+        features = [attribute for attribute, _ in _CAPABILITY_FUNCTIONS
+                    if getattr(self, attribute)]
+        return '<Capabilities {0}: {1}>'.format(
+            self.version, ', '.join(features) or 'none'
+        )
+
+
+def _library_version(lib):
+    """The version string libiperf exports
+
+    :param lib: the library as loaded by ctypes
+    :rtype: unicode string, None when not exported
+    """
+    try:
+        version = c_char.in_dll(lib, 'version')
+    except ValueError:
+        return None
+    return string_at(addressof(version)).decode('utf-8', 'replace')
+
+
+def _parse_version(version):
+    """Parse a libiperf version string
+
+    :param version: the version string, like 'iperf 3.17.1' or
+        'iperf 3.1b3', or None
+    :rtype: tuple of ints, empty when there is no version number
+    """
+    match = re.search(r'(\d+)\.(\d+)(?:\.(\d+))?', version or '')
+    if match is None:
+        return ()
+    return tuple(int(part) for part in match.groups() if part is not None)
+
 
 def more_data(pipe_out):
     """Check if there is more data left on the pipe
@@ -47,21 +408,154 @@ def more_data(pipe_out):
     return bool(r)
 
 
-def read_pipe(pipe_out):
+def read_pipe(pipe_out, chunk_size=PIPE_CHUNK_SIZE):
     """Read data on a pipe
 
     Used to capture stdout data produced by libiperf
 
     :param pipe_out: The os pipe_out
+    :param chunk_size: The maximum amount of bytes to read per system call
     :rtype: unicode string
     """
-    out = b''
+    out = bytearray()
     while more_data(pipe_out):
-        out += os.read(pipe_out, 1024)
+        chunk = os.read(pipe_out, chunk_size)
+        if not chunk:
+            break
+        out += chunk
 
     return out.decode('utf-8')
 
 
+def _release(view):
+    """Release a memoryview, so the bytearray it exports can be resized
+
+    Python2 has no memoryview.release, the view is released once nothing
+    refers to it anymore.
+
+    :param view: the memoryview
+    """
+    release = getattr(view, 'release', None)
+    if release is not None:
+        release()
+
+
+class PipeReader(object):
+    """Drains a pipe into a growing buffer on a background thread
+
+    libiperf writes its output to the pipe while a test is running. When
+    nobody reads from the pipe it fills up and libiperf blocks halfway
+    through the test. The reader empties the pipe while the test runs and
+    collects the data in a single buffer that grows geometrically, so
+    capturing large outputs takes linear time.
+
+    Basic Usage::
+
+      >>> reader = PipeReader(pipe_out)
+      >>> reader.start()
+      >>> # ... libiperf writes to the pipe ...
+      >>> data = reader.stop()
+
+    When a callback is given every chunk is handed to it as soon as it has
+    been read instead of being collected, so the reader uses a fixed amount
+    of memory no matter how much data passes through the pipe.
+    """
+
+    def __init__(self, pipe_out, chunk_size=PIPE_CHUNK_SIZE, callback=None):
+        """Initialise the pipe reader
+
+        :param pipe_out: The os pipe_out
+        :param chunk_size: The maximum amount of bytes to read per system call
+        :param callback: optional function called with every chunk of bytes
+            read from the pipe, from the reader thread
+        """
+        self._callback = callback
+        self._pipe_out = pipe_out
+        self._pipe = io.FileIO(pipe_out, 'r', closefd=False)
+        self._chunk_size = chunk_size
+        self._buffer = bytearray(chunk_size)
+        self._length = 0
+        self._thread = None
+        self._wake_out = None
+        self._wake_in = None
+
+    def start(self):
+        """Start draining the pipe on a background thread"""
+        if self._thread is not None:
+            raise RuntimeError('PipeReader is already running')
+
+        self._length = 0
+        self._wake_out, self._wake_in = os.pipe()
+        self._thread = threading.Thread(target=self._drain)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop draining the pipe and return everything that was read
+
+        Data still waiting on the pipe is read before returning.
+
+        :rtype: bytes, empty when a callback is used
+        """
+        if self._thread is None:
+            raise RuntimeError('PipeReader is not running')
+
+        os.write(self._wake_in, b'x')
+        self._thread.join()
+        self._thread = None
+
+        os.close(self._wake_out)
+        os.close(self._wake_in)
+
+        view = memoryview(self._buffer)
+        try:
+            return view[:self._length].tobytes()
+        finally:
+            _release(view)
+
+    def _readinto(self):
+        """Read the next chunk from the pipe straight into the buffer
+
+        :rtype: amount of bytes read, 0 at the end of the pipe and None when
+            a non-blocking pipe has no data
+        """
+        if len(self._buffer) - self._length < self._chunk_size:
+            self._buffer.extend(
+                bytearray(max(len(self._buffer), self._chunk_size))
+            )
+
+        view = memoryview(self._buffer)
+        try:
+            read = self._pipe.readinto(
+                view[self._length:self._length + self._chunk_size]
+            )
+        finally:
+            _release(view)
+
+        if read and self._callback is not None:
+            self._callback(bytes(self._buffer[:read]))
+        elif read:
+            self._length += read
+        return read
+
+    def _drain(self):
+        """Read from the pipe until stop() is called"""
+        while True:
+            readable, _, _ = select.select(
+                [self._pipe_out, self._wake_out], [], []
+            )
+            if self._pipe_out in readable:
+                if self._readinto() == 0:
+                    # The write end of the pipe has been closed
+                    return
+            elif self._wake_out in readable:
+                break
+
+        while more_data(self._pipe_out):
+            if not self._readinto():
+                return
+
+
 def output_to_pipe(pipe_in):
     """Redirects stdout and stderr to a pipe
 
@@ -81,11 +575,407 @@ def output_to_screen(stdout_fd, stderr_fd):
     # os.dup2(stderr_fd, 2)
 
 
+def _discard(data):
+    """Drop output that is read back from libiperf instead"""
+
+
+def _write_stdout(data):
+    """Write libiperf output to stdout, as libiperf would
+
+    :param data: bytes
+    """
+    while data:
+        data = data[os.write(1, data):]
+
+
+class StopTest(Exception):
+    """Raised by an on_interval callback to stop the test early.
+
+    The test then returns a :class:`TestResult` computed from the intervals
+    received so far, with ``stopped_early`` set.
+    """
+
+
+class IntervalAggregate(object):
+    """Running totals of the intervals of a test, kept in constant memory.
+
+    Pass it as on_interval to :meth:`Client.run` to follow a test of any
+    length without keeping its intervals. Omitted intervals are counted
+    but not added to the totals.
+
+    Basic Usage::
+
+      >>> aggregate = iperf3.IntervalAggregate()
+      >>> result = client.run(on_interval=aggregate, keep_intervals=False)
+      >>> aggregate.count, aggregate.min_bits_per_second
+      (28800, 912312000.0)
+
+    :param count: amount of intervals added
+    :param omitted: amount of omitted intervals seen
+    :param start: start of the first interval, in seconds since the test
+        started
+    :param end: end of the last interval
+    :param bytes: bytes transferred
+    :param min_bits_per_second: throughput of the slowest interval
+    :param max_bits_per_second: throughput of the fastest interval
+    :param retransmits: TCP retransmits, None when not reported
+    :param jitter_ms: UDP jitter of the last interval, None for TCP
+    :param packets: UDP packets
+    :param lost_packets: UDP lost packets
+    """
+
+    __slots__ = (
+        'count', 'omitted', 'start', 'end', 'bytes',
+        'min_bits_per_second', 'max_bits_per_second', 'retransmits',
+        'jitter_ms', 'packets', 'lost_packets', '_mean', '_squares',
+    )
+
+    def __init__(self):
+        self.count = 0
+        self.omitted = 0
+        self.start = 0
+        self.end = 0
+        self.bytes = 0
+        self.min_bits_per_second = None
+        self.max_bits_per_second = None
+        self.retransmits = None
+        self.jitter_ms = None
+        self.packets = 0
+        self.lost_packets = 0
+
+        # Welford's running mean and sum of squared differences
+        self._mean = 0.0
+        self._squares = 0.0
+
+    def add(self, interval):
+        """Add an interval
+
+        :param interval: an interval as found in the json output
+        """
+        total = interval['sum']
+        if total.get('omitted'):
+            self.omitted += 1
+            return
+
+        if not self.count:
+            self.start = total['start']
+        self.end = total['end']
+        self.count += 1
+        self.bytes += total['bytes']
+
+        bps = total['bits_per_second']
+        if self.min_bits_per_second is None or bps < self.min_bits_per_second:
+            self.min_bits_per_second = bps
+        if self.max_bits_per_second is None or bps > self.max_bits_per_second:
+            self.max_bits_per_second = bps
+        delta = bps - self._mean
+        self._mean += delta / self.count
+        self._squares += delta * (bps - self._mean)
+
+        if 'retransmits' in total:
+            self.retransmits = (self.retransmits or 0) + total['retransmits']
+        if 'jitter_ms' in total:
+            self.jitter_ms = total['jitter_ms']
+            self.packets += total.get('packets', 0)
+            self.lost_packets += total.get('lost_packets', 0)
+
+    def __call__(self, interval):
+        """Add an interval, so the aggregate can be passed as on_interval"""
+        self.add(interval)
+
+    @property
+    def seconds(self):
+        """Time covered by the intervals in seconds"""
+        return self.end - self.start
+
+    @property
+    def bits_per_second(self):
+        """Throughput over all intervals"""
+        seconds = self.seconds
+        return self.bytes * 8 / float(seconds) if seconds else 0
+
+    @property
+    def mean_bits_per_second(self):
+        """Mean of the interval throughputs, None without intervals"""
+        return self._mean if self.count else None
+
+    @property
+    def std_bits_per_second(self):
+        """Sample standard deviation of the interval throughputs
+
+        None with less than two intervals.
+        """
+        if self.count < 2:
+            return None
+        return (self._squares / (self.count - 1)) ** .5
+
+    @property
+    def lost_percent(self):
+        """UDP lost packets in percent"""
+        return 100.0 * self.lost_packets / self.packets if self.packets else 0
+
+    def end_section(self):
+        """The end section of the json output, computed from the intervals
+
+        :rtype: dict
+        """
+        total = {
+            'start': self.start,
+            'end': self.end,
+            'seconds': self.seconds,
+            'bytes': self.bytes,
+            'bits_per_second': self.bits_per_second,
+        }
+
+        end_section = {
+            'cpu_utilization_percent': dict(
+                (name, None) for name in (
+                    'host_total', 'host_user', 'host_system',
+                    'remote_total', 'remote_user', 'remote_system',
+                )
+            ),
+        }
+
+        if self.jitter_ms is not None:
+            udp = dict(total)
+            udp['jitter_ms'] = self.jitter_ms
+            udp['packets'] = self.packets
+            udp['lost_packets'] = self.lost_packets
+            udp['lost_percent'] = self.lost_percent
+            end_section['sum'] = udp
+        else:
+            sent = dict(total)
+            if self.retransmits is not None:
+                sent['retransmits'] = self.retransmits
+            end_section['sum_sent'] = sent
+            end_section['sum_received'] = dict(total)
+
+        return end_section
+
+
+class _JSONStream(object):
+    """Assembles the events of libiperf's json stream into a json document
+
+    With json streaming enabled libiperf writes every part of the json
+    output as a separate event on a line of its own, as soon as it is known.
+    Intervals are folded into an :class:`IntervalAggregate` as they arrive
+    and are only kept when keep_intervals is set.
+    """
+
+    def __init__(self, on_interval=None, keep_intervals=True):
+        """Initialise the json stream
+
+        :param on_interval: optional function called with every interval
+        :param keep_intervals: keep the intervals for the json document
+        """
+        self._on_interval = on_interval
+        self._keep_intervals = keep_intervals
+        self._partial = b''
+        self.document = {}
+        self.intervals = []
+        self.aggregate = IntervalAggregate()
+        self.exception = None
+
+    def feed(self, data):
+        """Feed bytes of the stream, which may contain incomplete lines
+
+        :param data: bytes read from the stream
+        """
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.event(line)
+
+    def event(self, line):
+        """Handle a single event
+
+        Events arriving after on_interval raised an exception are ignored.
+
+        :param line: the json encoded event
+        """
+        if self.exception is not None:
+            return
+
+        try:
+            event = _load_json(line)
+        except ValueError:
+            # Not part of the json stream
+            return
+        name = event.get('event')
+        data = event.get('data')
+
+        if name == 'interval':
+            self.aggregate.add(data)
+            if self._keep_intervals:
+                self.intervals.append(data)
+            if self._on_interval is not None:
+                try:
+                    self._on_interval(data)
+                except Exception as e:
+                    self.exception = e
+        else:
+            self.document[name] = data
+
+    @property
+    def text(self):
+        """The complete json document as libiperf would have returned it
+
+        :rtype: unicode string, None when no events have been received
+        """
+        if not self.document and not self.aggregate.count and \
+                not self.aggregate.omitted:
+            return None
+
+        document = {}
+        if 'start' in self.document:
+            document['start'] = self.document['start']
+        document['intervals'] = self.intervals
+        document.update(self.document)
+        return json.dumps(document)
+
+    @property
+    def stopped_text(self):
+        """The json document of a test stopped before its end
+
+        The end section is computed from the intervals received so far, as
+        seen from this side of the test.
+
+        :rtype: unicode string
+        """
+        return json.dumps({
+            'start': self.document.get('start'),
+            'intervals': self.intervals,
+            'end': self.aggregate.end_section(),
+            'stopped_early': True,
+        })
+
+
+def _get_event_loop():
+    """The running asyncio event loop, or the default one"""
+    try:
+        return asyncio.get_running_loop()
+    except (AttributeError, RuntimeError):
+        return asyncio.get_event_loop()
+
+
+def _run_off_loop(instance, function, timeout=None, cancel=None):
+    """Run a blocking test on a thread of its own without blocking asyncio
+
+    Cancelling the returned awaitable, or running into the timeout, stops
+    the test running on the thread.
+
+    :param instance: the :class:`IPerf3` instance running the test
+    :param function: the blocking function running the test
+    :param timeout: optional timeout in seconds
+    :param cancel: optional function stopping the test, the _abort method
+        of instance by default
+    :rtype: awaitable returning the result of function
+    """
+    if asyncio is None:
+        raise RuntimeError('asyncio is not available')
+
+    loop = _get_event_loop()
+    future = loop.create_future()
+
+    def set_result(result):
+        if not future.done():
+            future.set_result(result)
+
+    def set_exception(exception):
+        if not future.done():
+            future.set_exception(exception)
+
+    def target():
+        try:
+            result = function()
+        except BaseException as e:
+            callback, argument = set_exception, e
+        else:
+            callback, argument = set_result, result
+
+        try:
+            loop.call_soon_threadsafe(callback, argument)
+        except RuntimeError:
+            # The event loop has been closed in the meantime
+            pass
+
+    def cancel_test(future):
+        if future.cancelled():
+            (cancel or instance._abort)()
+
+    future.add_done_callback(cancel_test)
+
+    t = threading.Thread(target=target)
+    t.daemon = True
+    t.start()
+
+    if timeout is not None:
+        return asyncio.wait_for(future, timeout)
+    return future
+
+
+def _c_string(value):
+    """A unicode string as argument of libiperf"""
+    return c_char_p(value.encode('utf-8'))
+
+
+def _py_string(value):
+    """A string returned by libiperf as unicode string, None when empty"""
+    return value.decode('utf-8') if value else None
+
+
+def _c_char(value):
+    """A one character unicode string as argument of libiperf"""
+    return c_char(value.encode('utf-8'))
+
+
+def _py_char(value):
+    """A character returned by libiperf as unicode string"""
+    if isinstance(value, int):
+        value = chr(value).encode('utf-8')
+    return value.decode('utf-8')
+
+
+def _protocol_id(protocol):
+    """The socket type libiperf identifies a protocol name with"""
+    return int(SOCK_DGRAM if protocol == 'udp' else SOCK_STREAM)
+
+
+def _protocol_name(protocol_id):
+    """The protocol name of a socket type returned by libiperf"""
+    return 'udp' if protocol_id == SOCK_DGRAM else 'tcp'
+
+
+class _ClosedLibrary(object):
+    """Stands in for libiperf on a closed :class:`IPerf3` instance, so using
+    the instance raises instead of handing a freed struct to libiperf"""
+
+    def __getattr__(self, name):
+        raise ValueError('The iperf3 instance has been closed')
+
+
 class IPerf3(object):
     """The base class used by both the iperf3 :class:`Server` and :class:`Client`
 
     .. note:: You should not use this class directly
     """
+
+    # Settings mirrored in Python, in the order they are written to the
+    # iperf_test struct, see apply(). (name, libiperf getter, libiperf
+    # setter, convert to libiperf, convert from libiperf)
+    _SETTINGS = (
+        ('role', 'iperf_get_test_role', 'iperf_set_test_role',
+         _c_char, _py_char),
+        ('bind_address', 'iperf_get_test_bind_address',
+         'iperf_set_test_bind_address', _c_string, _py_string),
+        ('port', 'iperf_get_test_server_port', 'iperf_set_test_server_port',
+         int, int),
+        ('json_output', 'iperf_get_test_json_output',
+         'iperf_set_test_json_output', int, bool),
+        ('verbose', 'iperf_get_verbose', 'iperf_set_verbose', int, bool),
+    )
+
     def __init__(self,
                  role,
                  verbose=True,
@@ -96,112 +986,42 @@ class IPerf3(object):
         :param verbose: enable verbose output
         :param lib_name: optional name and path for libiperf.so.0 library
         """
-        if lib_name is None:
-            lib_name = util.find_library('libiperf')
-            if lib_name is None:
-                # If we still couldn't find it lets try the manual approach
-                lib_name = 'libiperf.so.0'
-
-        try:
-            self.lib = cdll.LoadLibrary(lib_name)
-        except OSError:
-            raise OSError(
-                "Couldn't find shared library {}, is iperf3 installed?".format(
-                    lib_name
-                )
-            )
+        # stdout/strerr redirection variables, only used when libiperf
+        # can't write the test output to a file of its own
+        self._stdout_fd = None
+        self._stderr_fd = None
+        self._pipe_out = None
+        self._pipe_in = None
+        self._pipe_reader = None
 
-        # Set the appropriate C types.
-        self.lib.iperf_client_end.restype = c_int
-        self.lib.iperf_client_end.argtypes = (c_void_p,)
-        self.lib.iperf_free_test.restxpe = None
-        self.lib.iperf_free_test.argtypes = (c_void_p,)
-        self.lib.iperf_new_test.restype = c_void_p
-        self.lib.iperf_new_test.argtypes = None
-        self.lib.iperf_defaults.restype = c_int
-        self.lib.iperf_defaults.argtypes = (c_void_p,)
-        self.lib.iperf_get_test_role.restype = c_char
-        self.lib.iperf_get_test_role.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_role.restype = None
-        self.lib.iperf_set_test_role.argtypes = (c_void_p, c_char,)
-        self.lib.iperf_get_test_bind_address.restype = c_char_p
-        self.lib.iperf_get_test_bind_address.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_bind_address.restype = None
-        self.lib.iperf_set_test_bind_address.argtypes = (c_void_p, c_char_p,)
-        self.lib.iperf_get_test_server_port.restype = c_int
-        self.lib.iperf_get_test_server_port.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_server_port.restype = None
-        self.lib.iperf_set_test_server_port.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_get_test_json_output.restype = c_int
-        self.lib.iperf_get_test_json_output.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_json_output.restype = None
-        self.lib.iperf_set_test_json_output.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_get_verbose.restype = c_int
-        self.lib.iperf_get_verbose.argtypes = (c_void_p,)
-        self.lib.iperf_set_verbose.restype = None
-        self.lib.iperf_set_verbose.argtypes = (c_void_p, c_int)
-        self.lib.iperf_strerror.restype = c_char_p
-        self.lib.iperf_strerror.argtypes = (c_int,)
-        self.lib.iperf_get_test_server_hostname.restype = c_char_p
-        self.lib.iperf_get_test_server_hostname.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_server_hostname.restype = None
-        self.lib.iperf_set_test_server_hostname.argtypes = (
-            c_void_p, c_char_p,
-        )
-        self.lib.iperf_get_test_protocol_id.restype = c_int
-        self.lib.iperf_get_test_protocol_id.argtypes = (c_void_p,)
-        self.lib.set_protocol.restype = c_int
-        self.lib.set_protocol.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_get_test_omit.restype = c_int
-        self.lib.iperf_get_test_omit.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_omit.restype = None
-        self.lib.iperf_set_test_omit.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_get_test_duration.restype = c_int
-        self.lib.iperf_get_test_duration.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_duration.restype = None
-        self.lib.iperf_set_test_duration.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_get_test_rate.restype = c_uint64
-        self.lib.iperf_get_test_rate.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_rate.restype = None
-        self.lib.iperf_set_test_rate.argtypes = (c_void_p, c_uint64,)
-        self.lib.iperf_get_test_blksize.restype = c_int
-        self.lib.iperf_get_test_blksize.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_blksize.restype = None
-        self.lib.iperf_set_test_blksize.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_get_test_num_streams.restype = c_int
-        self.lib.iperf_get_test_num_streams.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_num_streams.restype = None
-        self.lib.iperf_set_test_num_streams.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_has_zerocopy.restype = c_int
-        self.lib.iperf_has_zerocopy.argtypes = None
-        self.lib.iperf_set_test_zerocopy.restype = None
-        self.lib.iperf_set_test_zerocopy.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_get_test_reverse.restype = c_int
-        self.lib.iperf_get_test_reverse.argtypes = (c_void_p,)
-        self.lib.iperf_set_test_reverse.restype = None
-        self.lib.iperf_set_test_reverse.argtypes = (c_void_p, c_int,)
-        self.lib.iperf_run_client.restype = c_int
-        self.lib.iperf_run_client.argtypes = (c_void_p,)
-        self.lib.iperf_run_server.restype = c_int
-        self.lib.iperf_run_server.argtypes = (c_void_p,)
-        self.lib.iperf_reset_test.restype = None
-        self.lib.iperf_reset_test.argtypes = (c_void_p,)
+        # (path, read fd, write fd) of the FIFO libiperf writes the output
+        # of this instance to, opened by libiperf once and never switched
+        self._fifo = None
 
-        try:
-            # Only available from iperf v3.1 and onwards
-            self.lib.iperf_get_test_json_output_string.restype = c_char_p
-            self.lib.iperf_get_test_json_output_string.argtypes = (c_void_p,)
-        except AttributeError:
-            pass
+        self.lib = load_library(lib_name)
+        self.capabilities = _capabilities[self.lib]
 
         # The test C struct iperf_test
         self._test = self._new()
         self.defaults()
 
-        # stdout/strerr redirection variables
-        self._stdout_fd = os.dup(1)
-        self._stderr_fd = os.dup(2)
-        self._pipe_out, self._pipe_in = os.pipe()  # no need for pipe write
+        # Only one test runs on the iperf_test struct at a time, _abort may
+        # only touch the struct while a test is running
+        self._run_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._running = False
+
+        # Seconds after which a running test is stopped, None lets the test
+        # run until libiperf returns
+        self.max_runtime = None
+
+        self._own_output = self.capabilities.own_output
+
+        if not self._own_output:
+            self._stdout_fd = os.dup(1)
+            self._stderr_fd = os.dup(2)
+            self._pipe_out, self._pipe_in = os.pipe()
+            self._pipe_reader = PipeReader(self._pipe_out)
 
         # Generic test settings
         self.role = role
@@ -210,27 +1030,54 @@ class IPerf3(object):
 
     def __del__(self):
         """Cleanup the test after the :class:`IPerf3` class is terminated"""
-        os.close(self._stdout_fd)
-        os.close(self._stderr_fd)
-        os.close(self._pipe_out)
-        os.close(self._pipe_in)
-
         try:
-            # In the current version of libiperf, the control socket isn't
-            # closed on iperf_client_end(), see proposed pull request:
-            # https://github.com/esnet/iperf/pull/597
-            # Workaround for testing, don't ever do this..:
-            #
-            # sck=self.lib.iperf_get_control_socket(self._test)
-            # os.close(sck)
-
-            self.lib.iperf_client_end(self._test)
-            self.lib.iperf_free_test(self._test)
+            self.close()
         except AttributeError:
             # self.lib doesn't exist, likely because iperf3 wasn't installed or
             # the shared library libiperf.so.0 could not be found
             pass
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Free the iperf_test struct and the file descriptors of the instance
+
+        Called when leaving a ``with`` block, or otherwise when the instance
+        is garbage collected. A closed instance can't run tests anymore.
+        """
+        for name in ('_stdout_fd', '_stderr_fd', '_pipe_out', '_pipe_in'):
+            fd = getattr(self, name)
+            if fd is not None:
+                os.close(fd)
+                setattr(self, name, None)
+
+        if self._fifo is not None:
+            path, read_fd, write_fd = self._fifo
+            os.close(read_fd)
+            os.close(write_fd)
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            self._fifo = None
+
+        if getattr(self, '_test', None) is None:
+            return
+
+        # In the current version of libiperf, the control socket isn't
+        # closed on iperf_client_end(), see proposed pull request:
+        # https://github.com/esnet/iperf/pull/597
+        # Workaround for testing, don't ever do this..:
+        #
+        # sck=self.lib.iperf_get_control_socket(self._test)
+        # os.close(sck)
+
+        self.lib.iperf_client_end(self._test)
+        self.lib.iperf_free_test(self._test)
+        self._test = None
+        self.lib = _ClosedLibrary()
+
     def _new(self):
         """Initialise a new iperf test
 
@@ -241,6 +1088,7 @@ class IPerf3(object):
     def defaults(self):
         """Set/reset iperf test defaults."""
         self.lib.iperf_defaults(self._test)
+        self._load_settings()
 
     @property
     def role(self):
@@ -250,24 +1098,12 @@ class IPerf3(object):
 
         :rtype: 'c' or 's'
         """
-        try:
-            self._role = c_char(
-                self.lib.iperf_get_test_role(self._test)
-            ).value.decode('utf-8')
-        except TypeError:
-            self._role = c_char(
-                chr(self.lib.iperf_get_test_role(self._test))
-            ).value.decode('utf-8')
-        return self._role
+        return self._settings['role']
 
     @role.setter
     def role(self, role):
         if role.lower() in ['c', 's']:
-            self.lib.iperf_set_test_role(
-                self._test,
-                c_char(role.lower().encode('utf-8'))
-            )
-            self._role = role
+            self._set('role', role.lower())
         else:
             raise ValueError("Unknown role, accepted values are 'c' and 's'")
 
@@ -278,34 +1114,20 @@ class IPerf3(object):
         use * to listen on all available IPs
         :rtype: string
         """
-        result = c_char_p(
-            self.lib.iperf_get_test_bind_address(self._test)
-        ).value
-        if result:
-            self._bind_address = result.decode('utf-8')
-        else:
-            self._bind_address = '*'
-
-        return self._bind_address
+        return self._settings['bind_address'] or '*'
 
     @bind_address.setter
     def bind_address(self, address):
-        self.lib.iperf_set_test_bind_address(
-            self._test,
-            c_char_p(address.encode('utf-8'))
-        )
-        self._bind_address = address
+        self._set('bind_address', address)
 
     @property
     def port(self):
         """The port the iperf3 server is listening on"""
-        self._port = self.lib.iperf_get_test_server_port(self._test)
-        return self._port
+        return self._settings['port']
 
     @port.setter
     def port(self, port):
-        self.lib.iperf_set_test_server_port(self._test, int(port))
-        self._port = port
+        self._set('port', int(port))
 
     @property
     def json_output(self):
@@ -316,23 +1138,11 @@ class IPerf3(object):
 
         :rtype: bool
         """
-        enabled = self.lib.iperf_get_test_json_output(self._test)
-
-        if enabled:
-            self._json_output = True
-        else:
-            self._json_output = False
-
-        return self._json_output
+        return self._settings['json_output']
 
     @json_output.setter
     def json_output(self, enabled):
-        if enabled:
-            self.lib.iperf_set_test_json_output(self._test, 1)
-        else:
-            self.lib.iperf_set_test_json_output(self._test, 0)
-
-        self._json_output = enabled
+        self._set('json_output', bool(enabled))
 
     @property
     def verbose(self):
@@ -340,40 +1150,127 @@ class IPerf3(object):
 
         :rtype: bool
         """
-        enabled = self.lib.iperf_get_verbose(self._test)
-
-        if enabled:
-            self._verbose = True
-        else:
-            self._verbose = False
-
-        return self._verbose
+        return self._settings['verbose']
 
     @verbose.setter
     def verbose(self, enabled):
-        if enabled:
-            self.lib.iperf_set_verbose(self._test, 1)
-        else:
-            self.lib.iperf_set_verbose(self._test, 0)
-        self._verbose = enabled
+        self._set('verbose', bool(enabled))
+
+    def _set(self, name, value):
+        """Change a setting, see :meth:`apply`
+
+        :param name: name of the setting
+        :param value: the new value
+        """
+        self._settings[name] = value
+        self._changed.add(name)
+
+    def _load_settings(self):
+        """Read the settings from the iperf_test struct once"""
+        self._settings = dict.fromkeys(
+            [setting[0] for setting in self._SETTINGS]
+        )
+        self._changed = set()
+        for name, getter, _, _, from_c in self._SETTINGS:
+            if getter is not None and hasattr(self.lib, getter):
+                self._settings[name] = from_c(
+                    getattr(self.lib, getter)(self._test)
+                )
+
+    def apply(self):
+        """Write the changed settings to the iperf_test struct.
+
+        The settings are kept in Python, reading them doesn't call into
+        libiperf. Changes are written to libiperf in one go when the next
+        test starts, or when apply is called.
+        """
+        if not self._changed:
+            return
+
+        changed, self._changed = self._changed, set()
+        for name, _, setter, to_c, _ in self._SETTINGS:
+            if name in changed:
+                value = self._settings[name]
+                if value is not None:
+                    getattr(self.lib, setter)(self._test, to_c(value))
+
+    def to_config(self):
+        """The settings of the instance, see :meth:`from_config`
+
+        :rtype: dict of setting names and values, without the role and
+            unset settings
+        """
+        return dict(
+            (name, value) for name, value in self._settings.items()
+            if value is not None and name != 'role'
+        )
+
+    @classmethod
+    def from_config(cls, config, lib_name=None):
+        """Create an instance with the settings of a dict.
+
+        Basic Usage::
+
+          >>> client = iperf3.Client.from_config(
+          ...     {'server_hostname': '10.0.0.1', 'duration': 5})
+          >>> client.to_config()
+          {'server_hostname': '10.0.0.1', 'duration': 5, 'port': 5201, ...}
+
+        :param config: dict of attributes, like the settings returned by
+            :meth:`to_config`
+        :param lib_name: optional name and path for libiperf.so.0 library
+        :rtype: instance of cls
+        """
+        instance = cls(lib_name=lib_name)
+        for name, value in config.items():
+            if not hasattr(instance, name):
+                raise ValueError('Unknown setting {0}'.format(name))
+            setattr(instance, name, value)
+        instance.apply()
+        return instance
+
+    def _reset(self):
+        """Reset the iperf_test struct after a test
+
+        iperf_reset_test frees what the test left behind, also when it has
+        been stopped, but restores the defaults of most settings and the
+        server role as well. These are written to libiperf again before the
+        next test, the strings are kept by the reset.
+        """
+        self.lib.iperf_reset_test(self._test)
+        self._changed.update(
+            name for name, _, _, to_c, _ in self._SETTINGS
+            if to_c is not _c_string
+        )
 
     @property
     def _errno(self):
         """Returns the last error ID
 
+        libiperf keeps it in the global i_errno, which is shared by all tests
+        in the process. A test failing on another thread at the same time
+        may have overwritten it.
+
         :rtype: int
         """
         return c_int.in_dll(self.lib, "i_errno").value
 
+    def _test_state(self):
+        """Returns the state of the iperf_test struct, see iperf.h
+
+        :rtype: int, None when libiperf doesn't export it
+        """
+        if not self.capabilities.test_state:
+            return None
+        return self.lib.iperf_get_test_state(self._test)
+
     @property
     def iperf_version(self):
         """Returns the version of the libiperf library
 
         :rtype: string
         """
-        # TODO: Is there a better way to get the const char than allocating 30?
-        VersionType = c_char * 30
-        return VersionType.in_dll(self.lib, "version").value.decode('utf-8')
+        return self.capabilities.version
 
     def _error_to_string(self, error_id):
         """Returns an error string from libiperf
@@ -381,19 +1278,331 @@ class IPerf3(object):
         :param error_id: The error_id produced by libiperf
         :rtype: string
         """
-        strerror = self.lib.iperf_strerror
-        strerror.restype = c_char_p
-        return strerror(error_id).decode('utf-8')
+        # iperf_strerror formats the message in a static buffer
+        with _strerror_lock:
+            return self.lib.iperf_strerror(error_id).decode('utf-8')
 
-    def run(self):
-        """Runs the iperf3 instance.
-
-        This function has to be instantiated by the Client and Server
-        instances
+    def _server_busy(self, result):
+        """Whether a test failed because the server was running another test
 
-        :rtype: NotImplementedError
+        :param result: instance of :class:`TestResult`
+        :rtype: bool
         """
-        raise NotImplementedError
+        error = result.error if result is not None else None
+        return bool(error) and \
+            self._error_to_string(IEACCESSDENIED) in error
+
+    def _call(self, run):
+        """Run the test on the iperf_test struct
+
+        :param run: iperf_run_client or iperf_run_server
+        :rtype: the return value of run
+        """
+        self.apply()
+        with self._state_lock:
+            self._running = True
+
+        outfile = None
+        if self._fifo is not None:
+            outfile = self.lib.iperf_get_test_outfile(self._test)
+
+        done = None
+        if self.max_runtime is not None:
+            done = threading.Event()
+            watchdog = threading.Thread(
+                target=self._watchdog, args=(done, self.max_runtime)
+            )
+            watchdog.daemon = True
+            watchdog.start()
+
+        try:
+            return run(self._test)
+        finally:
+            with self._state_lock:
+                self._running = False
+            if done is not None:
+                done.set()
+            if outfile and \
+                    outfile != self.lib.iperf_get_test_outfile(self._test):
+                # Some releases open the logfile again on every run and
+                # leave the file of the previous run open
+                _fclose(outfile)
+
+    def _watchdog(self, done, max_runtime):
+        """Stop the test once it runs longer than max_runtime seconds
+
+        A client that is still connecting can't be stopped yet, so stopping
+        is retried until the test returns.
+
+        :param done: event set when the test has returned
+        :param max_runtime: seconds the test may run
+        """
+        if done.wait(max_runtime):
+            return
+        while not done.is_set():
+            self._abort()
+            done.wait(WATCHDOG_RETRY_INTERVAL)
+
+    def cancel(self):
+        """Stop the running test from another thread.
+
+        The test returns promptly with an error, and with the output
+        gathered until it stopped when libiperf provides it. The instance
+        can run the next test right away.
+
+        :rtype: True if a test was running and has been told to stop
+        """
+        return self._abort()
+
+    def _abort(self):
+        """Stop the test that is currently running
+
+        Shuts down the control connection of the test, after which libiperf
+        returns from iperf_run_client or iperf_run_server with an error. A
+        server still waiting for a client is woken up by connecting to it.
+
+        :rtype: True if the running test has been told to stop
+        """
+        with self._state_lock:
+            if not self._running:
+                return False
+
+            ctrl_sck = -1
+            if self.capabilities.control_socket:
+                ctrl_sck = self.lib.iperf_get_control_socket(self._test)
+            if ctrl_sck >= 0:
+                # fromfd duplicates the descriptor, shutting down the copy
+                # shuts down the connection libiperf is using
+                sck = socket.fromfd(ctrl_sck, socket.AF_INET, SOCK_STREAM)
+                try:
+                    sck.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+                finally:
+                    sck.close()
+                return True
+
+            if self.role == 's':
+                host = self.bind_address
+                if host == '*':
+                    host = 'localhost'
+                try:
+                    socket.create_connection((host, self.port), 1).close()
+                except socket.error:
+                    return False
+                return True
+
+            return False
+
+    def _run_test(self, run):
+        """Run the test and capture its json output
+
+        libiperf writes the output of the test to a file of its own when
+        it supports it, so several tests can run in one process at the same
+        time. Older versions write to stdout, which is then redirected to a
+        pipe for the duration of the test. Only one such test runs at a
+        time.
+
+        :param run: iperf_run_client or iperf_run_server
+        :rtype: the json output as bytes
+        """
+        with self._run_lock:
+            return self._capture(run)
+
+    def _capture(self, run):
+        """Run the test and capture its json output, see :meth:`_run_test`
+
+        :param run: iperf_run_client or iperf_run_server
+        :rtype: the json output as bytes
+        """
+        if self._own_output:
+            # The json output is read back from libiperf directly, what
+            # libiperf writes to the FIFO is only drained
+            error, error_id = self._call_draining(run, _discard)
+            data = self._json_output()
+        else:
+            with _stdout_lock:
+                self._pipe_reader.start()
+                output_to_pipe(self._pipe_in)  # disable stdout
+                error = self._call(run)
+                error_id = self._errno if error else 0
+                output_to_screen(self._stdout_fd, self._stderr_fd)
+                output = self._pipe_reader.stop()
+
+            if self.role == 's' or not self.capabilities.json_output_string:
+                data = output
+                if data.startswith(b'Control connection'):
+                    data = b'{' + data.split(b'{', 1)[1]
+            else:
+                data = self._json_output()
+
+        # i_errno is shared by all tests in the process, so it is read right
+        # after the test returns. The error libiperf adds to the json output
+        # of the failed test itself is preferred when it is there.
+        if not data or (error and b'"error"' not in data):
+            data = self._error_output(error_id)
+
+        return data
+
+    def _json_output(self):
+        """The json output of the last test, copied out of libiperf once
+
+        :rtype: bytes, empty when there is no output
+        """
+        pointer = self.lib.iperf_get_test_json_output_string(self._test)
+        return string_at(pointer) if pointer else b''
+
+    def _error_output(self, error_id):
+        """The json output of a failed test
+
+        :param error_id: the libiperf error number
+        :rtype: bytes
+        """
+        return ('{"error": "%s"}' % self._error_to_string(error_id)).encode(
+            'utf-8'
+        )
+
+    def _output(self):
+        """The FIFO libiperf writes the output of this instance to
+
+        The FIFO is created the first time it is needed and opened once by
+        libiperf. It stays the logfile of the iperf_test struct until the
+        instance is closed, switching the logfile would open another file
+        every time.
+
+        :rtype: the read fd of the FIFO
+        """
+        if self._fifo is None:
+            directory = tempfile.mkdtemp(prefix='iperf3-')
+            path = os.path.join(directory, 'output')
+            os.mkfifo(path)
+            read_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            # Keeping the FIFO open for writing ourselves means the reader
+            # never sees an end of file, whoever else opens or closes it
+            write_fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+
+            self.lib.iperf_set_test_logfile(
+                self._test,
+                c_char_p(path.encode('utf-8'))
+            )
+            if self.lib.iperf_open_logfile(self._test) < 0:
+                os.close(read_fd)
+                os.close(write_fd)
+                shutil.rmtree(directory, ignore_errors=True)
+                raise OSError(self._error_to_string(self._errno))
+            self._fifo = (path, read_fd, write_fd)
+        return self._fifo[1]
+
+    def _call_draining(self, run, callback):
+        """Run the test while the FIFO of this instance is drained
+
+        :param run: iperf_run_client or iperf_run_server
+        :param callback: function called with every chunk of bytes libiperf
+            writes to the FIFO
+        :rtype: tuple of (return value of run, libiperf error number)
+        """
+        reader = PipeReader(self._output(), callback=callback)
+        reader.start()
+        try:
+            error = self._call(run)
+            return error, self._errno if error else 0
+        finally:
+            reader.stop()
+
+    def _run_streaming(self, run, on_interval=None, keep_intervals=True):
+        """Run the test and hand every interval to on_interval as it arrives
+
+        libiperf 3.17 and later hand every json stream event to a callback.
+        libiperf 3.10 and later write the json stream to the FIFO of this
+        instance, which is read while the test runs. Older versions can't
+        report intervals before the test has finished, on_interval is then
+        called for every interval afterwards.
+
+        An exception raised by on_interval stops the test and is raised
+        again once libiperf has returned.
+
+        :param run: iperf_run_client or iperf_run_server
+        :param on_interval: function called with every interval as a dict,
+            with the same contents as an entry of the intervals in the json
+            output
+        :param keep_intervals: keep the intervals in the json output
+        :rtype: the json output as a unicode string
+        """
+        stream = _JSONStream(on_interval, keep_intervals)
+
+        def event(line):
+            stream.event(line)
+            if stream.exception is not None:
+                self._abort()
+
+        def feed(data):
+            stream.feed(data)
+            if stream.exception is not None:
+                self._abort()
+
+        with self._run_lock:
+            if self.capabilities.streaming == 'callback':
+                callback = _JSON_CALLBACK(lambda test, line: event(line))
+                self.lib.iperf_set_test_json_stream(self._test, 1)
+                self.lib.iperf_set_test_json_callback(
+                    self._test, cast(callback, c_void_p)
+                )
+                try:
+                    error = self._call(run)
+                    error_id = self._errno if error else 0
+                finally:
+                    self.lib.iperf_set_test_json_callback(self._test, None)
+                    self.lib.iperf_set_test_json_stream(self._test, 0)
+
+            elif self.capabilities.streaming == 'fifo':
+                self.lib.iperf_set_test_json_stream(self._test, 1)
+                try:
+                    error, error_id = self._call_draining(run, feed)
+                finally:
+                    self.lib.iperf_set_test_json_stream(self._test, 0)
+
+            else:
+                data = self._capture(run)
+                if on_interval is not None:
+                    try:
+                        for interval in _load_json(data).get('intervals', []):
+                            on_interval(interval)
+                    except StopTest:
+                        pass
+                return data if keep_intervals else _skip_intervals(data)
+
+        if isinstance(stream.exception, StopTest):
+            if 'start' in stream.document:
+                return stream.stopped_text
+        elif stream.exception is not None:
+            raise stream.exception
+
+        data = stream.text
+        if not data or (error and 'error' not in stream.document):
+            data = self._error_output(error_id)
+
+        return data
+
+    def _run_to_screen(self, run):
+        """Run the test and let its output go to stdout
+
+        :param run: iperf_run_client or iperf_run_server
+        :rtype: the return value of run
+        """
+        if self._fifo is None:
+            # libiperf still writes to stdout
+            return self._call(run)
+        return self._call_draining(run, _write_stdout)[0]
+
+    def run(self):
+        """Runs the iperf3 instance.
+
+        This function has to be instantiated by the Client and Server
+        instances
+
+        :rtype: NotImplementedError
+        """
+        raise NotImplementedError
 
 
 class Client(IPerf3):
@@ -417,16 +1626,26 @@ class Client(IPerf3):
         """Initialise the iperf shared library"""
         super(Client, self).__init__(role='c', *args, **kwargs)
 
-        # Internal variables
-        self._blksize = None
-        self._server_hostname = None
-        self._port = None
-        self._num_streams = None
-        self._zerocopy = False
-        self._omit = None
-        self._duration = None
-        self._bandwidth = None
-        self._protocol = None
+    _SETTINGS = IPerf3._SETTINGS + (
+        ('server_hostname', 'iperf_get_test_server_hostname',
+         'iperf_set_test_server_hostname', _c_string, _py_string),
+        ('protocol', 'iperf_get_test_protocol_id', 'set_protocol',
+         _protocol_id, _protocol_name),
+        ('omit', 'iperf_get_test_omit', 'iperf_set_test_omit', int, int),
+        ('duration', 'iperf_get_test_duration', 'iperf_set_test_duration',
+         int, int),
+        ('bandwidth', 'iperf_get_test_rate', 'iperf_set_test_rate',
+         int, int),
+        ('blksize', 'iperf_get_test_blksize', 'iperf_set_test_blksize',
+         int, int),
+        ('num_streams', 'iperf_get_test_num_streams',
+         'iperf_set_test_num_streams', int, int),
+        ('zerocopy', None, 'iperf_set_test_zerocopy', int, None),
+        ('reverse', 'iperf_get_test_reverse', 'iperf_set_test_reverse',
+         int, bool),
+        ('connect_timeout', 'iperf_get_test_connect_timeout',
+         'iperf_set_test_connect_timeout', int, int),
+    )
 
     @property
     def server_hostname(self):
@@ -436,22 +1655,11 @@ class Client(IPerf3):
 
         :rtype: string
         """
-        result = c_char_p(
-            self.lib.iperf_get_test_server_hostname(self._test)
-        ).value
-        if result:
-            self._server_hostname = result.decode('utf-8')
-        else:
-            self._server_hostname = None
-        return self._server_hostname
+        return self._settings['server_hostname'] or None
 
     @server_hostname.setter
     def server_hostname(self, hostname):
-        self.lib.iperf_set_test_server_hostname(
-            self._test,
-            c_char_p(hostname.encode('utf-8'))
-        )
-        self._server_hostname = hostname
+        self._set('server_hostname', hostname)
 
     @property
     def protocol(self):
@@ -461,65 +1669,49 @@ class Client(IPerf3):
 
         :rtype: str
         """
-        proto_id = self.lib.iperf_get_test_protocol_id(self._test)
-
-        if proto_id == SOCK_STREAM:
-            self._protocol = 'tcp'
-        elif proto_id == SOCK_DGRAM:
-            self._protocol = 'udp'
-
-        return self._protocol
+        return self._settings['protocol']
 
     @protocol.setter
     def protocol(self, protocol):
-        if protocol == 'tcp':
-            self.lib.set_protocol(self._test, int(SOCK_STREAM))
-        elif protocol == 'udp':
-            self.lib.set_protocol(self._test, int(SOCK_DGRAM))
+        if protocol not in ('tcp', 'udp'):
+            raise ValueError(
+                "Unknown protocol, accepted values are 'tcp' and 'udp'")
+        self._set('protocol', protocol)
 
-            if self.blksize > MAX_UDP_BULKSIZE:
-                self.blksize = MAX_UDP_BULKSIZE
-
-        self._protocol = protocol
+        if protocol == 'udp' and self.blksize > MAX_UDP_BULKSIZE:
+            self.blksize = MAX_UDP_BULKSIZE
 
     @property
     def omit(self):
         """The test startup duration to omit in seconds."""
-        self._omit = self.lib.iperf_get_test_omit(self._test)
-        return self._omit
+        return self._settings['omit']
 
     @omit.setter
     def omit(self, omit):
-        self.lib.iperf_set_test_omit(self._test, omit)
-        self._omit = omit
+        self._set('omit', int(omit))
 
     @property
     def duration(self):
         """The test duration in seconds."""
-        self._duration = self.lib.iperf_get_test_duration(self._test)
-        return self._duration
+        return self._settings['duration']
 
     @duration.setter
     def duration(self, duration):
-        self.lib.iperf_set_test_duration(self._test, duration)
-        self._duration = duration
+        self._set('duration', int(duration))
 
     @property
     def bandwidth(self):
         """Target bandwidth in bits/sec"""
-        self._bandwidth = self.lib.iperf_get_test_rate(self._test)
-        return self._bandwidth
+        return self._settings['bandwidth']
 
     @bandwidth.setter
     def bandwidth(self, bandwidth):
-        self.lib.iperf_set_test_rate(self._test, bandwidth)
-        self._bandwidth = bandwidth
+        self._set('bandwidth', int(bandwidth))
 
     @property
     def blksize(self):
         """The test blksize."""
-        self._blksize = self.lib.iperf_get_test_blksize(self._test)
-        return self._blksize
+        return self._settings['blksize']
 
     @blksize.setter
     def blksize(self, bulksize):
@@ -528,8 +1720,7 @@ class Client(IPerf3):
         if self.protocol == 'udp' and bulksize > MAX_UDP_BULKSIZE:
             bulksize = MAX_UDP_BULKSIZE
 
-        self.lib.iperf_set_test_blksize(self._test, bulksize)
-        self._blksize = bulksize
+        self._set('blksize', int(bulksize))
 
     @property
     def bulksize(self):
@@ -551,13 +1742,11 @@ class Client(IPerf3):
     @property
     def num_streams(self):
         """The number of streams to use."""
-        self._num_streams = self.lib.iperf_get_test_num_streams(self._test)
-        return self._num_streams
+        return self._settings['num_streams']
 
     @num_streams.setter
     def num_streams(self, number):
-        self.lib.iperf_set_test_num_streams(self._test, number)
-        self._num_streams = number
+        self._set('num_streams', int(number))
 
     @property
     def zerocopy(self):
@@ -571,16 +1760,29 @@ class Client(IPerf3):
 
         :rtype: bool
         """
-        return self._zerocopy
+        return bool(self._settings['zerocopy'])
 
     @zerocopy.setter
     def zerocopy(self, enabled):
-        if enabled and self.lib.iperf_has_zerocopy():
-            self.lib.iperf_set_test_zerocopy(self._test, 1)
-            self._zerocopy = True
-        else:
-            self.lib.iperf_set_test_zerocopy(self._test, 0)
-            self._zerocopy = False
+        self._set('zerocopy', bool(enabled and self.lib.iperf_has_zerocopy()))
+
+    @property
+    def connect_timeout(self):
+        """Milliseconds to wait for the control connection to the server.
+
+        Requires libiperf 3.10 or later, see :class:`Capabilities`. On
+        older versions the timeout of the operating system applies and this
+        is None.
+
+        :rtype: int, -1 when the timeout of the operating system applies
+        """
+        return self._settings['connect_timeout']
+
+    @connect_timeout.setter
+    def connect_timeout(self, timeout):
+        if self.capabilities.connect_timeout:
+            self._set('connect_timeout',
+                      -1 if timeout is None else int(timeout))
 
     @property
     def reverse(self):
@@ -588,297 +1790,3701 @@ class Client(IPerf3):
 
         :rtype: bool
         """
-        enabled = self.lib.iperf_get_test_reverse(self._test)
-
-        if enabled:
-            self._reverse = True
-        else:
-            self._reverse = False
-
-        return self._reverse
+        return self._settings['reverse']
 
     @reverse.setter
     def reverse(self, enabled):
-        if enabled:
-            self.lib.iperf_set_test_reverse(self._test, 1)
-        else:
-            self.lib.iperf_set_test_reverse(self._test, 0)
-
-        self._reverse = enabled
+        self._set('reverse', bool(enabled))
 
-    def run(self):
+    def run(self, on_interval=None, keep_intervals=True):
         """Run the current test client.
 
+        Basic Usage::
+
+          >>> def show(interval):
+          ...     print(interval['sum']['bits_per_second'])
+
+          >>> client.run(on_interval=show)
+          9.50062e+08
+          ...
+
+        Long tests can run in constant memory by not keeping the intervals
+        and folding them into an :class:`IntervalAggregate` or another
+        on_interval function instead::
+
+          >>> aggregate = iperf3.IntervalAggregate()
+          >>> result = client.run(on_interval=aggregate, keep_intervals=False)
+
+        The iperf_test struct is reset after every test and keeps the
+        settings of the client, so the client can run the same test again,
+        see :class:`ClientCache`.
+
+        :param on_interval: optional function called with every interval
+            (a dict like the entries of the json intervals) while the test
+            runs. Requires libiperf 3.10 or later, older versions call it
+            for every interval once the test has finished. Raising
+            :class:`StopTest` from on_interval stops the test, any other
+            exception stops the test and is raised by run.
+        :param keep_intervals: keep the intervals in the result. When False
+            the result has no intervals, and with libiperf 3.10 or later
+            neither libiperf nor this module hold on to them while the test
+            runs.
         :rtype: instance of :class:`TestResult`
         """
         if self.json_output:
-            output_to_pipe(self._pipe_in)  # Disable stdout
-            error = self.lib.iperf_run_client(self._test)
+            try:
+                if on_interval is not None or not keep_intervals:
+                    return TestResult(self._run_streaming(
+                        self.lib.iperf_run_client, on_interval, keep_intervals
+                    ))
+                return TestResult(self._run_test(self.lib.iperf_run_client))
+            finally:
+                if self._test is not None:
+                    self._reset()
+
+    def run_until_stable(self, window=5, max_cv=0.05, on_interval=None):
+        """Run the current test client until the throughput has converged.
+
+        The test is stopped as soon as the coefficient of variation
+        (standard deviation / mean) of the throughput of the last ``window``
+        intervals drops below ``max_cv``. The test runs for at most
+        :attr:`duration` seconds. Omitted intervals are not taken into
+        account.
+
+        Requires libiperf 3.10 or later, older versions always run the
+        full duration.
+
+        Basic Usage::
+
+          >>> client.duration = 60
+          >>> result = client.run_until_stable(window=5, max_cv=0.05)
+          >>> result.stopped_early, result.sent_Mbps
+          (True, 935.992)
+
+        :param window: amount of intervals the criterion is computed over
+        :param max_cv: the coefficient of variation below which the
+            throughput is considered stable
+        :param on_interval: optional function called with every interval,
+            see :meth:`run`
+        :rtype: instance of :class:`TestResult`, with ``stopped_early`` set
+            when the test was stopped before the end of its duration
+        """
+        if window < 2:
+            raise ValueError('window must be >= 2')
 
-            if not self.iperf_version.startswith('iperf 3.1'):
-                data = read_pipe(self._pipe_out)
-                if data.startswith('Control connection'):
-                    data = '{' + data.split('{', 1)[1]
-            else:
-                data = c_char_p(
-                    self.lib.iperf_get_test_json_output_string(self._test)
-                ).value
-                if data:
-                    data = data.decode('utf-8')
+        throughput = deque(maxlen=window)
 
-            output_to_screen(self._stdout_fd, self._stderr_fd)  # enable stdout
+        def check(interval):
+            if on_interval is not None:
+                on_interval(interval)
 
-            if not data or error:
-                data = '{"error": "%s"}' % self._error_to_string(self._errno)
+            if interval['sum'].get('omitted'):
+                return
 
-            return TestResult(data)
+            throughput.append(interval['sum']['bits_per_second'])
+            if len(throughput) < window:
+                return
 
+            mean = sum(throughput) / float(window)
+            if not mean:
+                return
 
-class Server(IPerf3):
-    """An iperf3 server connection.
+            variance = sum((bps - mean) ** 2 for bps in throughput) / window
+            if variance ** .5 / mean < max_cv:
+                raise StopTest()
 
-    This starts an iperf3 server session. The server terminates after each
-    succesful client connection so it might be useful to run Server.run()
-    in a loop.
+        return self.run(on_interval=check)
 
-    The C function iperf_run_server is called in a seperate thread to make
-    sure KeyboardInterrupt(aka ctrl+c) can still be captured
+    def stream(self):
+        """Run the current test client, yielding intervals while it runs.
 
-    Basic Usage::
+        The test runs on a background thread. Call
+        :meth:`IntervalStream.close` to stop the test early.
 
-      >>> import iperf3
+        Basic Usage::
 
-      >>> server = iperf3.Server()
-      >>> server.run()
-      {'start': {...
-    """
+          >>> stream = client.stream()
+          >>> for interval in stream:
+          ...     print(interval['sum']['bits_per_second'])
+          9.50062e+08
+          ...
+          >>> stream.result
+          {'start': {...
 
-    def __init__(self, *args, **kwargs):
-        """Initialise the iperf3 server instance"""
-        super(Server, self).__init__(role='s', *args, **kwargs)
+        :rtype: instance of :class:`IntervalStream`
+        """
+        return IntervalStream(self)
 
-    def run(self):
-        """Run the iperf3 server instance.
+    def run_async(self, timeout=None):
+        """Run the current test client without blocking the asyncio loop.
 
-        :rtype: instance of :class:`TestResult`
+        libiperf runs on a thread of its own. Cancelling the returned
+        awaitable stops the test.
+
+        Basic Usage::
+
+          >>> result = await client.run_async(timeout=30)
+
+        :param timeout: optional timeout in seconds, raises
+            :class:`asyncio.TimeoutError` when the test takes longer
+        :rtype: awaitable returning an instance of :class:`TestResult`
         """
+        return _run_off_loop(self, self.run, timeout)
 
-        def _run_in_thread(self, data_queue):
-            """Runs the iperf_run_server
 
-            :param data_queue: thread-safe queue
-            """
-            output_to_pipe(self._pipe_in)  # disable stdout
-            error = self.lib.iperf_run_server(self._test)
-            output_to_screen(self._stdout_fd, self._stderr_fd)  # enable stdout
+class IntervalStream(object):
+    """Iterator over the intervals of a running :class:`Client` test.
 
-            # TODO json_output_string not available on earlier iperf3 builds
-            # have to build in a version check using self.iperf_version
-            # The following line should work on later versions:
-            # data = c_char_p(
-            #    self.lib.iperf_get_test_json_output_string(self._test)
-            # ).value
-            data = read_pipe(self._pipe_out)
+    See :meth:`Client.stream`.
 
-            if not data or error:
-                data = '{"error": "%s"}' % self._error_to_string(self._errno)
+    :param result: the :class:`TestResult` of the test, None until the
+        test has finished
+    """
 
-            self.lib.iperf_reset_test(self._test)
-            data_queue.put(data)
+    # Marks the end of the test on the interval queue
+    _done = object()
 
-        if self.json_output:
-            data_queue = Queue()
+    def __init__(self, client):
+        """Start the test
 
-            t = threading.Thread(
-                target=_run_in_thread, args=[self, data_queue]
-            )
-            t.daemon = True
+        :param client: the :class:`Client` to run the test with
+        """
+        self._client = client
+        self._queue = Queue()
+        self._exception = None
+        self.result = None
 
-            t.start()
-            while t.is_alive():
-                t.join(.1)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
 
-            return TestResult(data_queue.get())
-        else:
-            # setting json_output to False will output test to screen only
-            self.lib.iperf_run_server(self._test)
-            self.lib.iperf_reset_test(self._test)
+    def _run(self):
+        try:
+            self.result = self._client.run(on_interval=self._queue.put)
+        except Exception as e:
+            self._exception = e
+        finally:
+            self._queue.put(self._done)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        interval = self._queue.get()
+        if interval is self._done:
+            self._queue.put(self._done)
+            self._thread.join()
+            if self._exception is not None:
+                raise self._exception
+            raise StopIteration
+        return interval
+
+    next = __next__  # Python2 compatibility
+
+    def close(self):
+        """Stop the test and wait for it to finish"""
+        self._client._abort()
+        self._thread.join()
 
-            return None
+    def __del__(self):
+        if self._thread.is_alive():
+            self._client._abort()
 
 
-class TestResult(object):
-    """Class containing iperf3 test results.
+class SoakTest(object):
+    """Runs a client for hours or days, keeping rolling statistics.
 
-    :param text: The raw result from libiperf as text
-    :param json: The raw result from libiperf asjson/dict
-    :param error: Error captured during test, None if all ok
+    The client either runs back to back tests of run_duration seconds, or
+    one long test when run_duration is None. Intervals are streamed and
+    folded into rolling windows, like the last minute, 10 minutes and
+    hour, as they arrive. No interval is kept, every window holds a fixed
+    amount of time buckets with a :class:`QuantileSketch` each, so memory
+    use stays flat however long the soak runs. Streaming requires
+    libiperf 3.10 or later, with older versions the intervals of every
+    test arrive once it has finished.
 
-    :param time: Start time
-    :param timesecs: Start time in seconds
+    Every report_interval seconds on_report is called with the current
+    summary, see :meth:`summary`, also while no intervals arrive because
+    tests fail or hang.
 
-    :param system_info: System info
-    :param version: Iperf Version
+    Basic Usage::
 
-    :param local_host: Local host ip
-    :param local_port: Local port number
-    :param remote_host: Remote host ip
-    :param remote_port: Remote port number
+      >>> def report(summary):
+      ...     hour = summary['windows'][3600]
+      ...     if hour['p5_bits_per_second'] < 100e6:
+      ...         print('throughput collapsed', hour)
 
-    :param reverse: Test ran in reverse direction
-    :param protocol: 'TCP' or 'UDP'
-    :param num_streams: Number of test streams
-    :param blksize:
-    :param omit: Test duration to omit in the beginning in seconds
-    :param duration: Test duration (following omit duration) in seconds
+      >>> soak = iperf3.SoakTest(client, run_duration=600,
+      ...                        on_report=report)
+      >>> soak.run(3 * 24 * 3600)
+    """
 
-    :param local_cpu_total: The local total CPU load
-    :param local_cpu_user: The local user CPU load
-    :param local_cpu_system: The local system CPU load
-    :param remote_cpu_total: The remote total CPU load
-    :param remote_cpu_user: The remote user CPU load
-    :param remote_cpu_system: The remote system CPU load
+    def __init__(self, client, windows=(60, 600, 3600), run_duration=None,
+                 report_interval=60, on_report=None, buckets=60,
+                 relative_accuracy=.02, retry_delay=1, clock=None):
+        """Initialise the soak test
+
+        :param client: the :class:`Client` to run, with json_output enabled
+        :param windows: lengths of the rolling windows in seconds
+        :param run_duration: duration of each test in seconds, None to run
+            a single test for the whole soak
+        :param report_interval: seconds between calls of on_report, counted
+            from the start of :meth:`run`
+        :param on_report: optional function called with the summary
+        :param buckets: amount of time buckets per window, a window covers
+            its length to within one bucket
+        :param relative_accuracy: relative accuracy of the throughput
+            quantiles
+        :param retry_delay: seconds to wait before the next test when a test
+            failed or returned no result
+        :param clock: function returning the time in seconds, defaults to
+            a monotonic clock
+        """
+        self.client = client
+        self.run_duration = run_duration
+        self.report_interval = report_interval
+        self.on_report = on_report
+        self.retry_delay = retry_delay
+        self._clock = clock or _monotonic
+
+        self.windows = [
+            _RollingWindow(seconds, buckets, relative_accuracy)
+            for seconds in sorted(windows)
+        ]
+        self.runs = 0
+        self.failed_runs = 0
+        self.intervals = 0
+        self.last_error = None
+        self._next_report = None
+        self._stopping = False
+        self._wake = threading.Event()
+
+        # Intervals are added from the thread streaming them while reports
+        # are due on the report thread of run
+        self._lock = threading.RLock()
+
+    def add(self, interval, now=None):
+        """Fold an interval into the rolling windows
+
+        Omitted intervals are ignored. Calls on_report when a report is due.
+
+        :param interval: an interval as found in the json output
+        :param now: the time the interval arrived, defaults to the clock
+        """
+        total = interval['sum']
+        if total.get('omitted'):
+            return
 
+        if now is None:
+            now = self._clock()
+        with self._lock:
+            self.intervals += 1
+            for window in self.windows:
+                window.add(now, total)
 
-    TCP test specific
+            if self._next_report is None:
+                self._next_report = now + self.report_interval
+        self._report(now)
 
-    :param tcp_mss_default:
-    :param retransmits: amount of retransmits (Only returned from client)
+    def _report(self, now):
+        """Call on_report when a report is due
 
-    :param sent_bytes: Sent bytes
-    :param sent_bps: Sent bits per second
-    :param sent_kbps: sent kilobits per second
-    :param sent_Mbps: Sent Megabits per second
-    :param sent_kB_s: Sent kiloBytes per second
-    :param sent_MB_s: Sent MegaBytes per second
+        :param now: the current time of the clock
+        """
+        with self._lock:
+            if self._next_report is None or now < self._next_report:
+                return
+            while self._next_report <= now:
+                self._next_report += self.report_interval
+            if self.on_report is not None:
+                self.on_report(self.summary(now))
+
+    def _report_timer(self, done):
+        """Report every report_interval seconds until done is set, on a
+        thread of its own
+
+        :param done: event set when the soak test has finished
+        """
+        while not done.wait(self.report_interval):
+            self._report(self._clock())
+
+    def summary(self, now=None):
+        """The statistics of every rolling window
+
+        :param now: the end of the windows, defaults to the clock
+        :rtype: dict with the wall clock time, the amount of runs, failed
+            runs and intervals, the last error and a dict of windows by
+            length. Every window is a dict with its amount of intervals,
+            seconds, bytes, bits_per_second, the min, max, mean, p5,
+            median and p95 of the interval throughputs, retransmits,
+            lost_percent and the mean jitter_ms. Statistics the window has
+            no data for are None.
+        """
+        if now is None:
+            now = self._clock()
+        with self._lock:
+            return {
+                'time': time.time(),
+                'runs': self.runs,
+                'failed_runs': self.failed_runs,
+                'intervals': self.intervals,
+                'last_error': self.last_error,
+                'windows': dict(
+                    (window.seconds, window.summary(now))
+                    for window in self.windows
+                ),
+            }
+
+    def run(self, duration):
+        """Run the soak test
+
+        Failed tests, for example against a busy server, and tests that
+        returned no result are counted and retried after retry_delay
+        seconds.
+
+        :param duration: total duration of the soak in seconds
+        :rtype: the final summary, see :meth:`summary`
+        """
+        self._stopping = False
+        self._wake.clear()
+        client_duration = self.client.duration
+        start = self._clock()
+        deadline = start + duration
+        with self._lock:
+            self._next_report = start + self.report_interval
+
+        def on_interval(interval):
+            if self._stopping:
+                raise StopTest()
+            self.add(interval)
+
+        done = threading.Event()
+        if self.on_report is not None:
+            timer = threading.Thread(target=self._report_timer, args=(done,))
+            timer.daemon = True
+            timer.start()
 
-    :param received_bytes:  Received bytes
-    :param received_bps: Received bits per second
-    :param received_kbps: Received kilobits per second
-    :param received_Mbps: Received Megabits per second
-    :param received_kB_s: Received kiloBytes per second
-    :param received_MB_s: Received MegaBytes per second
+        try:
+            while not self._stopping:
+                remaining = int(math.ceil(deadline - self._clock()))
+                if remaining <= 0:
+                    break
+                if self.run_duration is not None:
+                    remaining = min(remaining, self.run_duration)
+                self.client.duration = remaining
+
+                result = self.client.run(on_interval=on_interval,
+                                         keep_intervals=False)
+                failed = result is None or bool(result.error)
+                with self._lock:
+                    self.runs += 1
+                    if failed:
+                        self.failed_runs += 1
+                        if result is not None:
+                            self.last_error = result.error
+                self._report(self._clock())
+
+                if failed:
+                    # Don't spin on tests failing right away, stop() wakes
+                    # the wait up
+                    self._wake.wait(max(0, min(self.retry_delay,
+                                               deadline - self._clock())))
+        finally:
+            done.set()
+            self.client.duration = client_duration
+
+        return self.summary()
+
+    def stop(self):
+        """Stop the soak test, from another thread or from on_report
+
+        A running test is stopped at its next interval.
+        """
+        self._stopping = True
+        self._wake.set()
 
 
-    UDP test specific
+class _RollingWindow(object):
+    """Statistics of the intervals of the last seconds, in fixed memory
 
-    :param bytes:
-    :param bps:
-    :param jitter_ms:
-    :param kbps:
-    :param Mbps:
-    :param kB_s:
-    :param MB_s:
-    :param packets:
-    :param lost_packets:
-    :param lost_percent:
-    :param seconds:
+    The window is a ring of time buckets. A bucket is cleared and reused
+    once it falls out of the window.
     """
 
-    def __init__(self, result):
-        """Initialise TestResult
+    def __init__(self, seconds, buckets, relative_accuracy):
+        """Initialise the window
 
-        :param result: raw json output from :class:`Client` and :class:`Server`
+        :param seconds: length of the window
+        :param buckets: amount of time buckets
+        :param relative_accuracy: accuracy of the throughput quantiles
         """
-        # The full result data
-        self.text = result
-        self.json = json.loads(result)
+        self.seconds = seconds
+        self._width = seconds / float(buckets)
+        self._buckets = [_WindowBucket(relative_accuracy)
+                         for _ in range(buckets)]
+
+    def add(self, now, total):
+        """Add the sum of an interval arriving at now"""
+        slot = int(now // self._width)
+        bucket = self._buckets[slot % len(self._buckets)]
+        if bucket.slot != slot:
+            bucket.clear(slot)
+        bucket.add(total)
+
+    def summary(self, now):
+        """The statistics of the buckets in the window ending at now
+
+        :rtype: dict, see :meth:`SoakTest.summary`
+        """
+        slot = int(now // self._width)
+        buckets = [bucket for bucket in self._buckets
+                   if bucket.slot is not None and
+                   slot - len(self._buckets) < bucket.slot <= slot]
+
+        sketch = QuantileSketch(self._buckets[0].sketch.relative_accuracy)
+        count = seconds = bytes_ = packets = lost_packets = 0
+        jitter = jitter_count = 0
+        retransmits = lowest = highest = None
+        for bucket in buckets:
+            sketch.merge(bucket.sketch)
+            count += bucket.count
+            seconds += bucket.seconds
+            bytes_ += bucket.bytes
+            packets += bucket.packets
+            lost_packets += bucket.lost_packets
+            jitter += bucket.jitter
+            jitter_count += bucket.jitter_count
+            if bucket.retransmits is not None:
+                retransmits = (retransmits or 0) + bucket.retransmits
+            if bucket.count:
+                if lowest is None or bucket.lowest < lowest:
+                    lowest = bucket.lowest
+                if highest is None or bucket.highest > highest:
+                    highest = bucket.highest
+
+        # The extremes are exact, the sketch is only accurate to within a
+        # bin
+        p5, median, p95 = (
+            None if not count else
+            min(max(sketch.percentile(p), lowest), highest)
+            for p in (5, 50, 95)
+        )
+        return {
+            'intervals': count,
+            'seconds': seconds,
+            'bytes': bytes_,
+            'bits_per_second': bytes_ * 8 / seconds if seconds else None,
+            'min_bits_per_second': lowest,
+            'max_bits_per_second': highest,
+            'p5_bits_per_second': p5,
+            'median_bits_per_second': median,
+            'p95_bits_per_second': p95,
+            'retransmits': retransmits,
+            'lost_percent': (100.0 * lost_packets / packets
+                             if packets else None),
+            'jitter_ms': jitter / jitter_count if jitter_count else None,
+        }
+
+
+class _WindowBucket(object):
+    """Totals of the intervals arriving in one time bucket of a window"""
+
+    __slots__ = ('slot', 'sketch', 'count', 'seconds', 'bytes', 'lowest',
+                 'highest', 'retransmits', 'packets', 'lost_packets',
+                 'jitter', 'jitter_count')
+
+    def __init__(self, relative_accuracy):
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.clear(None)
+
+    def clear(self, slot):
+        """Empty the bucket for reuse as time slot"""
+        self.slot = slot
+        self.sketch.clear()
+        self.count = 0
+        self.seconds = 0
+        self.bytes = 0
+        self.lowest = None
+        self.highest = None
+        self.retransmits = None
+        self.packets = 0
+        self.lost_packets = 0
+        self.jitter = 0
+        self.jitter_count = 0
+
+    def add(self, total):
+        """Add the sum of an interval"""
+        bps = total['bits_per_second']
+        self.sketch.add(bps)
+        self.count += 1
+        self.seconds += total['seconds']
+        self.bytes += total['bytes']
+        if self.lowest is None or bps < self.lowest:
+            self.lowest = bps
+        if self.highest is None or bps > self.highest:
+            self.highest = bps
+        if 'retransmits' in total:
+            self.retransmits = (self.retransmits or 0) + total['retransmits']
+        if 'jitter_ms' in total:
+            self.jitter += total['jitter_ms']
+            self.jitter_count += 1
+            self.packets += total.get('packets', 0)
+            self.lost_packets += total.get('lost_packets', 0)
+
+
+class QuantileSketch(object):
+    """Approximate quantiles of a stream of values, in fixed memory.
+
+    Values are counted in logarithmically sized bins, so every quantile is
+    within relative_accuracy of the true value. Values below min_value,
+    like a throughput of 0, are counted as 0. Values above max_value are
+    counted in the highest bin. Sketches with the same settings can be
+    merged.
 
-        if 'error' in self.json:
-            self.error = self.json['error']
+    Basic Usage::
+
+      >>> sketch = iperf3.QuantileSketch()
+      >>> for interval in result.json['intervals']:
+      ...     sketch.add(interval['sum']['bits_per_second'])
+      >>> sketch.percentile(5)
+      930123802.3
+    """
+
+    def __init__(self, relative_accuracy=.02, min_value=1., max_value=1e13):
+        """Initialise the sketch
+
+        :param relative_accuracy: relative accuracy of the quantiles,
+            between 0 and 1
+        :param min_value: smallest value distinguished from 0
+        :param max_value: largest value counted accurately
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be between 0 and 1')
+
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._offset = self._key(min_value)
+        self._bins = array(_INT_TYPECODE, [0]) * (
+            self._key(max_value) - self._offset + 1
+        )
+        self.zeros = 0
+        self.count = 0
+
+    def _key(self, value):
+        """The bin number of a value"""
+        return int(math.ceil(math.log(value) / self._log_gamma))
+
+    def add(self, value):
+        """Count a value"""
+        self.count += 1
+        if value < self.min_value:
+            self.zeros += 1
         else:
-            self.error = None
+            index = min(self._key(value) - self._offset, len(self._bins) - 1)
+            self._bins[index] += 1
+
+    def merge(self, other):
+        """Add the counts of a sketch with the same settings"""
+        if len(other._bins) != len(self._bins) or \
+                other._gamma != self._gamma:
+            raise ValueError('sketches have different settings')
+        if not other.count:
+            return
+        self._bins = array(_INT_TYPECODE,
+                           map(operator.add, self._bins, other._bins))
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def clear(self):
+        """Forget all values"""
+        if self.count:
+            self._bins = array(_INT_TYPECODE, [0]) * len(self._bins)
+        self.zeros = 0
+        self.count = 0
+
+    def percentile(self, percent):
+        """An approximate percentile of the values
+
+        :param percent: percentile between 0 and 100
+        :rtype: float, None without values
+        """
+        if not self.count:
+            return None
 
-            # start time
-            self.time = self.json['start']['timestamp']['time']
-            self.timesecs = self.json['start']['timestamp']['timesecs']
+        rank = percent / 100. * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.
+        for index, count in enumerate(self._bins):
+            seen += count
+            if rank < seen:
+                return 2 * self._gamma ** (index + self._offset) / (
+                    self._gamma + 1
+                )
+        return self.max_value
 
-            # generic info
-            self.system_info = self.json['start']['system_info']
-            self.version = self.json['start']['version']
 
-            # connection details
-            connection_details = self.json['start']['connected'][0]
-            self.local_host = connection_details['local_host']
-            self.local_port = connection_details['local_port']
-            self.remote_host = connection_details['remote_host']
-            self.remote_port = connection_details['remote_port']
+class _ServingStopped(RuntimeError):
+    """Raised while waiting for a result when the server stops serving"""
 
-            # test setup
-            self.tcp_mss_default = self.json['start'].get('tcp_mss_default')
-            self.protocol = self.json['start']['test_start']['protocol']
-            self.num_streams = self.json['start']['test_start']['num_streams']
-            self.blksize = self.json['start']['test_start']['blksize']
-            self.omit = self.json['start']['test_start']['omit']
-            self.duration = self.json['start']['test_start']['duration']
 
-            # system performance
-            cpu_utilization_perc = self.json['end']['cpu_utilization_percent']
-            self.local_cpu_total = cpu_utilization_perc['host_total']
-            self.local_cpu_user = cpu_utilization_perc['host_user']
-            self.local_cpu_system = cpu_utilization_perc['host_system']
-            self.remote_cpu_total = cpu_utilization_perc['remote_total']
-            self.remote_cpu_user = cpu_utilization_perc['remote_user']
-            self.remote_cpu_system = cpu_utilization_perc['remote_system']
+class Server(IPerf3):
+    """An iperf3 server connection.
 
-            # TCP specific test results
-            if self.protocol == 'TCP':
-                sent_json = self.json['end']['sum_sent']
-                self.sent_bytes = sent_json['bytes']
-                self.sent_bps = sent_json['bits_per_second']
+    This starts an iperf3 server session. The server terminates after each
+    succesful client connection so it might be useful to run Server.run()
+    in a loop, or to iterate over Server.serve().
 
-                recv_json = self.json['end']['sum_received']
-                self.received_bytes = recv_json['bytes']
-                self.received_bps = recv_json['bits_per_second']
+    The C function iperf_run_server is called on a long lived worker thread
+    of the server to make sure KeyboardInterrupt(aka ctrl+c) can still be
+    captured. The worker resets the test as soon as it has been served and
+    exits after being idle for a minute.
 
-                # Bits are measured in 10**3 terms
-                # Bytes are measured in 2**10 terms
-                # kbps = Kilobits per second
-                # Mbps = Megabits per second
-                # kB_s = kiloBytes per second
-                # MB_s = MegaBytes per second
+    The :attr:`ready` event is set and the optional :attr:`on_ready`
+    function is called as soon as libiperf listens for a client, see
+    :meth:`wait_ready`. libiperf versions that don't tell the state of a
+    test signal readiness when the test starts, just before listening.
 
-                self.sent_kbps = self.sent_bps / 1000
-                self.sent_Mbps = self.sent_kbps / 1000
-                self.sent_kB_s = self.sent_bps / (8 * 1024)
-                self.sent_MB_s = self.sent_kB_s / 1024
+    Basic Usage::
 
-                self.received_kbps = self.received_bps / 1000
-                self.received_Mbps = self.received_kbps / 1000
-                self.received_kB_s = self.received_bps / (8 * 1024)
-                self.received_MB_s = self.received_kB_s / 1024
+      >>> import iperf3
 
-                # retransmits only returned from client
-                self.retransmits = sent_json.get('retransmits')
+      >>> server = iperf3.Server()
+      >>> server.run()
+      {'start': {...
+    """
 
-            # UDP specific test results
-            elif self.protocol == 'UDP':
-                self.bytes = self.json['end']['sum']['bytes']
-                self.bps = self.json['end']['sum']['bits_per_second']
-                self.jitter_ms = self.json['end']['sum']['jitter_ms']
-                self.kbps = self.bps / 1000
-                self.Mbps = self.kbps / 1000
-                self.kB_s = self.bps / (8 * 1024)
-                self.MB_s = self.kB_s / 1024
-                self.packets = self.json['end']['sum']['packets']
-                self.lost_packets = self.json['end']['sum']['lost_packets']
-                self.lost_percent = self.json['end']['sum']['lost_percent']
-                self.seconds = self.json['end']['sum']['seconds']
+    def __init__(self, *args, **kwargs):
+        """Initialise the iperf3 server instance"""
+        super(Server, self).__init__(role='s', *args, **kwargs)
 
-    @property
-    def reverse(self):
-        if self.json['start']['test_start']['reverse']:
-            return True
+        # Set while the server listens for the client of the current test,
+        # on_ready is called with the server when it starts listening
+        self.ready = threading.Event()
+        self.on_ready = None
+
+        # Tests requested from the worker thread, see _serve_worker. Results
+        # are (result, exception) tuples in the order the tests finished.
+        self._serve_condition = threading.Condition()
+        self._serve_pending = 0
+        self._serve_forever = False
+        self._serve_results = deque()
+        self._serve_discard = 0
+        self._serve_active = False
+        self._serve_closed = False
+        self._serve_stops = 0
+        self._serve_runs = 0
+        self._worker = None
+
+    def _run_once(self):
+        """Serve a single test
+
+        :rtype: instance of :class:`TestResult`, None when json_output is
+            disabled
+        """
+        done = threading.Event()
+        if self.capabilities.test_state:
+            # Forget the state of the previous test, which may have been
+            # stopped while listening
+            self.lib.iperf_set_test_state(self._test, 0)
+        watcher = threading.Thread(target=self._watch_ready, args=(done,))
+        watcher.daemon = True
+        watcher.start()
+        try:
+            return self._serve_test()
+        finally:
+            done.set()
+            self.ready.clear()
+
+    def _watch_ready(self, done):
+        """Signal that the server listens, on a thread of its own
+
+        :param done: event set when the test has been served
+        """
+        while not done.is_set():
+            # _run_once resets the state, any other state means libiperf
+            # listens or a client already connected in between two polls
+            if self._test_state() != 0:
+                break
+            done.wait(SERVER_READY_POLL_INTERVAL)
         else:
-            return False
+            return
 
-    @property
-    def type(self):
-        if 'connecting_to' in self.json['start']:
-            return 'client'
+        self.ready.set()
+        if self.on_ready is not None:
+            self.on_ready(self)
+
+    def wait_ready(self, timeout=None):
+        """Wait until the server listens for a client.
+
+        Starting clients once the server is ready replaces sleeping before
+        the first client connects::
+
+          >>> thread = threading.Thread(target=server.run)
+          >>> thread.start()
+          >>> server.wait_ready(5)
+          True
+
+        :param timeout: optional timeout in seconds
+        :rtype: True when the server listens, False when the timeout
+            expired first
+        """
+        return bool(self.ready.wait(timeout))
+
+    def _serve_test(self):
+        """Serve a single test, see :meth:`_run_once`"""
+        if self.json_output:
+            data = self._run_test(self.lib.iperf_run_server)
+            self._reset()
+            return TestResult(data)
         else:
-            return 'server'
+            # setting json_output to False will output test to screen only
+            with self._run_lock:
+                self._run_to_screen(self.lib.iperf_run_server)
+                self._reset()
 
-    def __repr__(self):
-        """Print the result as received from iperf3"""
-        return self.text
+            return None
+
+    def _serve_worker(self):
+        """Serve the requested tests, on the worker thread of the server"""
+        condition = self._serve_condition
+        while True:
+            with condition:
+                deadline = _monotonic() + SERVER_WORKER_IDLE_TIMEOUT
+                while not self._serve_pending and not self._serve_forever:
+                    remaining = deadline - _monotonic()
+                    if remaining <= 0 or self._serve_closed:
+                        self._worker = None
+                        return
+                    condition.wait(remaining)
+
+                if not self._serve_forever:
+                    self._serve_pending -= 1
+                self._serve_active = True
+                self._serve_runs += 1
+
+            result = error = None
+            try:
+                result = self._run_once()
+            except Exception as e:
+                error = e
+
+            with condition:
+                self._serve_active = False
+                if self._serve_discard:
+                    self._serve_discard -= 1
+                else:
+                    self._serve_results.append((result, error))
+                condition.notify_all()
+
+    def _request(self, count=1):
+        """Ask the worker thread to serve tests, starting it when needed
+
+        :param count: amount of tests, None to serve until stopped
+        """
+        with self._serve_condition:
+            if count is None:
+                self._serve_forever = True
+            else:
+                self._serve_pending += count
+
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._serve_worker)
+                self._worker.daemon = True
+                self._worker.start()
+            self._serve_condition.notify_all()
+
+    def _next_result(self):
+        """Wait for the next test served by the worker thread
+
+        Raises :class:`_ServingStopped` when serving is stopped in the
+        meantime.
+
+        :rtype: instance of :class:`TestResult`
+        """
+        with self._serve_condition:
+            stops = self._serve_stops
+            while not self._serve_results:
+                if self._serve_stops != stops:
+                    raise _ServingStopped('The server has been stopped')
+                self._serve_condition.wait(SERVER_RESULT_POLL_INTERVAL)
+            result, error = self._serve_results.popleft()
+
+        if error is not None:
+            raise error
+        return result
+
+    def _stop_serving(self):
+        """Cancel the requested tests and stop the one being served
+
+        Doesn't block, the test being served is stopped by a thread of its
+        own, see :meth:`_abort_served`.
+        """
+        with self._serve_condition:
+            self._serve_pending = 0
+            self._serve_forever = False
+            self._serve_results.clear()
+            self._serve_stops += 1
+            self._serve_condition.notify_all()
+            active = self._serve_active
+            run = self._serve_runs
+            if active:
+                self._serve_discard += 1
+
+        if active and not self._abort():
+            stopper = threading.Thread(target=self._abort_served,
+                                       args=(run,))
+            stopper.daemon = True
+            stopper.start()
+
+    def _abort_served(self, run):
+        """Stop a test of the worker thread that hasn't started yet
+
+        The worker may not have started the test it took up when serving is
+        stopped, stopping is retried until the test has returned.
+
+        :param run: the number of the test, see _serve_runs
+        """
+        condition = self._serve_condition
+        while True:
+            with condition:
+                if not self._serve_active or self._serve_runs != run:
+                    return
+                condition.wait(WATCHDOG_RETRY_INTERVAL)
+                if not self._serve_active or self._serve_runs != run:
+                    return
+            self._abort()
+
+    def close(self):
+        """Stop serving, then free the iperf_test struct of the server, see
+        :meth:`IPerf3.close`"""
+        self._stop_serving()
+        with self._serve_condition:
+            self._serve_closed = True
+            self._serve_condition.notify_all()
+            worker = self._worker
+
+        if worker is not None and worker is not threading.current_thread():
+            worker.join()
+        super(Server, self).close()
+
+    def run(self):
+        """Run the iperf3 server instance.
+
+        :rtype: instance of :class:`TestResult`
+        """
+        self._request()
+        try:
+            return self._next_result()
+        except _ServingStopped:
+            raise
+        except BaseException:
+            # KeyboardInterrupt while waiting, don't leave the test behind
+            self._stop_serving()
+            raise
+
+    def serve(self, count=None):
+        """Serve tests back to back, yielding their results.
+
+        The server listens for the next client as soon as a test has
+        finished, also while the result of that test is being handled.
+        Closing the generator stops the server.
+
+        Basic Usage::
+
+          >>> for result in server.serve():
+          ...     print(result.remote_host, result.received_Mbps)
+
+        :param count: amount of tests to serve, None to serve until the
+            generator is closed
+        :rtype: generator of :class:`TestResult`
+        """
+        self._request(count)
+        served = 0
+        try:
+            while count is None or served < count:
+                yield self._next_result()
+                served += 1
+        finally:
+            self._stop_serving()
+
+    def run_async(self, timeout=None):
+        """Serve a single test without blocking the asyncio loop.
+
+        The test is served by the worker thread, like :meth:`run`.
+        Cancelling the returned awaitable stops the server.
+
+        :param timeout: optional timeout in seconds, raises
+            :class:`asyncio.TimeoutError` when no test finished in time
+        :rtype: awaitable returning an instance of :class:`TestResult`
+        """
+        return _run_off_loop(self, self.run, timeout, self._stop_serving)
+
+    def serve_async(self, count=None):
+        """Serve tests back to back without blocking the asyncio loop.
+
+        The tests are served by the worker thread, like :meth:`serve`.
+        Cancelling an awaited result, or calling ``close()`` on the
+        iterator, stops the server.
+
+        Basic Usage::
+
+          >>> async for result in server.serve_async():
+          ...     print(result.remote_host, result.received_Mbps)
+
+        :param count: amount of tests to serve, None to serve until the
+            iterator is closed
+        :rtype: asynchronous iterator of :class:`TestResult`, one for every
+            test served
+        """
+        return _AsyncServerResults(self, count)
+
+
+class _AsyncServerResults(object):
+    """Asynchronous iterator returned by :meth:`Server.serve_async`"""
+
+    def __init__(self, server, count=None):
+        self._server = server
+        self._count = count
+        self._served = 0
+        self._requested = False
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if self._count is not None and self._served >= self._count:
+            self._closed = True
+        if self._closed:
+            raise StopAsyncIteration
+
+        if not self._requested:
+            self._server._request(self._count)
+            self._requested = True
+        self._served += 1
+        return _run_off_loop(self._server, self._next, cancel=self.close)
+
+    def _next(self):
+        """Wait for the next result, on a thread of its own"""
+        try:
+            return self._server._next_result()
+        except _ServingStopped:
+            raise
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        """Stop serving, the iterator ends"""
+        if not self._closed:
+            self._closed = True
+            self._server._stop_serving()
+
+
+class ServerFarm(object):
+    """Runs an iperf3 server on every port of a port range.
+
+    A server serves one test at a time, a farm of servers on one host lets
+    many clients test against it at the same time. The servers run in
+    threads when libiperf writes the output of every test to a file of its
+    own, see :class:`IPerf3`, otherwise each server runs in a process of its
+    own. The results of all servers are reported in one stream.
+
+    Basic Usage::
+
+      >>> import iperf3
+
+      >>> farm = iperf3.ServerFarm(range(5201, 5211))
+      >>> farm.start()
+      >>> for port, result in farm.results():
+      ...     print(port, result.remote_host, result.received_Mbps)
+    """
+
+    def __init__(self, ports, bind_address=None, processes=None,
+                 retry_delay=1, poll_interval=.1, lib_name=None):
+        """Initialise the server farm
+
+        :param ports: iterable of the ports to serve tests on
+        :param bind_address: optional address the servers listen on
+        :param processes: True to run every server in a process of its own,
+            False to run them in threads. Defaults to threads when the
+            servers can serve tests in parallel in one process
+        :param retry_delay: seconds a server waits before listening again
+            after a failed test, so a port that can't be listened on
+            doesn't flood the results
+        :param poll_interval: seconds between updates of the idle ports of
+            servers running in a process
+        :param lib_name: optional name and path for libiperf.so.0 library
+        """
+        self.ports = list(ports)
+        if not self.ports:
+            raise ValueError('ports must not be empty')
+
+        self.bind_address = bind_address
+        self.processes = processes
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.lib_name = lib_name
+
+        # Amount of results reported per port
+        self.served = dict.fromkeys(self.ports, 0)
+
+        self._results = None
+        self._stop_event = None
+        self._workers = []
+        self._servers = []
+        self._states = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start the servers, one on every port"""
+        if self._workers:
+            raise RuntimeError('The server farm is already running')
+
+        processes = self.processes
+        if processes is None:
+            lib = load_library(self.lib_name)
+            processes = not _capabilities[lib].own_output
+
+        if processes:
+            self._results = multiprocessing.Queue()
+            self._stop_event = multiprocessing.Event()
+            self._states = multiprocessing.Array('b', len(self.ports))
+            for index, port in enumerate(self.ports):
+                worker = multiprocessing.Process(
+                    target=_serve_farm_process,
+                    args=(port, self.bind_address, self.retry_delay,
+                          self.poll_interval, self.lib_name, self._results,
+                          self._states, index, self._stop_event)
+                )
+                worker.daemon = True
+                self._workers.append(worker)
+        else:
+            self._results = Queue()
+            self._stop_event = threading.Event()
+            self._servers = [
+                _farm_server(port, self.bind_address, self.lib_name)
+                for port in self.ports
+            ]
+            for server, port in zip(self._servers, self.ports):
+                worker = threading.Thread(
+                    target=_serve_farm_port,
+                    args=(server, port, self.retry_delay, self._results.put,
+                          self._stop_event)
+                )
+                worker.daemon = True
+                self._workers.append(worker)
+
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self, timeout=5):
+        """Stop all servers, aborting the tests they are serving
+
+        :param timeout: seconds to wait for a server process to exit before
+            it is terminated
+        """
+        if not self._workers:
+            return
+
+        self._stop_event.set()
+        if self._servers:
+            # Tests are aborted until the thread notices it has to stop
+            for server, worker in zip(self._servers, self._workers):
+                while worker.is_alive():
+                    server._abort()
+                    worker.join(.1)
+                server.close()
+        else:
+            for worker in self._workers:
+                worker.join(timeout)
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+
+        self._workers = []
+        self._servers = []
+
+    def is_running(self):
+        """Whether any of the servers is still running
+
+        :rtype: bool
+        """
+        return any(worker.is_alive() for worker in self._workers)
+
+    def idle_ports(self):
+        """The ports of the servers waiting for a client
+
+        Ports are reported idle while they serve a test when libiperf
+        doesn't tell the state of a test, see :class:`Capabilities`.
+
+        :rtype: list of ports
+        """
+        if self._servers:
+            states = [server._test_state() for server in self._servers]
+        elif self._states is not None:
+            states = self._states[:]
+        else:
+            return []
+
+        return [port for port, state, worker
+                in zip(self.ports, states, self._workers)
+                if state not in _BUSY_STATES and worker.is_alive()]
+
+    def wait_ready(self, timeout=None):
+        """Wait until the servers on all ports listen for a client.
+
+        :param timeout: optional timeout in seconds
+        :rtype: True when all servers listen, False when the timeout expired
+            first
+        """
+        deadline = None if timeout is None else _monotonic() + timeout
+        while True:
+            if self._servers:
+                ready = all(server.ready.is_set() for server in self._servers)
+            else:
+                ready = self._workers and all(
+                    state == IPERF_START for state in self._states[:]
+                )
+            if ready:
+                return True
+            if deadline is not None and _monotonic() >= deadline:
+                return False
+            time.sleep(SERVER_READY_POLL_INTERVAL)
+
+    def results(self):
+        """Yield the results of all servers as they come in, until the farm
+        is stopped
+
+        :rtype: generator of (port, :class:`TestResult`) tuples
+        """
+        while self._results is not None:
+            try:
+                port, result = self._results.get(True, .1)
+            except Empty:
+                if not self.is_running():
+                    return
+                continue
+
+            if not isinstance(result, TestResult):
+                result = TestResult(result)
+            self.served[port] += 1
+            yield port, result
+
+
+def _farm_server(port, bind_address=None, lib_name=None):
+    """Create the :class:`Server` of a :class:`ServerFarm` port
+
+    :param port: the port to listen on
+    :param bind_address: optional address to listen on
+    :param lib_name: optional name and path for libiperf.so.0 library
+    :rtype: instance of :class:`Server`
+    """
+    server = Server(lib_name=lib_name)
+    server.port = port
+    if bind_address is not None:
+        server.bind_address = bind_address
+    return server
+
+
+def _serve_farm_port(server, port, retry_delay, put, stop_event):
+    """Serve tests on a :class:`ServerFarm` port until the farm stops
+
+    :param server: instance of :class:`Server`
+    :param port: the port the server listens on
+    :param retry_delay: seconds to wait after a failed test
+    :param put: function called with every (port, result) tuple
+    :param stop_event: event set when the farm stops
+    """
+    while not stop_event.is_set():
+        try:
+            result = server.run()
+        except Exception as e:
+            put((port, TestResult(json.dumps({'error': str(e)}))))
+            return
+
+        if stop_event.is_set():
+            # The test has been aborted to stop the server
+            return
+
+        put((port, result))
+        if result.error:
+            stop_event.wait(retry_delay)
+
+
+def _serve_farm_process(port, bind_address, retry_delay, poll_interval,
+                        lib_name, results, states, index, stop_event):
+    """Serve tests on a :class:`ServerFarm` port in a process of its own
+
+    Only the raw json output is sent back to the parent process. A thread
+    copies the state of the test to the shared states array and aborts the
+    test when the farm stops.
+
+    :param results: multiprocessing queue of (port, json output) tuples
+    :param states: multiprocessing array with the test state of every port
+    :param index: index of the port in states
+    """
+    try:
+        server = _farm_server(port, bind_address, lib_name)
+    except Exception as e:
+        results.put((port, json.dumps({'error': str(e)})))
+        return
+
+    def put(item):
+        results.put((item[0], item[1]._text))
+
+    worker = threading.Thread(
+        target=_serve_farm_port,
+        args=(server, port, retry_delay, put, stop_event)
+    )
+    worker.daemon = True
+    worker.start()
+
+    while worker.is_alive():
+        if stop_event.is_set():
+            server._abort()
+            worker.join(poll_interval)
+        else:
+            state = server._test_state()
+            if state is None:
+                state = IPERF_START if server.ready.is_set() else 0
+            states[index] = state
+            stop_event.wait(poll_interval)
+
+
+class ClientCache(object):
+    """Keeps idle, configured :class:`Client` instances for reuse.
+
+    Creating a client allocates and initialises an iperf_test struct, and
+    configuring it calls into libiperf for every setting. The cache hands out
+    a client that ran a test with the same configuration before instead,
+    which has been reset and kept its settings, see :meth:`Client.run`.
+    Clients that don't fit in the cache are closed.
+
+    Basic Usage::
+
+      >>> import iperf3
+
+      >>> config = {'server_hostname': '10.0.0.1', 'duration': 1}
+      >>> with iperf3.ClientCache() as cache:
+      ...     results = [cache.run(config) for _ in range(1000)]
+    """
+
+    def __init__(self, max_idle=16, lib_name=None):
+        """Initialise the client cache
+
+        :param max_idle: maximum amount of idle clients kept, the clients
+            of the least recently used configurations are closed first
+        :param lib_name: optional name and path for libiperf.so.0 library
+        """
+        if max_idle < 0:
+            raise ValueError('max_idle must be >= 0')
+
+        self.max_idle = max_idle
+        self.lib_name = lib_name
+
+        # Idle clients per configuration, least recently used first, and
+        # the configurations of the clients handed out
+        self._idle = OrderedDict()
+        self._idle_count = 0
+        self._acquired = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._idle_count
+
+    @staticmethod
+    def _key(config):
+        """The cache key of a test configuration
+
+        :param config: dict of :class:`Client` attributes
+        :rtype: tuple
+        """
+        return tuple(sorted(config.items()))
+
+    def acquire(self, config):
+        """Take a client configured with config, creating it when none is
+        idle. Hand it back with :meth:`release`.
+
+        :param config: dict of :class:`Client` attributes
+        :rtype: instance of :class:`Client`
+        """
+        key = self._key(config)
+        with self._lock:
+            clients = self._idle.get(key)
+            if clients:
+                client = clients.pop()
+                if not clients:
+                    del self._idle[key]
+                self._idle_count -= 1
+            else:
+                client = None
+
+        if client is None:
+            client = _new_client(config, self.lib_name)
+
+        with self._lock:
+            self._acquired[id(client)] = key
+        return client
+
+    def release(self, client):
+        """Hand back a client taken with :meth:`acquire`
+
+        :param client: instance of :class:`Client`
+        """
+        with self._lock:
+            try:
+                key = self._acquired.pop(id(client))
+            except KeyError:
+                raise ValueError('The client was not acquired from the cache')
+
+            evicted = []
+            if self._closed or client._test is None:
+                evicted.append(client)
+            else:
+                # Move the configuration to the most recently used end
+                clients = self._idle.pop(key, [])
+                clients.append(client)
+                self._idle[key] = clients
+                self._idle_count += 1
+
+            while self._idle_count > self.max_idle:
+                oldest = next(iter(self._idle))
+                clients = self._idle[oldest]
+                evicted.append(clients.pop(0))
+                if not clients:
+                    del self._idle[oldest]
+                self._idle_count -= 1
+
+        for client in evicted:
+            client.close()
+
+    def run(self, config, **kwargs):
+        """Run a test on a cached client
+
+        :param config: dict of :class:`Client` attributes
+        :param kwargs: arguments of :meth:`Client.run`
+        :rtype: instance of :class:`TestResult`
+        """
+        client = self.acquire(config)
+        try:
+            return client.run(**kwargs)
+        finally:
+            self.release(client)
+
+    def close(self):
+        """Close the idle clients, clients handed out are closed when they
+        are released"""
+        with self._lock:
+            self._closed = True
+            clients = [client for idle in self._idle.values()
+                       for client in idle]
+            self._idle.clear()
+            self._idle_count = 0
+
+        for client in clients:
+            client.close()
+
+
+class ClientPool(object):
+    """Runs many iperf3 client tests in parallel threads.
+
+    Every test runs on a :class:`Client` of its own, so each test has its
+    own iperf_test struct. An iperf3 server accepts only one test at a time,
+    so the amount of tests running against the same server_hostname:port is
+    limited as well.
+
+    Running tests in parallel requires a libiperf version that writes the
+    output of every test to a file of its own, see :class:`IPerf3`. With
+    older versions the tests run one after another.
+
+    Clients are kept in a :class:`ClientCache` and reused by later tests
+    with the same configuration, until the pool is closed.
+
+    Servers shared with other clients may turn a test down because they are
+    busy running another one. Such tests are queued again, up to ``retries``
+    times, and the server is left alone for a jittered, exponentially
+    growing delay. When a host runs servers on several ports, like a
+    :class:`ServerFarm`, its tests are spread over the least busy ports.
+
+    The error of a failed test is taken from its own json output. libiperf
+    versions that leave it out only keep it in a variable shared by all
+    tests, then tests failing at the same moment may report each other's
+    error.
+
+    Basic Usage::
+
+      >>> import iperf3
+
+      >>> pool = iperf3.ClientPool(max_workers=8)
+      >>> results = pool.run([
+      ...     {'server_hostname': '10.0.0.1', 'duration': 5},
+      ...     {'server_hostname': '10.0.0.2', 'duration': 5},
+      ...     {'server_hostname': '10.0.0.2', 'port': 5202, 'duration': 5},
+      ... ])
+      >>> [result.error for result in results]
+      [None, None, None]
+
+      >>> pool = iperf3.ClientPool(
+      ...     max_workers=8, retries=10,
+      ...     ports={'10.0.0.1': range(5201, 5211)})
+    """
+
+    def __init__(self, max_workers=4, max_per_server=1, lib_name=None,
+                 retries=0, backoff=1, max_backoff=60, ports=None):
+        """Initialise the client pool
+
+        :param max_workers: maximum amount of tests running at the same time
+        :param max_per_server: maximum amount of tests running at the same
+            time against one server_hostname:port
+        :param lib_name: optional name and path for libiperf.so.0 library
+        :param retries: amount of times a test is queued again when the
+            server is busy running another test
+        :param backoff: seconds a busy server is left alone, doubled every
+            time it is busy again and jittered between half and the full
+            delay
+        :param max_backoff: maximum seconds a busy server is left alone
+        :param ports: optional dict of server_hostname to the ports it runs
+            servers on. Tests against these hosts run on any of the ports,
+            the port of the test configuration is ignored
+        """
+        if max_workers < 1 or max_per_server < 1:
+            raise ValueError('max_workers and max_per_server must be >= 1')
+        if retries < 0:
+            raise ValueError('retries must be >= 0')
+
+        self.max_workers = max_workers
+        self.max_per_server = max_per_server
+        self.lib_name = lib_name
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ports = dict(
+            (host, [int(port) for port in host_ports])
+            for host, host_ports in (ports or {}).items()
+        )
+        self._clients = ClientCache(max_workers, lib_name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the clients kept for reuse"""
+        self._clients.close()
+
+    def _client(self, config):
+        """Take a :class:`Client` for a test configuration
+
+        :param config: dict of :class:`Client` attributes
+        :rtype: instance of :class:`Client`
+        """
+        return self._clients.acquire(config)
+
+    def _release(self, client):
+        """Hand back a client taken with :meth:`_client`
+
+        :param client: instance of :class:`Client`
+        """
+        if isinstance(client, Client):
+            self._clients.release(client)
+
+    @staticmethod
+    def _destination(config):
+        """The server_hostname:port a test configuration connects to"""
+        return config.get('server_hostname'), int(config.get('port', 5201))
+
+    def _destinations(self, config):
+        """The server_hostname:port pairs a test configuration may use
+
+        :param config: dict of :class:`Client` attributes
+        :rtype: list of (server_hostname, port) tuples
+        """
+        host = config.get('server_hostname')
+        if host in self.ports:
+            return [(host, port) for port in self.ports[host]]
+        return [self._destination(config)]
+
+    @staticmethod
+    def _server_busy(client, result):
+        """Whether the server turned a test down because it was busy
+
+        :param client: the :class:`Client` that ran the test, None when it
+            couldn't be created
+        :param result: instance of :class:`TestResult`
+        :rtype: bool
+        """
+        return isinstance(client, IPerf3) and client._server_busy(result)
+
+    def _delay(self, busy_count):
+        """Seconds to leave a server alone after it has been busy
+
+        :param busy_count: amount of times in a row the server was busy
+        :rtype: float
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (busy_count - 1))
+        return random.uniform(delay / 2., delay)
+
+    def run(self, configs):
+        """Run all tests and wait for them to finish.
+
+        :param configs: iterable of dicts with :class:`Client` attributes,
+            for example ``{'server_hostname': '10.0.0.1', 'duration': 5}``
+        :rtype: list of :class:`TestResult`, in the order of configs. Tests
+            that found their server busy more than ``retries`` times have
+            the busy error of their last attempt.
+        """
+        configs = list(configs)
+        results = [None] * len(configs)
+        pending = [(index, config, 0) for index, config in enumerate(configs)]
+        running = {}
+        # Servers that were busy: times in a row and when to try them again
+        busy_count = {}
+        busy_until = {}
+        condition = threading.Condition()
+
+        def next_test():
+            """Take the first pending test with a server that has room"""
+            with condition:
+                while pending or any(running.values()):
+                    now = _monotonic()
+                    wake = None
+                    for position, test in enumerate(pending):
+                        index, config, attempt = test
+                        candidates = []
+                        for destination in self._destinations(config):
+                            if running.get(destination, 0) >= \
+                                    self.max_per_server:
+                                continue
+                            until = busy_until.get(destination, 0)
+                            if until > now:
+                                wake = until if wake is None else min(
+                                    wake, until)
+                                continue
+                            candidates.append(destination)
+
+                        if candidates:
+                            destination = min(
+                                candidates,
+                                key=lambda d: running.get(d, 0)
+                            )
+                            del pending[position]
+                            running[destination] = (
+                                running.get(destination, 0) + 1
+                            )
+                            return index, config, attempt, destination
+
+                    condition.wait(None if wake is None else wake - now)
+                return None
+
+        def worker():
+            while True:
+                test = next_test()
+                if test is None:
+                    return
+
+                index, config, attempt, destination = test
+                if destination != self._destination(config):
+                    config = dict(config, port=destination[1])
+
+                client = None
+                try:
+                    client = self._client(config)
+                    result = client.run()
+                except Exception as e:
+                    result = TestResult(
+                        json.dumps({'error': str(e)})
+                    )
+
+                busy = self._server_busy(client, result)
+                if client is not None:
+                    self._release(client)
+                with condition:
+                    running[destination] -= 1
+                    if busy:
+                        count = busy_count.get(destination, 0) + 1
+                        busy_count[destination] = count
+                        busy_until[destination] = (
+                            _monotonic() + self._delay(count)
+                        )
+                    else:
+                        busy_count.pop(destination, None)
+
+                    if busy and attempt < self.retries:
+                        pending.append((index, test[1], attempt + 1))
+                    else:
+                        results[index] = result
+                    condition.notify_all()
+
+        threads = []
+        for _ in range(min(self.max_workers, len(configs))):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            while t.is_alive():
+                t.join(.1)
+
+        return results
+
+
+def _new_client(config, lib_name=None):
+    """Create a :class:`Client` for a test configuration
+
+    :param config: dict of :class:`Client` attributes
+    :param lib_name: optional name and path for libiperf.so.0 library
+    :rtype: instance of :class:`Client`
+    """
+    return Client.from_config(config, lib_name)
+
+
+def _pin_worker(cpus):
+    """Pin a :class:`ClientProcessPool` worker process to the next free CPU
+
+    :param cpus: multiprocessing queue with the CPUs to hand out
+    """
+    try:
+        cpu = cpus.get(True, 1)
+    except Empty:
+        return
+    os.sched_setaffinity(0, [cpu])
+
+
+# Clients of a ClientProcessPool worker process, reused by its later tests
+_process_clients = {}
+
+
+def _run_client_process(args):
+    """Run a client test in a :class:`ClientProcessPool` worker process
+
+    Only the raw json output is sent back to the parent process, which is
+    much cheaper to pickle than a :class:`TestResult`.
+
+    :param args: tuple of (config, lib_name)
+    :rtype: the json output as bytes, None when json_output is disabled
+    """
+    config, lib_name = args
+    try:
+        cache = _process_clients.get(lib_name)
+        if cache is None:
+            cache = _process_clients[lib_name] = ClientCache(
+                lib_name=lib_name
+            )
+
+        client = cache.acquire(config)
+        try:
+            if not client.json_output:
+                return None
+            try:
+                return client._run_test(client.lib.iperf_run_client)
+            finally:
+                client._reset()
+        finally:
+            cache.release(client)
+    except Exception as e:
+        return json.dumps({'error': str(e)}).encode('utf-8')
+
+
+class ClientProcessPool(object):
+    """Runs many iperf3 client tests in parallel worker processes.
+
+    Every worker process loads its own copy of libiperf, so tests don't
+    share any library state and very fast tests don't compete for the one
+    core a single Python process would mostly run on. On Linux each worker
+    is pinned to a CPU of its own.
+
+    The worker processes are started by the first :meth:`run` and serve
+    every later one, keeping their CPU and the clients of earlier tests,
+    until the pool is closed.
+
+    Basic Usage::
+
+      >>> import iperf3
+
+      >>> with iperf3.ClientProcessPool(cpus=[2, 3]) as pool:
+      ...     results = pool.run([
+      ...         {'server_hostname': '10.0.0.1', 'duration': 10},
+      ...         {'server_hostname': '10.1.0.1', 'duration': 10},
+      ...     ])
+    """
+
+    def __init__(self, processes=None, cpus=None, lib_name=None):
+        """Initialise the process pool
+
+        :param processes: amount of worker processes, defaults to the amount
+            of CPUs
+        :param cpus: CPUs to pin the worker processes to, one each. Defaults
+            to the CPUs this process is allowed to run on. Workers are not
+            pinned on systems without os.sched_setaffinity
+        :param lib_name: optional name and path for libiperf.so.0 library
+        """
+        if cpus is None and hasattr(os, 'sched_getaffinity'):
+            cpus = sorted(os.sched_getaffinity(0))
+
+        if processes is None:
+            processes = len(cpus) if cpus else multiprocessing.cpu_count()
+
+        if processes < 1:
+            raise ValueError('processes must be >= 1')
+
+        self.processes = processes
+        self.cpus = list(cpus) if cpus else []
+        self.lib_name = lib_name
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _workers(self):
+        """The worker processes, started the first time they are needed
+
+        :rtype: multiprocessing.Pool
+        """
+        with self._lock:
+            if self._pool is None:
+                initializer = None
+                initargs = ()
+
+                if self.cpus and hasattr(os, 'sched_setaffinity'):
+                    cpus = multiprocessing.Queue()
+                    for index in range(self.processes):
+                        cpus.put(self.cpus[index % len(self.cpus)])
+                    initializer = _pin_worker
+                    initargs = (cpus,)
+
+                self._pool = multiprocessing.Pool(
+                    self.processes, initializer, initargs
+                )
+            return self._pool
+
+    def run(self, configs):
+        """Run all tests and wait for them to finish.
+
+        :param configs: iterable of dicts with :class:`Client` attributes,
+            for example ``{'server_hostname': '10.0.0.1', 'duration': 5}``
+        :rtype: list of :class:`TestResult`, in the order of configs
+        """
+        args = [(config, self.lib_name) for config in configs]
+        if not args:
+            return []
+
+        outputs = self._workers().map(_run_client_process, args, chunksize=1)
+        return [TestResult(output) if output else None for output in outputs]
+
+    def close(self):
+        """Stop the worker processes and the clients they kept, a later
+        :meth:`run` starts new ones"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _load_json(data, intervals=True):
+    """Parse json output of libiperf
+
+    Uses orjson or ujson when installed, which parse several times faster
+    than the json module.
+
+    :param data: the json output as bytes or unicode string
+    :param intervals: parse the top level intervals section, skipping it
+        saves most of the work for long tests
+    :rtype: dict
+    """
+    if not intervals:
+        data = _skip_intervals(data)
+
+    try:
+        if orjson is not None:
+            return orjson.loads(data)
+        if ujson is not None:
+            return ujson.loads(data)
+    except ValueError:
+        pass  # let the json module parse it, or raise its usual error
+
+    if isinstance(data, bytes) and bytes is not str:
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def _skip_intervals(data):
+    """Cut the top level intervals section out of the json output
+
+    Only json output formatted by libiperf is recognised, other text is
+    returned as is.
+
+    :param data: the json output as bytes or unicode string
+    :rtype: the json output without intervals, of the same type as data
+    """
+    intervals, end = _INTERVALS_MARKER, _END_MARKER
+    if not isinstance(data, bytes):
+        intervals, end = intervals.decode('ascii'), end.decode('ascii')
+
+    start = data.find(intervals)
+    if start < 0:
+        return data
+    stop = data.find(end, start)
+    if stop < 0:
+        return data
+    return data[:start] + data[stop:]
+
+
+class TestResult(object):
+    """Class containing iperf3 test results.
+
+    The json output is parsed the first time a result attribute is read,
+    after which only the summary below is kept. Call :meth:`drop_text` to
+    let go of the raw text as well when keeping many results in memory.
+
+    :param text: The raw result from libiperf as text, None once dropped
+    :param json: The raw result from libiperf asjson/dict, None once the
+        text has been dropped
+    :param intervals: The intervals as :class:`Intervals` columns, None
+        when the text has been dropped without keeping them
+    :param streams: The results of every stream as :class:`Streams`
+        columns, None for failed tests or when the text has been dropped
+        without keeping them
+    :param error: Error captured during test, None if all ok
+    :param stopped_early: The test was stopped before its duration ended,
+        the summary is computed from the intervals received until then
+
+    :param time: Start time
+    :param timesecs: Start time in seconds
+
+    :param system_info: System info
+    :param version: Iperf Version
+
+    :param local_host: Local host ip
+    :param local_port: Local port number
+    :param remote_host: Remote host ip
+    :param remote_port: Remote port number
+
+    :param reverse: Test ran in reverse direction
+    :param protocol: 'TCP' or 'UDP'
+    :param num_streams: Number of test streams
+    :param blksize:
+    :param omit: Test duration to omit in the beginning in seconds
+    :param duration: Test duration (following omit duration) in seconds
+
+    :param local_cpu_total: The local total CPU load
+    :param local_cpu_user: The local user CPU load
+    :param local_cpu_system: The local system CPU load
+    :param remote_cpu_total: The remote total CPU load
+    :param remote_cpu_user: The remote user CPU load
+    :param remote_cpu_system: The remote system CPU load
+
+
+    TCP test specific
+
+    :param tcp_mss_default:
+    :param retransmits: amount of retransmits (Only returned from client)
+
+    :param sent_bytes: Sent bytes
+    :param sent_bps: Sent bits per second
+    :param sent_kbps: sent kilobits per second
+    :param sent_Mbps: Sent Megabits per second
+    :param sent_kB_s: Sent kiloBytes per second
+    :param sent_MB_s: Sent MegaBytes per second
+
+    :param received_bytes:  Received bytes
+    :param received_bps: Received bits per second
+    :param received_kbps: Received kilobits per second
+    :param received_Mbps: Received Megabits per second
+    :param received_kB_s: Received kiloBytes per second
+    :param received_MB_s: Received MegaBytes per second
+
+
+    UDP test specific
+
+    :param bytes:
+    :param bps:
+    :param jitter_ms:
+    :param kbps:
+    :param Mbps:
+    :param kB_s:
+    :param MB_s:
+    :param packets:
+    :param lost_packets:
+    :param lost_percent:
+    :param seconds:
+    """
+
+    # attributes copied out of the json output by _parse
+    _SUMMARY = (
+        'error', 'stopped_early', 'time', 'timesecs', 'system_info',
+        'version', 'local_host', 'local_port', 'remote_host', 'remote_port',
+        '_reverse', '_type', 'tcp_mss_default', 'protocol', 'num_streams',
+        'blksize', 'omit', 'duration',
+        'local_cpu_total', 'local_cpu_user', 'local_cpu_system',
+        'remote_cpu_total', 'remote_cpu_user', 'remote_cpu_system',
+        'sent_bytes', 'sent_bps', 'received_bytes', 'received_bps',
+        'retransmits',
+        'bytes', 'bps', 'jitter_ms', 'packets', 'lost_packets',
+        'lost_percent', 'seconds',
+    )
+
+    __slots__ = ('_text', '_json', '_parsed', '_intervals',
+                 '_streams') + _SUMMARY
+
+    def __init__(self, result, keep_text=True, keep_intervals=True,
+                 keep_streams=True):
+        """Initialise TestResult
+
+        :param result: raw json output from :class:`Client` and :class:`Server`
+            as bytes or unicode string
+        :param keep_text: keep the raw json output, when False the result is
+            parsed right away and only the summary is kept
+        :param keep_intervals: keep the intervals as compact
+            :class:`Intervals` columns when the raw text is dropped
+        :param keep_streams: keep the per stream results as
+            :class:`Streams` columns when the raw text is dropped
+        """
+        # The full result data
+        self._text = result
+        self._json = None
+        self._parsed = False
+        self._intervals = None
+        self._streams = None
+
+        if not keep_text:
+            self.drop_text(keep_intervals, keep_streams)
+
+    def __getattr__(self, name):
+        """Parse the result the first time a summary attribute is read
+
+        Only called for attributes that have not been set.
+        """
+        try:
+            parsed = object.__getattribute__(self, '_parsed')
+        except AttributeError:
+            raise AttributeError(name)
+
+        if parsed or name.startswith('__'):
+            raise AttributeError(name)
+
+        self._parse()
+        return object.__getattribute__(self, name)
+
+    def _parse(self, document=None):
+        """Copy the summary out of the json output
+
+        The intervals are skipped when the json output still has to be
+        parsed, as the summary doesn't need them.
+
+        The result counts as parsed only once the whole summary has been
+        copied, output missing a part of it raises ValueError every time.
+
+        :param document: the parsed json output, when already available
+        """
+        if document is None:
+            document = self._json
+        if document is None:
+            document = _load_json(self._text, intervals=False)
+
+        try:
+            self._copy_summary(document)
+        except (KeyError, IndexError, TypeError) as e:
+            for name in self._SUMMARY:
+                try:
+                    delattr(self, name)
+                except AttributeError:
+                    pass
+            raise ValueError(
+                'Incomplete iperf3 json output, missing {0!r}'.format(e))
+
+        self._parsed = True
+        return document
+
+    def _copy_summary(self, document):
+        """Set the summary attributes from the parsed json output
+
+        :param document: the parsed json output
+        """
+        self.stopped_early = bool(document.get('stopped_early'))
+
+        if 'error' in document:
+            self.error = document['error']
+        else:
+            self.error = None
+
+            start = document['start']
+            test_start = start['test_start']
+
+            # start time
+            self.time = start['timestamp']['time']
+            self.timesecs = start['timestamp']['timesecs']
+
+            # generic info
+            self.system_info = start['system_info']
+            self.version = start['version']
+
+            # connection details
+            connection_details = start['connected'][0]
+            self.local_host = connection_details['local_host']
+            self.local_port = connection_details['local_port']
+            self.remote_host = connection_details['remote_host']
+            self.remote_port = connection_details['remote_port']
+
+            # test setup
+            self._reverse = bool(test_start['reverse'])
+            self._type = 'client' if 'connecting_to' in start else 'server'
+            self.tcp_mss_default = start.get('tcp_mss_default')
+            self.protocol = test_start['protocol']
+            self.num_streams = test_start['num_streams']
+            self.blksize = test_start['blksize']
+            self.omit = test_start['omit']
+            self.duration = test_start['duration']
+
+            # system performance
+            cpu_utilization_perc = document['end']['cpu_utilization_percent']
+            self.local_cpu_total = cpu_utilization_perc['host_total']
+            self.local_cpu_user = cpu_utilization_perc['host_user']
+            self.local_cpu_system = cpu_utilization_perc['host_system']
+            self.remote_cpu_total = cpu_utilization_perc['remote_total']
+            self.remote_cpu_user = cpu_utilization_perc['remote_user']
+            self.remote_cpu_system = cpu_utilization_perc['remote_system']
+
+            # TCP specific test results
+            if self.protocol == 'TCP':
+                sent_json = document['end']['sum_sent']
+                self.sent_bytes = sent_json['bytes']
+                self.sent_bps = sent_json['bits_per_second']
+
+                recv_json = document['end']['sum_received']
+                self.received_bytes = recv_json['bytes']
+                self.received_bps = recv_json['bits_per_second']
+
+                # retransmits only returned from client
+                self.retransmits = sent_json.get('retransmits')
+
+            # UDP specific test results
+            elif self.protocol == 'UDP':
+                udp_json = document['end']['sum']
+                self.bytes = udp_json['bytes']
+                self.bps = udp_json['bits_per_second']
+                self.jitter_ms = udp_json['jitter_ms']
+                self.packets = udp_json['packets']
+                self.lost_packets = udp_json['lost_packets']
+                self.lost_percent = udp_json['lost_percent']
+                self.seconds = udp_json['seconds']
+
+    def drop_text(self, keep_intervals=True, keep_streams=True):
+        """Release the raw json output, keeping only the summary
+
+        :param keep_intervals: keep the intervals as compact
+            :class:`Intervals` columns
+        :param keep_streams: keep the per stream results as compact
+            :class:`Streams` columns
+        """
+        if self._text is None:
+            return
+
+        document = self._json
+        if document is None:
+            document = _load_json(
+                self._text,
+                intervals=keep_intervals and self._intervals is None
+            )
+        if not self._parsed:
+            self._parse(document)
+
+        if keep_intervals and self._intervals is None:
+            self._intervals = Intervals.from_json(
+                document.get('intervals', [])
+            )
+        if keep_streams and self._streams is None and not self.error:
+            self._streams = Streams.from_json(document)
+
+        self._text = None
+        self._json = None
+
+    def to_dict(self):
+        """The summary of the result as a dict
+
+        Holds the summary attributes the test reported, like error,
+        protocol and sent_bps, plus reverse and type. Does not hold the
+        text, intervals or streams.
+
+        :rtype: dict
+        """
+        if not self._parsed:
+            self._parse()
+
+        summary = {}
+        for name in self.__slots__:
+            if name.startswith('_'):
+                continue
+            try:
+                summary[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass  # not reported by this test
+        for name in ('reverse', 'type'):
+            try:
+                summary[name] = object.__getattribute__(self, '_' + name)
+            except AttributeError:
+                pass
+        return summary
+
+    @classmethod
+    def from_dict(cls, summary, intervals=None, streams=None):
+        """Rebuild a result from its summary, without the raw text
+
+        :param summary: dict as returned by :meth:`to_dict`
+        :param intervals: the intervals as :class:`Intervals`, optional
+        :param streams: the per stream results as :class:`Streams`,
+            optional
+        :rtype: instance of :class:`TestResult`
+        """
+        result = cls(None)
+        result._parsed = True
+        result._intervals = intervals
+        result._streams = streams
+        result.error = None
+        result.stopped_early = False
+
+        for name, value in summary.items():
+            if name in ('reverse', 'type'):
+                name = '_' + name
+            setattr(result, name, value)
+        return result
+
+    @property
+    def text(self):
+        if isinstance(self._text, bytes) and bytes is not str:
+            self._text = self._text.decode('utf-8')
+        return self._text
+
+    @property
+    def json(self):
+        if self._json is None and self._text is not None:
+            self._json = _load_json(self._text)
+        return self._json
+
+    @property
+    def intervals(self):
+        if self._intervals is None and self._text is not None:
+            self._intervals = Intervals.from_json(
+                self.json.get('intervals', [])
+            )
+        return self._intervals
+
+    @property
+    def streams(self):
+        if (self._streams is None and self._text is not None and
+                not self.error):
+            self._streams = Streams.from_json(self.json)
+        return self._streams
+
+    # Bits are measured in 10**3 terms
+    # Bytes are measured in 2**10 terms
+    # kbps = Kilobits per second
+    # Mbps = Megabits per second
+    # kB_s = kiloBytes per second
+    # MB_s = MegaBytes per second
+
+    @property
+    def sent_kbps(self):
+        return self.sent_bps / 1000
+
+    @property
+    def sent_Mbps(self):
+        return self.sent_kbps / 1000
+
+    @property
+    def sent_kB_s(self):
+        return self.sent_bps / (8 * 1024)
+
+    @property
+    def sent_MB_s(self):
+        return self.sent_kB_s / 1024
+
+    @property
+    def received_kbps(self):
+        return self.received_bps / 1000
+
+    @property
+    def received_Mbps(self):
+        return self.received_kbps / 1000
+
+    @property
+    def received_kB_s(self):
+        return self.received_bps / (8 * 1024)
+
+    @property
+    def received_MB_s(self):
+        return self.received_kB_s / 1024
+
+    @property
+    def kbps(self):
+        return self.bps / 1000
+
+    @property
+    def Mbps(self):
+        return self.kbps / 1000
+
+    @property
+    def kB_s(self):
+        return self.bps / (8 * 1024)
+
+    @property
+    def MB_s(self):
+        return self.kB_s / 1024
+
+    @property
+    def reverse(self):
+        return self._reverse
+
+    @property
+    def type(self):
+        return self._type
+
+    def __repr__(self):
+        """Print the result as received from iperf3"""
+        if self._text is None:
+            return '<TestResult {0}>'.format(
+                self.error or '{0} {1}:{2}'.format(
+                    self.protocol, self.remote_host, self.remote_port
+                )
+            )
+        return self.text
+
+
+class Intervals(object):
+    """Per interval totals of a test, stored as compact typed columns.
+
+    Each column holds one value per interval. Columns are NumPy arrays when
+    NumPy is installed and :class:`array.array` objects otherwise. Columns
+    the test didn't report, like jitter_ms for a TCP test, are None.
+    Missing floating point values are NaN, missing counters are 0.
+
+    Basic Usage::
+
+      >>> intervals = result.intervals
+      >>> numpy.percentile(intervals.bits_per_second, 5)
+      929812000.0
+
+    :param start: Interval start, in seconds since the test started
+    :param end: Interval end, in seconds since the test started
+    :param bytes: Bytes transferred during the interval
+    :param bits_per_second: Throughput during the interval
+    :param retransmits: TCP retransmits during the interval
+    :param snd_cwnd: TCP congestion window at the end of the interval,
+        summed over all streams
+    :param rtt: TCP round trip time in microseconds, averaged over all
+        streams
+    :param jitter_ms: UDP jitter in milliseconds
+    :param lost_packets: UDP packets lost during the interval
+    """
+
+    # (column, type code, value is taken from the streams)
+    _COLUMNS = (
+        ('start', 'd', False),
+        ('end', 'd', False),
+        ('bytes', 'q', False),
+        ('bits_per_second', 'd', False),
+        ('retransmits', 'q', False),
+        ('snd_cwnd', 'd', True),
+        ('rtt', 'd', True),
+        ('jitter_ms', 'd', False),
+        ('lost_packets', 'q', False),
+    )
+
+    __slots__ = tuple(name for name, _, _ in _COLUMNS)
+
+    def __init__(self, **columns):
+        """Initialise the columns
+
+        :param columns: the columns by name, missing columns are None
+        """
+        for name, _, _ in self._COLUMNS:
+            setattr(self, name, columns.get(name))
+
+    @classmethod
+    def from_json(cls, intervals):
+        """Build the columns from the intervals of the json output
+
+        :param intervals: list of intervals as found in the json output
+        :rtype: instance of :class:`Intervals`
+        """
+        columns = {}
+        for name, typecode, per_stream in cls._COLUMNS:
+            if per_stream:
+                values = [_stream_total(name, interval['streams'])
+                          for interval in intervals]
+            else:
+                values = [interval['sum'].get(name)
+                          for interval in intervals]
+
+            if intervals and all(value is None for value in values):
+                columns[name] = None
+            else:
+                columns[name] = _column(typecode, values)
+
+        return cls(**columns)
+
+    def __len__(self):
+        return len(self.start)
+
+
+class Streams(object):
+    """Results of every parallel stream of a test, stored as typed columns.
+
+    Each column holds one value per stream, in the order of the connected
+    streams in the json output. Columns are NumPy arrays when NumPy is
+    installed and :class:`array.array` objects otherwise. Columns the test
+    didn't report are None. Missing floating point values are NaN, missing
+    counters are 0.
+
+    Basic Usage::
+
+      >>> streams = result.streams
+      >>> streams.local_port[streams.received_bps.argmin()]
+      60166
+      >>> streams.jain_index()
+      0.998
+
+    :param socket: Socket number of the stream
+    :param local_host: Local host ip, list of strings
+    :param local_port: Local port number
+    :param remote_host: Remote host ip, list of strings
+    :param remote_port: Remote port number
+    :param sent_bytes: Sent bytes
+    :param sent_bps: Sent bits per second
+    :param received_bytes: Received bytes
+    :param received_bps: Received bits per second
+    :param retransmits: TCP retransmits
+    :param max_snd_cwnd: Maximum TCP congestion window
+    :param max_rtt: Maximum TCP round trip time in microseconds
+    :param min_rtt: Minimum TCP round trip time in microseconds
+    :param mean_rtt: Mean TCP round trip time in microseconds
+    :param jitter_ms: UDP jitter in milliseconds
+    :param lost_packets: UDP lost packets
+    :param lost_percent: UDP lost packets in percent
+    """
+
+    # (column, type code, records of the end streams to take the value
+    # from in order of preference, key in the record). UDP tests of older
+    # iperf versions report a single 'udp' record.
+    _COLUMNS = (
+        ('sent_bytes', 'q', ('sender', 'udp'), 'bytes'),
+        ('sent_bps', 'd', ('sender', 'udp'), 'bits_per_second'),
+        ('received_bytes', 'q', ('receiver',), 'bytes'),
+        ('received_bps', 'd', ('receiver',), 'bits_per_second'),
+        ('retransmits', 'q', ('sender',), 'retransmits'),
+        ('max_snd_cwnd', 'd', ('sender',), 'max_snd_cwnd'),
+        ('max_rtt', 'd', ('sender',), 'max_rtt'),
+        ('min_rtt', 'd', ('sender',), 'min_rtt'),
+        ('mean_rtt', 'd', ('sender',), 'mean_rtt'),
+        ('jitter_ms', 'd', ('udp', 'receiver', 'sender'), 'jitter_ms'),
+        ('lost_packets', 'q', ('udp', 'receiver', 'sender'), 'lost_packets'),
+        ('lost_percent', 'd', ('udp', 'receiver', 'sender'), 'lost_percent'),
+    )
+
+    __slots__ = (
+        'socket', 'local_host', 'local_port', 'remote_host', 'remote_port',
+    ) + tuple(name for name, _, _, _ in _COLUMNS)
+
+    def __init__(self, **columns):
+        """Initialise the columns
+
+        :param columns: the columns by name, missing columns are None
+        """
+        for name in self.__slots__:
+            setattr(self, name, columns.get(name))
+
+    @classmethod
+    def from_json(cls, document):
+        """Build the columns from the json output of a test
+
+        :param document: the json output as a dict
+        :rtype: instance of :class:`Streams`
+        """
+        connected = document['start']['connected']
+        ends = dict(
+            (_stream_socket(stream), stream)
+            for stream in document.get('end', {}).get('streams', [])
+        )
+
+        columns = {
+            'socket': _column('q', [c['socket'] for c in connected]),
+            'local_host': [c['local_host'] for c in connected],
+            'local_port': _column('q', [c['local_port'] for c in connected]),
+            'remote_host': [c['remote_host'] for c in connected],
+            'remote_port': _column(
+                'q', [c['remote_port'] for c in connected]
+            ),
+        }
+
+        streams = [ends.get(c['socket'], {}) for c in connected]
+        for name, typecode, records, key in cls._COLUMNS:
+            values = [_stream_value(stream, records, key)
+                      for stream in streams]
+
+            if all(value is None for value in values):
+                columns[name] = None
+            else:
+                columns[name] = _column(typecode, values)
+
+        return cls(**columns)
+
+    def __len__(self):
+        return len(self.local_host)
+
+    @property
+    def throughput(self):
+        """Throughput of every stream in bits per second
+
+        The received throughput when known, else the sent throughput.
+        """
+        if self.received_bps is not None:
+            return self.received_bps
+        return self.sent_bps
+
+    def jain_index(self):
+        """Jain's fairness index of the stream throughputs
+
+        1.0 when all streams got the same throughput, 1/n when a single
+        stream got everything.
+
+        :rtype: float, None without streams or throughput
+        """
+        throughput = self.throughput
+        if throughput is None or not len(throughput):
+            return None
+
+        total = float(sum(throughput))
+        squares = float(sum(value * value for value in throughput))
+        if not squares:
+            return None
+        return total * total / (len(throughput) * squares)
+
+    def min_mean_ratio(self):
+        """Throughput of the slowest stream relative to the mean throughput
+
+        :rtype: float, None without streams or throughput
+        """
+        throughput = self.throughput
+        if throughput is None or not len(throughput):
+            return None
+
+        mean = float(sum(throughput)) / len(throughput)
+        if not mean:
+            return None
+        return min(throughput) / mean
+
+
+def _stream_socket(stream):
+    """The socket number of a stream in the end section of the json output
+
+    :param stream: a stream of the end section
+    :rtype: int
+    """
+    for record in ('sender', 'receiver', 'udp'):
+        if record in stream:
+            return stream[record]['socket']
+    return None
+
+
+def _stream_value(stream, records, key):
+    """A value from the end section of a stream in the json output
+
+    :param stream: a stream of the end section
+    :param records: names of the records to look in, in order of preference
+    :param key: the key of the value
+    :rtype: the value of the first record that has it, None if none has
+    """
+    for record in records:
+        if key in stream.get(record, ()):
+            return stream[record][key]
+    return None
+
+
+def _stream_total(name, streams):
+    """Combine a per stream interval value into a value for the interval
+
+    snd_cwnd is summed, rtt is averaged over the streams reporting it.
+
+    :param name: 'snd_cwnd' or 'rtt'
+    :param streams: the streams of an interval in the json output
+    :rtype: float, None when no stream reported the value
+    """
+    values = [stream[name] for stream in streams if name in stream]
+    if not values:
+        return None
+    if name == 'rtt':
+        return sum(values) / float(len(values))
+    return float(sum(values))
+
+
+def _column(typecode, values):
+    """Store values in a compact column
+
+    :param typecode: 'd' for floating point values, 'q' for integers
+    :param values: list of values, None for missing values
+    :rtype: numpy.ndarray when NumPy is installed, else array.array
+    """
+    if typecode == 'd':
+        values = [NAN if value is None else value for value in values]
+    else:
+        values = [0 if value is None else int(value) for value in values]
+
+    if numpy is not None:
+        return numpy.array(
+            values, dtype=numpy.float64 if typecode == 'd' else numpy.int64
+        )
+    return array(typecode if typecode == 'd' else _INT_TYPECODE, values)
+
+
+def _array_bytes(values):
+    """The raw bytes of an array.array, Python2 names tobytes tostring
+
+    :param values: the array.array
+    :rtype: bytes
+    """
+    tobytes = getattr(values, 'tobytes', None) or values.tostring
+    return tobytes()
+
+
+def _array_extend(values, data):
+    """Append raw bytes to an array.array, Python2 names frombytes fromstring
+
+    :param values: the array.array
+    :param data: bytes, a multiple of the item size of the array long
+    """
+    frombytes = getattr(values, 'frombytes', None) or values.fromstring
+    frombytes(data)
+
+
+class ResultSet(object):
+    """Many test results, stored column-wise for fast aggregation.
+
+    Numeric summary values are stored in compact typed columns and text
+    values like the remote host are dictionary encoded. Aggregations are
+    vectorised with NumPy when it is installed and fall back to plain
+    Python otherwise. Failed tests are kept, with NaN for their measured
+    values, so they can be counted per group.
+
+    Basic Usage::
+
+      >>> results = iperf3.ResultSet(client_results)
+      >>> results.percentile('sent_Mbps', [5, 50, 95])
+      [850.2, 935.9, 941.0]
+      >>> for (host, protocol), group in results.groupby(
+      ...         'remote_host', 'protocol').items():
+      ...     print(host, protocol, len(group), group.mean('sent_Mbps'),
+      ...           group.confidence_interval('sent_Mbps'))
+
+    Available columns: the text columns remote_host, protocol and error,
+    the numeric columns timesecs, num_streams, reverse, duration, failed,
+    sent_bps, received_bps, retransmits, bps, jitter_ms, lost_percent,
+    local_cpu_total and remote_cpu_total, and the derived columns
+    sent_Mbps, received_Mbps and Mbps.
+    """
+
+    # Text columns, dictionary encoded
+    _LABELS = ('remote_host', 'protocol', 'error')
+
+    # (column, type code)
+    _NUMBERS = (
+        ('timesecs', 'q'),
+        ('num_streams', 'q'),
+        ('reverse', 'q'),
+        ('duration', 'q'),
+        ('failed', 'q'),
+        ('sent_bps', 'd'),
+        ('received_bps', 'd'),
+        ('retransmits', 'd'),
+        ('bps', 'd'),
+        ('jitter_ms', 'd'),
+        ('lost_percent', 'd'),
+        ('local_cpu_total', 'd'),
+        ('remote_cpu_total', 'd'),
+    )
+
+    # Columns computed from other columns, (column, source, divisor)
+    _DERIVED = {
+        'sent_Mbps': ('sent_bps', 1e6),
+        'received_Mbps': ('received_bps', 1e6),
+        'Mbps': ('bps', 1e6),
+    }
+
+    def __init__(self, results=()):
+        """Initialise the result set
+
+        :param results: iterable of :class:`TestResult`
+        """
+        self._columns = dict(
+            (name, array(_INT_TYPECODE if typecode == 'q' else typecode))
+            for name, typecode in self._NUMBERS
+        )
+        for name in self._LABELS:
+            self._columns[name] = array(_INT_TYPECODE)
+        self._categories = dict((name, []) for name in self._LABELS)
+        self._codes = dict((name, {}) for name in self._LABELS)
+
+        # A subset made by take() copies its columns from the parent on
+        # first use, so grouping doesn't copy columns nobody aggregates
+        self._parent = None
+        self._rows = None
+
+        self.extend(results)
+
+    @classmethod
+    def from_columns(cls, **columns):
+        """Build a result set straight from columns
+
+        :param columns: sequences of equal length by column name, text
+            columns as sequences of strings. Missing columns are filled
+            with NaN, 0 or None.
+        :rtype: instance of :class:`ResultSet`
+        """
+        result_set = cls()
+        lengths = set(len(values) for values in columns.values())
+        if len(lengths) > 1:
+            raise ValueError('columns must have the same length')
+        length = lengths.pop() if lengths else 0
+
+        for name, typecode in cls._NUMBERS:
+            column = result_set._columns[name]
+            if name in columns:
+                values = columns[name]
+                if numpy is not None:
+                    _array_extend(column, numpy.ascontiguousarray(
+                        values, dtype=numpy.dtype(column.typecode)
+                    ).tobytes())
+                else:
+                    column.extend(values)
+            else:
+                column.extend(array(column.typecode,
+                                    [NAN if typecode == 'd' else 0]) * length)
+
+        for name in cls._LABELS:
+            column = result_set._columns[name]
+            if name not in columns:
+                column.extend(array(column.typecode,
+                                    [result_set._encode(name, None)]) * length)
+                continue
+            values = columns[name]
+            for value in dict.fromkeys(values):
+                result_set._encode(name, value)
+            column.extend(map(result_set._codes[name].__getitem__, values))
+
+        return result_set
+
+    def _encode(self, name, value):
+        """The dictionary code of a text value
+
+        :param name: name of the text column
+        :param value: the text value
+        :rtype: int
+        """
+        codes = self._codes[name]
+        try:
+            return codes[value]
+        except KeyError:
+            codes[value] = len(self._categories[name])
+            self._categories[name].append(value)
+            return codes[value]
+
+    def append(self, result):
+        """Add a test result
+
+        :param result: instance of :class:`TestResult`
+        """
+        if self._parent is not None:
+            for name in self._columns:
+                self._stored(name)
+            self._parent = self._rows = None
+
+        failed = bool(result.error)
+        for name, typecode in self._NUMBERS:
+            if name == 'failed':
+                value = failed
+            elif failed:
+                value = None
+            else:
+                value = getattr(result, name, None)
+
+            if value is None:
+                value = NAN if typecode == 'd' else 0
+            elif typecode == 'q':
+                value = int(value)
+            self._stored(name).append(value)
+
+        for name in self._LABELS:
+            value = None if failed and name != 'error' else getattr(
+                result, name, None
+            )
+            self._stored(name).append(self._encode(name, value))
+
+    def extend(self, results):
+        """Add test results
+
+        :param results: iterable of :class:`TestResult`
+        """
+        for result in results:
+            self.append(result)
+
+    def __len__(self):
+        if self._parent is not None:
+            return len(self._rows)
+        return len(self._columns['failed'])
+
+    @property
+    def columns(self):
+        """Names of all available columns"""
+        return (self._LABELS + tuple(name for name, _ in self._NUMBERS) +
+                tuple(sorted(self._DERIVED)))
+
+    def column(self, name):
+        """All values of a column
+
+        :param name: name of the column
+        :rtype: numpy.ndarray when NumPy is installed, else array.array for
+            numeric columns and a list for text columns
+        """
+        if name in self._DERIVED:
+            source, divisor = self._DERIVED[name]
+            values = self.column(source)
+            if numpy is not None:
+                return values / divisor
+            return array('d', [value / divisor for value in values])
+
+        if name not in self._columns:
+            raise KeyError('Unknown column {0}'.format(name))
+
+        values = self._stored(name)
+        if name in self._LABELS:
+            categories = self._categories[name]
+            if numpy is not None:
+                return numpy.array(categories, dtype=object)[
+                    self._numpy(name)
+                ]
+            return [categories[code] for code in values]
+
+        # A copy, a view would keep the column from growing
+        return self._numpy(name).copy() if numpy is not None else values
+
+    def _stored(self, name):
+        """A stored column, copied from the parent set on first use"""
+        values = self._columns[name]
+        if self._parent is not None and not len(values):
+            if numpy is not None:
+                _array_extend(values, self._parent._numpy(name)[self._rows]
+                              .tobytes())
+            else:
+                parent = self._parent._stored(name)
+                values.extend(parent[i] for i in self._rows)
+        return values
+
+    def _numpy(self, name):
+        """A stored column as NumPy array, without copying it"""
+        values = self._stored(name)
+        if not len(values):
+            return numpy.array([], dtype=numpy.dtype(values.typecode))
+        return numpy.frombuffer(values, dtype=numpy.dtype(values.typecode))
+
+    def _keys(self, name):
+        """Group keys of a column, codes for text columns"""
+        if numpy is not None:
+            return self._numpy(name)
+        return self._stored(name)
+
+    def take(self, indices):
+        """A new result set with the results at indices
+
+        :param indices: sequence of result positions
+        :rtype: instance of :class:`ResultSet`
+        """
+        subset = ResultSet()
+        subset._categories = self._categories
+        subset._codes = self._codes
+        subset._parent = self
+        if numpy is not None:
+            subset._rows = numpy.asarray(indices, dtype=numpy.intp)
+        else:
+            subset._rows = list(indices)
+        return subset
+
+    def groupby(self, *names):
+        """Split the results into groups with the same values
+
+        :param names: one or more column names, like 'remote_host',
+            'protocol', 'num_streams' or 'reverse'
+        :rtype: dict of {key: :class:`ResultSet`}, where key is the value
+            of the column, or a tuple of values when grouping on several
+            columns
+        """
+        if not names:
+            raise ValueError('groupby needs at least one column')
+
+        if numpy is not None and len(self):
+            # Combine the codes of all columns into one integer key, which
+            # numpy.unique sorts much faster than rows of several columns
+            uniques = []
+            combined = numpy.zeros(len(self), dtype=numpy.int64)
+            for name in names:
+                unique, codes = numpy.unique(self._keys(name),
+                                             return_inverse=True)
+                uniques.append(unique.tolist())
+                combined = combined * len(unique) + codes.reshape(-1)
+
+            unique, inverse = numpy.unique(combined, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            order = numpy.argsort(inverse, kind='stable')
+            bounds = numpy.cumsum(numpy.bincount(inverse))[:-1]
+            groups = zip(
+                (_split_key(key, uniques) for key in unique.tolist()),
+                numpy.split(order, bounds),
+            )
+        else:
+            positions = {}
+            columns = [self._keys(name) for name in names]
+            for index, key in enumerate(zip(*columns)):
+                positions.setdefault(key, []).append(index)
+            groups = positions.items()
+
+        result = {}
+        for key, indices in groups:
+            key = tuple(
+                self._categories[name][value] if name in self._LABELS
+                else value
+                for name, value in zip(names, key)
+            )
+            result[key if len(names) > 1 else key[0]] = self.take(indices)
+        return result
+
+    def _values(self, name):
+        """The values of a numeric column without NaNs"""
+        if numpy is not None and name not in self._DERIVED:
+            values = self._numpy(name)
+        else:
+            values = self.column(name)
+        if numpy is not None:
+            return values[~numpy.isnan(values)]
+        return [value for value in values if value == value]
+
+    def count(self, name):
+        """Amount of results with a value in a column
+
+        :rtype: int
+        """
+        return len(self._values(name))
+
+    def mean(self, name):
+        """Mean of a numeric column, ignoring missing values
+
+        :rtype: float, NaN without values
+        """
+        values = self._values(name)
+        if not len(values):
+            return NAN
+        if numpy is not None:
+            return float(values.mean())
+        return math.fsum(values) / len(values)
+
+    def std(self, name):
+        """Sample standard deviation of a numeric column
+
+        :rtype: float, NaN with less than two values
+        """
+        values = self._values(name)
+        if len(values) < 2:
+            return NAN
+        if numpy is not None:
+            return float(values.std(ddof=1))
+        mean = math.fsum(values) / len(values)
+        return math.sqrt(
+            math.fsum((value - mean) ** 2 for value in values) /
+            (len(values) - 1)
+        )
+
+    def percentile(self, name, q):
+        """Percentiles of a numeric column, ignoring missing values
+
+        Uses linear interpolation between the closest ranks.
+
+        :param name: name of the column
+        :param q: percentile or list of percentiles, between 0 and 100
+        :rtype: float or list of floats, NaN without values
+        """
+        values = self._values(name)
+        qs = q if isinstance(q, (list, tuple)) else [q]
+
+        if not len(values):
+            result = [NAN] * len(qs)
+        elif numpy is not None:
+            result = [float(value) for value in numpy.percentile(values, qs)]
+        else:
+            values = sorted(values)
+            result = []
+            for percent in qs:
+                rank = (len(values) - 1) * percent / 100.
+                low = int(math.floor(rank))
+                high = min(low + 1, len(values) - 1)
+                result.append(
+                    values[low] + (values[high] - values[low]) * (rank - low)
+                )
+
+        return result if isinstance(q, (list, tuple)) else result[0]
+
+    def confidence_interval(self, name, confidence=.95):
+        """Confidence interval of the mean of a numeric column
+
+        Uses the normal approximation, which holds for the amounts of
+        results this class is meant for.
+
+        :param name: name of the column
+        :param confidence: confidence level, between 0 and 1
+        :rtype: tuple of (low, high), NaNs with less than two values
+        """
+        count = self.count(name)
+        if count < 2:
+            return NAN, NAN
+
+        mean = self.mean(name)
+        margin = _z_score(confidence) * self.std(name) / math.sqrt(count)
+        return mean - margin, mean + margin
+
+
+def _split_key(key, uniques):
+    """Split a combined group key back into the values of its columns
+
+    :param key: the combined key, an integer in mixed radix
+    :param uniques: list of the unique values of every column
+    :rtype: tuple
+    """
+    values = []
+    for unique in reversed(uniques):
+        key, index = divmod(key, len(unique))
+        values.append(unique[index])
+    return tuple(reversed(values))
+
+
+def _z_score(confidence):
+    """The two-sided z score of a confidence level
+
+    :param confidence: confidence level, between 0 and 1
+    :rtype: float
+    """
+    if not 0 < confidence < 1:
+        raise ValueError('confidence must be between 0 and 1')
+
+    if NormalDist is not None:
+        return NormalDist().inv_cdf(.5 + confidence / 2)
+
+    try:
+        return _Z_SCORES[confidence]
+    except KeyError:
+        raise ValueError('confidence must be one of {0} on this Python '
+                         'version'.format(sorted(_Z_SCORES)))
+
+
+# Result archive file layout, all values little endian:
+#
+# header: magic, format version
+# records, each: record size (excluding the size itself), summary, strings,
+#     interval columns
+#
+# The summary is fixed width. Its flags and a bitmask of the numbers the
+# test reported are followed by the numbers, the length of every string
+# (_ARCHIVE_NONE for None) and the amount of intervals. Interval columns
+# follow the strings, each as an encoding byte plus the encoded values.
+_ARCHIVE_MAGIC = b'IPERF3RA'
+_ARCHIVE_VERSION = 1
+_ARCHIVE_HEADER = struct.Struct('<8sH6x')
+_ARCHIVE_SIZE = struct.Struct('<I')
+_ARCHIVE_NONE = 0xFFFFFFFF
+
+# Summary numbers, (attribute, struct format)
+_ARCHIVE_NUMBERS = (
+    ('timesecs', 'q'), ('local_port', 'i'), ('remote_port', 'i'),
+    ('num_streams', 'i'), ('blksize', 'q'), ('omit', 'i'),
+    ('duration', 'i'), ('tcp_mss_default', 'i'),
+    ('local_cpu_total', 'd'), ('local_cpu_user', 'd'),
+    ('local_cpu_system', 'd'), ('remote_cpu_total', 'd'),
+    ('remote_cpu_user', 'd'), ('remote_cpu_system', 'd'),
+    ('sent_bytes', 'q'), ('sent_bps', 'd'), ('received_bytes', 'q'),
+    ('received_bps', 'd'), ('retransmits', 'q'),
+    ('bytes', 'q'), ('bps', 'd'), ('jitter_ms', 'd'), ('packets', 'q'),
+    ('lost_packets', 'q'), ('lost_percent', 'd'), ('seconds', 'd'),
+)
+_ARCHIVE_STRINGS = ('error', 'time', 'version', 'system_info', 'local_host',
+                    'remote_host', 'protocol')
+_ARCHIVE_SUMMARY = struct.Struct(
+    '<BI' + ''.join(code for _, code in _ARCHIVE_NUMBERS) +
+    'I' * len(_ARCHIVE_STRINGS) + 'I'
+)
+
+# Summary flags
+_ARCHIVE_STOPPED_EARLY = 1
+_ARCHIVE_REVERSE = 2
+_ARCHIVE_CLIENT = 4
+_ARCHIVE_SERVER = 8
+_ARCHIVE_INTERVALS = 16
+
+# Interval column encodings: integer deltas of 1, 2, 4 or 8 bytes, or
+_ARCHIVE_ABSENT = 0  # column not reported
+_ARCHIVE_CHAINED = 0xFE  # start column, equal to the previous end
+_ARCHIVE_FLOATS = 0xFF  # raw doubles
+_ARCHIVE_DELTA_TYPECODES = {1: 'b', 2: 'h', 4: 'i', 8: _INT_TYPECODE}
+_ARCHIVE_DOUBLE = struct.Struct('<d')
+
+
+class ArchiveWriter(object):
+    """Appends test results to a compact binary archive file.
+
+    Every result is stored as a fixed width summary plus delta encoded
+    interval columns, taking a few percent of the space of the json
+    output. Per stream results and the raw text are not stored. Records
+    are only ever appended, so several runs can add to one archive.
+    Read the archive back with :class:`ArchiveReader`.
+
+    Basic Usage::
+
+      >>> with iperf3.ArchiveWriter('results.ipa') as archive:
+      ...     archive.write(client.run())
+    """
+
+    def __init__(self, path):
+        """Open the archive, creating it when it doesn't exist
+
+        :param path: path of the archive file
+        """
+        self.path = path
+        self._file = open(path, 'ab')
+
+        if self._file.tell() == 0:
+            self._file.write(_ARCHIVE_HEADER.pack(_ARCHIVE_MAGIC,
+                                                  _ARCHIVE_VERSION))
+        else:
+            with open(path, 'rb') as f:
+                header = f.read(_ARCHIVE_HEADER.size)
+            try:
+                _check_archive_header(header)
+            except ValueError:
+                self._file.close()
+                raise
+
+    def write(self, result):
+        """Append a test result
+
+        :param result: instance of :class:`TestResult`
+        """
+        self._file.write(_archive_record(result))
+
+    def flush(self):
+        """Write buffered records to the file"""
+        self._file.flush()
+
+    def close(self):
+        """Flush and close the archive file"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ArchiveReader(object):
+    """Reads test results from an archive written by :class:`ArchiveWriter`.
+
+    The file is memory mapped, so archives larger than the memory of the
+    machine can be scanned. Results are decoded one at a time when
+    indexed or iterated. A partially written last record is ignored.
+
+    Basic Usage::
+
+      >>> with iperf3.ArchiveReader('results.ipa') as archive:
+      ...     results = iperf3.ResultSet(archive.results(intervals=False))
+      ...     print(len(archive), results.mean('sent_Mbps'))
+    """
+
+    def __init__(self, path):
+        """Open and map the archive
+
+        :param path: path of the archive file
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            _check_archive_header(self._file.read(_ARCHIVE_HEADER.size))
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        # Offsets of the complete records
+        self._offsets = array(_INT_TYPECODE)
+        offset = _ARCHIVE_HEADER.size
+        size = len(self._map)
+        while offset + _ARCHIVE_SIZE.size <= size:
+            end = (offset + _ARCHIVE_SIZE.size +
+                   _ARCHIVE_SIZE.unpack_from(self._map, offset)[0])
+            if end > size:
+                break
+            self._offsets.append(offset)
+            offset = end
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        return self.read(index)
+
+    def __iter__(self):
+        return self.results()
+
+    def read(self, index, intervals=True):
+        """Decode a test result
+
+        :param index: position of the result in the archive
+        :param intervals: decode the intervals, skipping them is faster
+            when only the summary is needed
+        :rtype: instance of :class:`TestResult`
+        """
+        if index < 0:
+            index += len(self._offsets)
+        if not 0 <= index < len(self._offsets):
+            raise IndexError('archive index out of range')
+        return _archive_result(self._map, self._offsets[index], intervals)
+
+    def results(self, intervals=True):
+        """Decode all test results in order
+
+        :param intervals: decode the intervals of every result
+        :rtype: iterator of :class:`TestResult`
+        """
+        for offset in self._offsets:
+            yield _archive_result(self._map, offset, intervals)
+
+    def close(self):
+        """Unmap and close the archive file"""
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _check_archive_header(header):
+    """Raise ValueError when a file header isn't a supported archive header
+
+    :param header: the first bytes of the file
+    """
+    if len(header) < _ARCHIVE_HEADER.size:
+        raise ValueError('not an iperf3 result archive')
+    magic, version = _ARCHIVE_HEADER.unpack(header)
+    if magic != _ARCHIVE_MAGIC:
+        raise ValueError('not an iperf3 result archive')
+    if version != _ARCHIVE_VERSION:
+        raise ValueError(
+            'unsupported archive format version {0}'.format(version)
+        )
+
+
+def _archive_record(result):
+    """Encode a test result as an archive record
+
+    :param result: instance of :class:`TestResult`
+    :rtype: bytes
+    """
+    summary = result.to_dict()
+    intervals = result.intervals
+
+    flags = 0
+    if summary.get('stopped_early'):
+        flags |= _ARCHIVE_STOPPED_EARLY
+    if summary.get('reverse'):
+        flags |= _ARCHIVE_REVERSE
+    if summary.get('type') == 'client':
+        flags |= _ARCHIVE_CLIENT
+    elif summary.get('type') == 'server':
+        flags |= _ARCHIVE_SERVER
+    if intervals is not None:
+        flags |= _ARCHIVE_INTERVALS
+
+    present = 0
+    numbers = []
+    for bit, (name, code) in enumerate(_ARCHIVE_NUMBERS):
+        value = summary.get(name)
+        if value is None:
+            value = 0
+        else:
+            present |= 1 << bit
+        numbers.append(float(value) if code == 'd' else int(value))
+
+    strings = [
+        None if summary.get(name) is None
+        else summary[name].encode('utf-8')
+        for name in _ARCHIVE_STRINGS
+    ]
+
+    parts = [_ARCHIVE_SUMMARY.pack(*(
+        [flags, present] + numbers +
+        [_ARCHIVE_NONE if value is None else len(value) for value in strings] +
+        [len(intervals) if intervals is not None else 0]
+    ))]
+    parts.extend(value for value in strings if value is not None)
+    if intervals is not None:
+        parts.extend(_archive_columns(intervals))
+
+    record = b''.join(parts)
+    return _ARCHIVE_SIZE.pack(len(record)) + record
+
+
+def _archive_columns(intervals):
+    """Encode the interval columns
+
+    Integer columns, and floating point columns holding only whole
+    numbers like snd_cwnd and rtt, are stored as deltas of the smallest
+    width that fits them. The start column is usually the end column
+    shifted by one interval and is then stored as its first value only.
+
+    :param intervals: instance of :class:`Intervals`
+    :rtype: list of bytes
+    """
+    if numpy is not None:
+        return _archive_numpy_columns(intervals)
+
+    columns = {}
+    for name, _, _ in Intervals._COLUMNS:
+        column = getattr(intervals, name)
+        if column is not None:
+            column = column.tolist()
+        columns[name] = column
+
+    parts = []
+    for name, _, _ in Intervals._COLUMNS:
+        values = columns[name]
+        if values is None:
+            parts.append(struct.pack('<B', _ARCHIVE_ABSENT))
+        elif (name == 'start' and values and
+                values[1:] == columns['end'][:-1]):
+            parts.append(struct.pack('<Bd', _ARCHIVE_CHAINED, values[0]))
+        elif all(_whole(value) for value in values):
+            deltas = [int(value) - int(previous) for value, previous
+                      in zip(values, [0] + values[:-1])]
+            width = _delta_width(min(deltas or [0]), max(deltas or [0]))
+            packed = array(_ARCHIVE_DELTA_TYPECODES[width], deltas)
+            if sys.byteorder == 'big':
+                packed.byteswap()
+            parts.append(struct.pack('<B', width))
+            parts.append(_array_bytes(packed))
+        else:
+            packed = array('d', values)
+            if sys.byteorder == 'big':
+                packed.byteswap()
+            parts.append(struct.pack('<B', _ARCHIVE_FLOATS))
+            parts.append(_array_bytes(packed))
+    return parts
+
+
+def _archive_numpy_columns(intervals):
+    """Encode the interval columns with NumPy, see :func:`_archive_columns`
+
+    :param intervals: instance of :class:`Intervals`
+    :rtype: list of bytes
+    """
+    parts = []
+    for name, _, _ in Intervals._COLUMNS:
+        values = getattr(intervals, name)
+        if values is None:
+            parts.append(struct.pack('<B', _ARCHIVE_ABSENT))
+            continue
+
+        values = numpy.asarray(values)
+        if (name == 'start' and len(values) and
+                numpy.array_equal(values[1:], intervals.end[:-1])):
+            parts.append(struct.pack('<Bd', _ARCHIVE_CHAINED, values[0]))
+            continue
+
+        if values.dtype.kind == 'f':
+            whole = bool(numpy.all(
+                (numpy.abs(values) < 2 ** 53) & (values == numpy.trunc(values))
+            ))
+        else:
+            whole = True
+
+        if whole:
+            deltas = numpy.diff(values.astype(numpy.int64), prepend=0)
+            width = _delta_width(int(deltas.min()) if len(deltas) else 0,
+                                 int(deltas.max()) if len(deltas) else 0)
+            parts.append(struct.pack('<B', width))
+            parts.append(deltas.astype('<i{0}'.format(width)).tobytes())
+        else:
+            parts.append(struct.pack('<B', _ARCHIVE_FLOATS))
+            parts.append(values.astype('<f8').tobytes())
+    return parts
+
+
+def _whole(value):
+    """Whether a value is stored exactly as a 64 bit integer
+
+    :rtype: bool
+    """
+    if isinstance(value, float):
+        return value.is_integer() and abs(value) < 2 ** 53
+    return True
+
+
+def _delta_width(low, high):
+    """The smallest integer width in bytes that holds all deltas
+
+    :param low: the smallest delta
+    :param high: the largest delta
+    :rtype: 1, 2, 4 or 8
+    """
+    for width in (1, 2, 4):
+        limit = 1 << (8 * width - 1)
+        if -limit <= low and high < limit:
+            return width
+    return 8
+
+
+def _archive_result(buffer, offset, intervals=True):
+    """Decode the archive record at offset
+
+    :param buffer: the memory mapped archive
+    :param offset: offset of the record
+    :param intervals: decode the intervals
+    :rtype: instance of :class:`TestResult`
+    """
+    offset += _ARCHIVE_SIZE.size
+    fields = _ARCHIVE_SUMMARY.unpack_from(buffer, offset)
+    offset += _ARCHIVE_SUMMARY.size
+
+    flags, present = fields[:2]
+    summary = {'stopped_early': bool(flags & _ARCHIVE_STOPPED_EARLY)}
+    if flags & (_ARCHIVE_CLIENT | _ARCHIVE_SERVER):
+        summary['reverse'] = bool(flags & _ARCHIVE_REVERSE)
+        summary['type'] = 'client' if flags & _ARCHIVE_CLIENT else 'server'
+
+    numbers = fields[2:2 + len(_ARCHIVE_NUMBERS)]
+    for bit, (name, _) in enumerate(_ARCHIVE_NUMBERS):
+        if present & (1 << bit):
+            summary[name] = numbers[bit]
+
+    lengths = fields[2 + len(_ARCHIVE_NUMBERS):-1]
+    for name, length in zip(_ARCHIVE_STRINGS, lengths):
+        if length == _ARCHIVE_NONE:
+            continue
+        summary[name] = buffer[offset:offset + length].decode('utf-8')
+        offset += length
+
+    columns = None
+    if intervals and flags & _ARCHIVE_INTERVALS:
+        columns = _archive_intervals(buffer, offset, fields[-1])
+
+    return TestResult.from_dict(summary, intervals=columns)
+
+
+def _archive_intervals(buffer, offset, count):
+    """Decode the interval columns of a record
+
+    :param buffer: the memory mapped archive
+    :param offset: offset of the first interval column
+    :param count: amount of intervals
+    :rtype: instance of :class:`Intervals`
+    """
+    columns = {}
+    chained = None
+    for name, typecode, _ in Intervals._COLUMNS:
+        encoding = buffer[offset:offset + 1][0]
+        if not isinstance(encoding, int):
+            encoding = ord(encoding)  # Python2 compatibility
+        offset += 1
+
+        if encoding == _ARCHIVE_ABSENT:
+            columns[name] = None
+        elif encoding == _ARCHIVE_CHAINED:
+            chained = _ARCHIVE_DOUBLE.unpack_from(buffer, offset)[0]
+            offset += _ARCHIVE_DOUBLE.size
+        elif encoding == _ARCHIVE_FLOATS:
+            columns[name] = _archive_array(buffer, offset, 'd', count)
+            offset += 8 * count
+        else:
+            deltas = _archive_array(
+                buffer, offset, _ARCHIVE_DELTA_TYPECODES[encoding], count
+            )
+            offset += encoding * count
+            if numpy is not None:
+                columns[name] = deltas.astype(numpy.int64).cumsum().astype(
+                    numpy.float64 if typecode == 'd' else numpy.int64
+                )
+            else:
+                total = 0
+                values = []
+                for delta in deltas:
+                    total += delta
+                    values.append(total)
+                columns[name] = _column(typecode, values)
+
+    if chained is not None:
+        end = columns['end']
+        if numpy is not None:
+            columns['start'] = numpy.concatenate(([chained], end[:-1]))
+        else:
+            columns['start'] = array('d', [chained]) + end[:-1]
+
+    return Intervals(**columns)
+
+
+def _archive_array(buffer, offset, typecode, count):
+    """Copy little endian values out of the archive
+
+    :param buffer: the memory mapped archive
+    :param offset: offset of the first value
+    :param typecode: array.array type code of the values
+    :param count: amount of values
+    :rtype: numpy.ndarray when NumPy is installed, else array.array
+    """
+    if numpy is not None:
+        dtype = numpy.dtype(typecode).newbyteorder('<')
+        return numpy.frombuffer(buffer, dtype=dtype, count=count,
+                                offset=offset).astype(dtype.newbyteorder('='))
+
+    values = array(typecode)
+    _array_extend(values, buffer[offset:offset + values.itemsize * count])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class JSONLinesWriter(object):
+    """Appends test results to a JSON lines file, one result per line.
+
+    Every line is a normalised record: the summary of the result as
+    returned by :meth:`TestResult.to_dict`, plus its intervals as lists
+    per column unless disabled. Missing floating point values are written
+    as null. Lines are buffered up to buffer_size bytes before they are
+    written to the file.
+
+    Basic Usage::
+
+      >>> with iperf3.JSONLinesWriter('results.jsonl', sync='flush') as out:
+      ...     out.write(client.run())
+
+    :param sync: when to fsync the file: None to leave it to the operating
+        system, 'close' when the writer is closed, 'flush' after every
+        write of the buffer to the file or 'write' after every result
+    """
+
+    _SYNC = (None, 'close', 'flush', 'write')
+
+    def __init__(self, path, buffer_size=PIPE_CHUNK_SIZE, sync=None,
+                 intervals=True):
+        """Open the file for appending
+
+        :param path: path of the file, or a file object opened for writing
+            text
+        :param buffer_size: amount of bytes to buffer before writing
+        :param sync: fsync policy, see above
+        :param intervals: include the intervals of every result
+        """
+        if sync not in self._SYNC:
+            raise ValueError('sync must be one of {0}'.format(self._SYNC))
+
+        self.buffer_size = buffer_size
+        self.sync = sync
+        self.intervals = intervals
+
+        self._owns_file = not hasattr(path, 'write')
+        if self._owns_file:
+            self._file = io.open(path, 'a', encoding='utf-8')
+        else:
+            self._file = path
+        self._buffer = []
+        self._buffered = 0
+
+    def write(self, result):
+        """Append a test result
+
+        :param result: instance of :class:`TestResult`, or a record dict
+            as yielded by :meth:`JSONLinesReader.records`
+        """
+        if isinstance(result, dict):
+            record = result
+        else:
+            record = _jsonl_record(result, self.intervals)
+
+        line = json.dumps(record, allow_nan=False, separators=(',', ':'))
+        self._buffer.append(line + '\n')
+        self._buffered += len(line) + 1
+
+        if self.sync == 'write' or self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered results to the file"""
+        if self._buffer:
+            self._file.write(u''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self._file.flush()
+        if self.sync in ('flush', 'write'):
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Flush, and close the file when it was opened by the writer"""
+        self.flush()
+        if self.sync == 'close':
+            os.fsync(self._file.fileno())
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class JSONLinesReader(object):
+    """Reads test results from a file written by :class:`JSONLinesWriter`.
+
+    Lines are read and decoded one at a time, so files of any size are
+    processed in constant memory. A partially written last line is
+    ignored.
+
+    Basic Usage::
+
+      >>> with iperf3.JSONLinesReader('results.jsonl') as results:
+      ...     for result in results:
+      ...         print(result.remote_host, result.sent_Mbps)
+    """
+
+    def __init__(self, path):
+        """Open the file
+
+        :param path: path of the file, or a file object opened for reading
+            text
+        """
+        self._owns_file = not hasattr(path, 'read')
+        if self._owns_file:
+            self._file = io.open(path, encoding='utf-8')
+        else:
+            self._file = path
+
+    def records(self):
+        """Decode the records, without building results
+
+        :rtype: iterator of dicts as written by :class:`JSONLinesWriter`
+        """
+        for line in self._file:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                if line.endswith('\n'):
+                    raise
+                return  # partially written last line
+
+    def results(self, intervals=True):
+        """Decode the test results
+
+        :param intervals: build the :class:`Intervals` of every result
+        :rtype: iterator of :class:`TestResult`
+        """
+        for record in self.records():
+            yield _jsonl_result(record, intervals)
+
+    def __iter__(self):
+        return self.results()
+
+    def close(self):
+        """Close the file when it was opened by the reader"""
+        if self._owns_file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _jsonl_record(result, intervals=True):
+    """The normalised JSON lines record of a test result
+
+    :param result: instance of :class:`TestResult`
+    :param intervals: include the intervals
+    :rtype: dict
+    """
+    record = dict(
+        (name, _json_value(value))
+        for name, value in result.to_dict().items()
+    )
+
+    columns = result.intervals if intervals else None
+    if columns is not None:
+        record['intervals'] = dict(
+            (name, None if getattr(columns, name) is None else
+             [_json_value(value) for value in getattr(columns, name).tolist()])
+            for name, _, _ in Intervals._COLUMNS
+        )
+    return record
+
+
+def _jsonl_result(record, intervals=True):
+    """Build a test result from a JSON lines record
+
+    :param record: dict as written by :class:`JSONLinesWriter`
+    :param intervals: build the intervals
+    :rtype: instance of :class:`TestResult`
+    """
+    summary = dict(record)
+    columns = summary.pop('intervals', None)
+
+    if intervals and columns is not None:
+        columns = Intervals(**dict(
+            (name, None if columns.get(name) is None else
+             _column(typecode, columns[name]))
+            for name, typecode, _ in Intervals._COLUMNS
+        ))
+    else:
+        columns = None
+
+    return TestResult.from_dict(summary, intervals=columns)
+
+
+def _json_value(value):
+    """A value that is valid JSON, None for NaN and infinity"""
+    if isinstance(value, float) and (math.isnan(value) or
+                                     math.isinf(value)):
+        return None
+    return value
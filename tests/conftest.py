@@ -0,0 +1,7 @@
+import sys
+
+# the asyncio tests use async syntax and asyncio.run, only collect them on
+# the Pythons having those
+collect_ignore = []
+if sys.version_info < (3, 7):
+    collect_ignore.append('test_iperf3_async.py')
@@ -2,11 +2,61 @@ import os
 import iperf3
 import pytest
 import subprocess
-from time import sleep
+import threading
+import json
+from time import sleep, time
 
 def isclose(a, b, rel_tol=1e-09, abs_tol=0.0):
     return abs(a-b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
 
+class FakeLib(object):
+    """Stands in for libiperf, keeping the iperf_test struct in a dict"""
+
+    def __init__(self):
+        self.calls = []
+        self.struct = {}
+        self.files = 0
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def function(*args):
+            self.calls.append(name)
+            if name == 'iperf_defaults':
+                self.struct.update(
+                    role=b's', server_port=5201, duration=10,
+                    protocol_id=1, blksize=131072, rate=0, omit=0,
+                    num_streams=1, json_output=0, verbose=0,
+                    reverse=0, connect_timeout=-1)
+            elif name == 'iperf_open_logfile' or name.startswith('iperf_run_'):
+                # like the libiperf releases opening the logfile on every run
+                self.files += 1
+                self.struct['outfile'] = self.files
+                return 0
+            elif name.startswith('iperf_get_'):
+                return self.struct.get(name.split('_', 3)[-1])
+            elif name.startswith('iperf_set_'):
+                self.struct[name.split('_', 3)[-1]] = args[1]
+        return function
+
+
+def fake_library(monkeypatch):
+    """Register a :class:`FakeLib` with every capability as lib_name 'fake'"""
+    lib = FakeLib()
+    capabilities = object.__new__(iperf3.Capabilities)
+    for attribute, _ in iperf3.iperf3._CAPABILITY_FUNCTIONS:
+        setattr(capabilities, attribute, True)
+    monkeypatch.setitem(iperf3.iperf3._libraries, 'fake', lib)
+    monkeypatch.setitem(iperf3.iperf3._capabilities, lib, capabilities)
+    return lib
+
+
+def worker_pid(args):
+    """Stands in for the test of a ClientProcessPool worker"""
+    return json.dumps({'error': str(os.getpid())})
+
+
 class TestPyPerf:
 
     def test_init_client(self):
@@ -21,6 +71,13 @@ class TestPyPerf:
         client = iperf3.Client(lib_name='libiperf.so.0')
         assert client._test
 
+    def test_shared_library(self):
+        """All instances share one set of libiperf bindings"""
+        client = iperf3.Client()
+        server = iperf3.Server()
+        assert client.lib is server.lib
+        assert client.lib is iperf3.iperf3.load_library()
+
     def test_run_not_implemented(self):
         with pytest.raises(NotImplementedError):
             client = iperf3.IPerf3(role='c')
@@ -96,6 +153,30 @@ class TestPyPerf:
         client = iperf3.Client()
         assert 'iperf' in client.iperf_version
 
+    def test_capabilities(self):
+        client = iperf3.Client()
+        server = iperf3.Server()
+        assert client.capabilities is server.capabilities
+        assert client.capabilities.version_info[0] == 3
+        if client.capabilities.version_info >= (3, 1):
+            assert client.capabilities.own_output
+
+    def test_capabilities_probe(self):
+        import ctypes
+        capabilities = iperf3.iperf3.Capabilities(ctypes.CDLL(None))
+        assert capabilities.version is None
+        assert capabilities.version_info == ()
+        assert not capabilities.own_output
+        assert capabilities.streaming is None
+
+    def test_parse_version(self):
+        parse_version = iperf3.iperf3._parse_version
+        assert parse_version('iperf 3.1.3') == (3, 1, 3)
+        assert parse_version('iperf 3.10') == (3, 10)
+        assert parse_version('iperf 3.1b3') == (3, 1)
+        assert parse_version('iperf 3.17.1+') == (3, 17, 1)
+        assert parse_version(None) == ()
+
     def test_blksize(self):
         client = iperf3.Client()
         client.blksize = 666
@@ -227,6 +308,208 @@ class TestPyPerf:
         assert response.type == 'client'
         assert response.__repr__()
 
+    def test_concurrent_client_runs(self):
+        """Clients running in threads of one process don't interfere"""
+        ports = [5209, 5210]
+        servers = [subprocess.Popen(["iperf3", "-s", "-p", str(port)])
+                   for port in ports]
+        sleep(.3)  # give the servers some time to start
+
+        responses = {}
+
+        def run(port):
+            client = iperf3.Client()
+            client.server_hostname = '127.0.0.1'
+            client.port = port
+            client.duration = 1
+            responses[port] = client.run()
+
+        threads = [threading.Thread(target=run, args=[port])
+                   for port in ports]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for server in servers:
+            server.kill()
+
+        for port in ports:
+            assert not responses[port].error
+            assert responses[port].remote_port == port
+
+    def test_client_pool(self):
+        servers = [subprocess.Popen(["iperf3", "-s", "-p", str(port)])
+                   for port in (5211, 5212)]
+        sleep(.3)  # give the servers some time to start
+
+        pool = iperf3.ClientPool(max_workers=4)
+        results = pool.run([
+            {'server_hostname': '127.0.0.1', 'port': port, 'duration': 1}
+            for port in (5211, 5212, 5211, 5213)
+        ])
+        for server in servers:
+            server.kill()
+
+        assert [result.remote_port for result in results[:3]] == [
+            5211, 5212, 5211]
+        assert "unable to connect to server" in results[3].error
+
+    def test_client_pool_max_per_server(self):
+        """Tests against the same server never overlap"""
+        running = {}
+        overlaps = []
+        lock = threading.Lock()
+
+        class FakeClient(object):
+            def __init__(self, config):
+                self.destination = config['port']
+
+            def run(self):
+                with lock:
+                    running[self.destination] = running.get(
+                        self.destination, 0) + 1
+                    if running[self.destination] > 1:
+                        overlaps.append(self.destination)
+                sleep(.01)
+                with lock:
+                    running[self.destination] -= 1
+                return self.destination
+
+        class FakePool(iperf3.ClientPool):
+            def _client(self, config):
+                return FakeClient(config)
+
+        pool = FakePool(max_workers=8)
+        results = pool.run([{'port': port % 3} for port in range(30)])
+
+        assert results == [port % 3 for port in range(30)]
+        assert not overlaps
+
+    def test_concurrent_client_errors(self, monkeypatch):
+        """Clients failing at the same time each report their own error"""
+        import ctypes
+        lib = fake_library(monkeypatch)
+        lock = threading.Lock()
+        failed = []
+        i_errno = [0]  # shared by all tests, like in libiperf
+        output = threading.local()
+
+        def run_client(test):
+            with lock:
+                failed.append(threading.current_thread())
+                number = len(failed)
+            i_errno[0] = number
+            output.json = ctypes.create_string_buffer(
+                ('{"error": "client %d failed"}' % number).encode('utf-8'))
+            sleep(.1)  # the other clients fail in the meantime
+            return -1
+
+        # the clients share the struct of the fake, keep them off its outfile
+        lib.iperf_open_logfile = lambda test: 0
+        lib.iperf_run_client = run_client
+        lib.iperf_get_test_json_output_string = \
+            lambda test: ctypes.addressof(output.json)
+        lib.iperf_strerror = lambda error_id: ('error %d' % error_id).encode()
+        monkeypatch.setattr(iperf3.IPerf3, '_errno',
+                            property(lambda self: i_errno[0]))
+
+        results = []
+        clients = [iperf3.Client(lib_name='fake') for _ in range(4)]
+        threads = [
+            threading.Thread(target=lambda c=c: results.append(c.run()))
+            for c in clients
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(result.error for result in results) == [
+            'client %d failed' % number for number in range(1, 5)]
+
+    def test_client_pool_busy_server(self):
+        """Busy servers are retried later and tests move to other ports"""
+        busy_ports = {5201: 3}
+        runs = []
+        lock = threading.Lock()
+
+        class FakeClient(object):
+            def __init__(self, config):
+                self.port = config.get('port', 5201)
+
+            def run(self):
+                with lock:
+                    runs.append(self.port)
+                    if busy_ports.get(self.port):
+                        busy_ports[self.port] -= 1
+                        return 'busy'
+                sleep(.01)
+                return self.port
+
+        class FakePool(iperf3.ClientPool):
+            def _client(self, config):
+                return FakeClient(config)
+
+            @staticmethod
+            def _server_busy(client, result):
+                return result == 'busy'
+
+        # A busy server is retried until it has room
+        pool = FakePool(retries=5, backoff=.01)
+        assert pool.run([{'server_hostname': 'hub'}]) == [5201]
+        assert runs == [5201] * 4
+
+        # Give up once the retries are used up
+        busy_ports[5201] = 3
+        pool = FakePool(retries=1, backoff=.01)
+        assert pool.run([{'server_hostname': 'hub'}]) == ['busy']
+
+        # Tests against a host with several ports avoid the busy one
+        busy_ports[5201] = 100
+        del runs[:]
+        pool = FakePool(max_workers=2, retries=5, backoff=10,
+                        ports={'hub': [5201, 5202]})
+        results = pool.run([{'server_hostname': 'hub'}] * 4)
+        assert results == [5202] * 4
+        assert runs.count(5201) == 1
+
+    def test_client_process_pool(self):
+        servers = [subprocess.Popen(["iperf3", "-s", "-p", str(port)])
+                   for port in (5214, 5215)]
+        sleep(.3)  # give the servers some time to start
+
+        pool = iperf3.ClientProcessPool(processes=2)
+        results = pool.run([
+            {'server_hostname': '127.0.0.1', 'port': port, 'duration': 1}
+            for port in (5214, 5215)
+        ])
+        for server in servers:
+            server.kill()
+
+        assert [result.remote_port for result in results] == [5214, 5215]
+
+    def test_client_process_pool_reuse(self, monkeypatch):
+        monkeypatch.setattr(iperf3.iperf3, '_run_client_process', worker_pid)
+
+        with iperf3.ClientProcessPool(processes=2, cpus=[]) as pool:
+            results = pool.run([{}] * 4) + pool.run([{}] * 4)
+            assert pool._pool is not None
+        assert pool._pool is None
+
+        # both runs are served by the same two worker processes
+        pids = set(result.error for result in results)
+        assert len(pids) <= 2 and str(os.getpid()) not in pids
+
+    def test_client_process_without_output(self, monkeypatch):
+        lib = fake_library(monkeypatch)
+        monkeypatch.setattr(iperf3.iperf3, '_process_clients', {})
+
+        output = iperf3.iperf3._run_client_process(
+            ({'json_output': False}, 'fake'))
+        assert output is None
+        assert 'iperf_reset_test' not in lib.calls
+        iperf3.iperf3._process_clients['fake'].close()
+
     def test_server_failed_run(self):
         """This test will launch two server instances on the same ip:port
         to generate an error"""
@@ -264,6 +547,368 @@ class TestPyPerf:
         else:
             assert response.error == 'the client has unexpectedly closed the connection'
 
+    def test_server_serve(self):
+        server = iperf3.Server()
+        server.bind_address = '127.0.0.1'
+        server.port = 5221
+
+        client = subprocess.Popen(
+            'sleep .5 && iperf3 -c 127.0.0.1 -p 5221 -t 1 && '
+            'iperf3 -c 127.0.0.1 -p 5221 -t 1',
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        results = list(server.serve(count=2))
+        client.wait()
+
+        assert len(results) == 2
+        assert server._worker is not None  # reused by the next run
+
+    def test_server_serve_close(self):
+        server = iperf3.Server()
+        server.bind_address = '127.0.0.1'
+        server.port = 5222
+
+        client = subprocess.Popen(
+            'sleep .5 && iperf3 -c 127.0.0.1 -p 5222 -t 1',
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        results = server.serve()
+        assert next(results) is not None
+        client.wait()
+
+        # the worker already listens for the next client, closing stops it
+        results.close()
+        sleep(.5)
+        assert not server._serve_forever
+        assert not server._serve_active
+
+    def test_server_close_before_listening(self, monkeypatch):
+        """A test stopped before it listens is stopped once it does"""
+        fake_library(monkeypatch)
+        server = iperf3.Server(lib_name='fake')
+        started = threading.Event()
+        listening = threading.Event()
+        aborted = threading.Event()
+
+        def run_once():
+            started.set()
+            listening.wait(5)
+            aborted.wait(5)  # a client that never comes
+            return None
+
+        def abort():
+            if listening.is_set():
+                aborted.set()
+            return aborted.is_set()
+
+        server._run_once = run_once
+        server._abort = abort
+        server._request()
+        assert started.wait(5)
+
+        threading.Timer(.3, listening.set).start()
+        start = time()
+        server.close()
+        assert aborted.is_set()
+        assert time() - start < 2
+        assert server._worker is None
+
+    def test_client_max_runtime(self):
+        """A server that never answers doesn't hang the client"""
+        import socket
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 5226))
+        listener.listen(1)
+
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5226
+        client.duration = 1
+        client.connect_timeout = 1000
+        client.max_runtime = .5
+
+        start = time()
+        response = client.run()
+        listener.close()
+
+        assert response.error
+        assert time() - start < 5
+        # the struct has been reset, keeping the settings of the client
+        assert client.role == 'c'
+        assert client.duration == 1
+        assert client.port == 5226
+
+    def test_client_cancel(self):
+        import socket
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 5227))
+        listener.listen(1)
+
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5227
+        assert not client.cancel()
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(client.run()))
+        thread.start()
+        sleep(.5)
+        assert client.cancel()
+        thread.join(5)
+        listener.close()
+
+        assert not thread.is_alive()
+        assert results[0].error
+
+    def test_client_close(self):
+        with iperf3.Client() as client:
+            client.duration = 1
+        assert client._test is None
+        client.close()  # closing twice is fine
+
+        with pytest.raises(ValueError):
+            client.duration
+
+    def test_client_reuse(self):
+        server = subprocess.Popen(["iperf3", "-s", "-p", "5228"])
+        sleep(.3)  # give the server some time to start
+
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5228
+        client.duration = 1
+        client.num_streams = 2
+        first = client.run()
+        fds = len(os.listdir('/proc/self/fd'))
+        second = client.run()
+        server.kill()
+
+        assert first.error is None and second.error is None
+        assert second.num_streams == 2
+        assert len(os.listdir('/proc/self/fd')) <= fds
+
+    def test_client_cache(self, monkeypatch):
+        class FakeClient(object):
+            def __init__(self, config):
+                self.config = config
+                self._test = object()
+                self.runs = 0
+
+            def run(self):
+                self.runs += 1
+                return self.runs
+
+            def close(self):
+                self._test = None
+
+        monkeypatch.setattr(iperf3.iperf3, '_new_client',
+                            lambda config, lib_name: FakeClient(config))
+
+        cache = iperf3.ClientCache(max_idle=2)
+        a = {'server_hostname': 'a', 'duration': 1}
+        b = {'server_hostname': 'b', 'duration': 1}
+        c = {'duration': 1, 'server_hostname': 'c'}
+
+        # the same configuration reuses the same client
+        assert [cache.run(a) for _ in range(3)] == [1, 2, 3]
+        assert len(cache) == 1
+        first = cache.acquire(a)
+        second = cache.acquire(a)
+        assert first is not second and first.runs == 3
+        cache.release(first)
+        cache.release(second)
+
+        with pytest.raises(ValueError):
+            cache.release(first)
+
+        # the least recently used configuration is closed first
+        cache.run(b)
+        cache.run(c)
+        assert len(cache) == 2
+        assert first._test is None or second._test is None
+        assert cache.acquire(dict(c)).runs == 1
+
+        cache.close()
+        assert len(cache) == 0
+
+    def test_settings(self, monkeypatch):
+        """Settings are kept in Python and written to libiperf in one go"""
+        lib = fake_library(monkeypatch)
+
+        client = iperf3.Client(lib_name='fake')
+        assert (client.role, client.port, client.duration) == ('c', 5201, 10)
+
+        del lib.calls[:]
+        for duration in range(100):
+            client.duration = duration
+            assert client.duration == duration
+        assert client.blksize == 131072
+        assert lib.calls == []
+
+        client.apply()
+        assert 'iperf_set_test_duration' in lib.calls
+        assert lib.struct['duration'] == 99
+        del lib.calls[:]
+        client.apply()
+        assert lib.calls == []
+
+        config = client.to_config()
+        assert config['duration'] == 99 and 'role' not in config
+        other = iperf3.Client.from_config(config, lib_name='fake')
+        assert other.to_config() == config
+
+        with pytest.raises(ValueError):
+            iperf3.Client.from_config({'durration': 1}, lib_name='fake')
+
+        with pytest.raises(ValueError):
+            client.protocol = 'sctp'
+        assert client.protocol == 'tcp'
+
+    def test_output_opened_once(self, monkeypatch):
+        lib = fake_library(monkeypatch)
+        closed = []
+        monkeypatch.setattr(iperf3.iperf3, '_fclose', closed.append)
+
+        client = iperf3.Client(lib_name='fake')
+        for _ in range(5):
+            client._call_draining(lib.iperf_run_client, iperf3.iperf3._discard)
+        client.close()
+
+        assert lib.calls.count('iperf_set_test_logfile') == 1
+        assert lib.calls.count('iperf_open_logfile') == 1
+        # the file of the previous run is closed once libiperf replaced it
+        assert closed == [1, 2, 3, 4, 5]
+
+    def test_output_fds(self):
+        """Running many tests doesn't open more and more files"""
+        server = subprocess.Popen(["iperf3", "-s", "-p", "5229"])
+        sleep(.3)  # give the server some time to start
+
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5229
+        client.duration = 1
+        counts = []
+        for _ in range(10):
+            assert client.run().error is None
+            counts.append(len(os.listdir('/proc/self/fd')))
+        server.kill()
+        assert counts[-1] == counts[0]
+
+        server = iperf3.Server()
+        server.bind_address = '127.0.0.1'
+        server.port = 5230
+        counts = []
+        for _ in range(10):
+            results = []
+            thread = threading.Thread(
+                target=lambda: results.append(server.run()))
+            thread.start()
+            assert server.wait_ready(5)
+            subprocess.call(
+                ['iperf3', '-c', '127.0.0.1', '-p', '5230', '-t', '1'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            thread.join()
+            assert results[0].error is None
+            counts.append(len(os.listdir('/proc/self/fd')))
+        assert counts[-1] == counts[0]
+
+    def test_watchdog(self):
+        class FakeTest(object):
+            aborts = 0
+            _watchdog = vars(iperf3.IPerf3)['_watchdog']
+
+            def _abort(self):
+                self.aborts += 1
+
+        done = threading.Event()
+        test = FakeTest()
+        thread = threading.Thread(target=test._watchdog, args=(done, .01))
+        thread.start()
+        sleep(.3)
+        done.set()
+        thread.join()
+        # keeps stopping the test until it has returned
+        assert test.aborts > 1
+
+        done = threading.Event()
+        done.set()
+        test = FakeTest()
+        test._watchdog(done, .01)
+        assert test.aborts == 0
+
+    def test_server_wait_ready(self):
+        server = iperf3.Server()
+        server.bind_address = '127.0.0.1'
+        server.port = 5225
+        ready = []
+        server.on_ready = ready.append
+        assert not server.wait_ready(.1)
+
+        results = []
+        thread = threading.Thread(target=lambda: results.append(server.run()))
+        thread.start()
+        assert server.wait_ready(5)
+        assert ready == [server]
+
+        # No sleep needed, the server already listens
+        subprocess.call(['iperf3', '-c', '127.0.0.1', '-p', '5225', '-t', '1'],
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        thread.join()
+
+        assert results[0].error is None
+        assert not server.ready.is_set()
+
+    def test_server_ready_client_connected(self, monkeypatch):
+        """A client connecting before the state is polled still counts"""
+        lib = fake_library(monkeypatch)
+        server = iperf3.Server(lib_name='fake')
+        server.json_output = False
+        ready = []
+        server.on_ready = ready.append
+
+        def serve_test():
+            lib.struct['state'] = 2  # TEST_RUNNING, already past IPERF_START
+            sleep(.1)
+
+        server._serve_test = serve_test
+        server.run()
+        server.close()
+        assert ready == [server]
+
+    def test_server_farm(self):
+        farm = iperf3.ServerFarm([5223, 5224], bind_address='127.0.0.1')
+        farm.start()
+        assert farm.wait_ready(5)
+
+        client = subprocess.Popen(
+            'iperf3 -c 127.0.0.1 -p 5223 -t 1 & '
+            'iperf3 -c 127.0.0.1 -p 5224 -t 1; wait',
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        results = farm.results()
+        ports = sorted(port for port, _ in [next(results), next(results)])
+        client.wait()
+
+        assert ports == [5223, 5224]
+        assert farm.served == {5223: 1, 5224: 1}
+        assert farm.wait_ready(5)
+        assert farm.idle_ports() == [5223, 5224]
+
+        farm.stop()
+        assert not farm.is_running()
+        assert farm.idle_ports() == []
+
+    def test_server_farm_without_ports(self):
+        with pytest.raises(ValueError):
+            iperf3.ServerFarm([])
+
     def test_server_run_output_to_screen(self):
         server = iperf3.Server()
         server.bind_address = '127.0.0.1'
@@ -313,12 +958,267 @@ class TestPyPerf:
 
         assert response == None
 
+    def test_read_pipe(self):
+        pipe_out, pipe_in = os.pipe()
+        os.write(pipe_in, b'{"start": {}}' * 1000)
+        assert iperf3.iperf3.read_pipe(pipe_out) == '{"start": {}}' * 1000
+        os.close(pipe_out)
+        os.close(pipe_in)
+
+    def test_pipe_reader(self):
+        """The reader keeps the pipe empty, so a writer producing more
+        than the pipe capacity never blocks"""
+        pipe_out, pipe_in = os.pipe()
+        data = os.urandom(4 * 1024 * 1024)
+
+        def write():
+            view = memoryview(data)
+            while view:
+                view = view[os.write(pipe_in, view):]
+
+        reader = iperf3.iperf3.PipeReader(pipe_out)
+        for _ in range(2):
+            writer = threading.Thread(target=write)
+            reader.start()
+            writer.start()
+            writer.join()
+            assert reader.stop() == data
+
+        os.close(pipe_out)
+        os.close(pipe_in)
+
+    def test_client_run_on_interval(self):
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5218
+        client.duration = 2
+
+        server = subprocess.Popen(["iperf3", "-s", "-p", "5218"])
+        sleep(.3)  # give the server some time to start
+        intervals = []
+        response = client.run(on_interval=intervals.append)
+        server.kill()
+
+        assert len(intervals) == 2
+        assert intervals == response.json['intervals']
+
+    def test_client_stream(self):
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5219
+        client.duration = 2
+
+        server = subprocess.Popen(["iperf3", "-s", "-p", "5219"])
+        sleep(.3)  # give the server some time to start
+        stream = client.stream()
+        intervals = [interval['sum']['bytes'] for interval in stream]
+        server.kill()
+
+        assert len(intervals) == 2
+        assert stream.result.remote_port == 5219
+
+    def test_json_stream(self):
+        """A json stream is assembled into the regular json output"""
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            document = json.loads(f.read())
+
+        events = [{'event': 'start', 'data': document['start']}]
+        events += [{'event': 'interval', 'data': interval}
+                   for interval in document['intervals']]
+        events += [{'event': 'end', 'data': document['end']}]
+        data = ''.join(json.dumps(event) + '\n' for event in events)
+        data = data.encode('utf-8')
+
+        intervals = []
+        stream = iperf3.iperf3._JSONStream(intervals.append)
+        for position in range(0, len(data), 100):
+            stream.feed(data[position:position + 100])
+
+        assert intervals == document['intervals']
+        assert json.loads(stream.text) == document
+
+    def test_client_run_until_stable(self):
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5220
+        client.duration = 30
+
+        server = subprocess.Popen(["iperf3", "-s", "-p", "5220"])
+        sleep(.3)  # give the server some time to start
+        start = time()
+        response = client.run_until_stable(window=3, max_cv=.5)
+        server.kill()
+
+        assert response.stopped_early
+        assert time() - start < 30
+        assert response.sent_bytes > 0
+
+    def test_json_stream_stopped_early(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            document = json.loads(f.read())
+
+        def stop_after_three(interval):
+            if len(stream.intervals) == 3:
+                raise iperf3.StopTest()
+
+        stream = iperf3.iperf3._JSONStream(stop_after_three)
+        stream.event(json.dumps(
+            {'event': 'start', 'data': document['start']}).encode('utf-8'))
+        for interval in document['intervals']:
+            stream.event(json.dumps(
+                {'event': 'interval', 'data': interval}).encode('utf-8'))
+
+        result = iperf3.TestResult(stream.stopped_text)
+        sums = [interval['sum'] for interval in document['intervals'][:3]]
+        assert result.stopped_early
+        assert result.sent_bytes == sum(s['bytes'] for s in sums)
+        assert isclose(result.sent_bps,
+                       result.sent_bytes * 8 / sums[-1]['end'])
+        assert len(result.json['intervals']) == 3
+
+    def test_json_stream_without_intervals(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            document = json.loads(f.read())
+
+        aggregate = iperf3.IntervalAggregate()
+        stream = iperf3.iperf3._JSONStream(aggregate, keep_intervals=False)
+        stream.event(json.dumps(
+            {'event': 'start', 'data': document['start']}).encode('utf-8'))
+        for interval in document['intervals']:
+            stream.event(json.dumps(
+                {'event': 'interval', 'data': interval}).encode('utf-8'))
+        stream.event(json.dumps(
+            {'event': 'end', 'data': document['end']}).encode('utf-8'))
+
+        assert stream.intervals == []
+        assert aggregate.count == stream.aggregate.count == 13
+        result = iperf3.TestResult(stream.text)
+        assert result.sent_bps == 935992000
+        assert len(result.intervals) == 0
+
+    def test_interval_aggregate(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            document = json.loads(f.read())
+        sums = [interval['sum'] for interval in document['intervals']]
+        bps = [s['bits_per_second'] for s in sums]
+
+        aggregate = iperf3.IntervalAggregate()
+        for interval in document['intervals']:
+            aggregate(interval)
+
+        mean = sum(bps) / len(bps)
+        std = (sum((x - mean) ** 2 for x in bps) / (len(bps) - 1)) ** .5
+        assert aggregate.count == len(sums)
+        assert aggregate.bytes == sum(s['bytes'] for s in sums)
+        assert aggregate.seconds == sums[-1]['end']
+        assert aggregate.min_bits_per_second == min(bps)
+        assert aggregate.max_bits_per_second == max(bps)
+        assert isclose(aggregate.mean_bits_per_second, mean)
+        assert isclose(aggregate.std_bits_per_second, std)
+        assert aggregate.retransmits == 0
+        assert aggregate.jitter_ms is None
+        assert 'sum_sent' in aggregate.end_section()
+
+    def test_quantile_sketch(self):
+        values = [float(value) for value in range(1, 10001)] + [0.] * 100
+        sketch = iperf3.QuantileSketch(relative_accuracy=.01)
+        for value in values:
+            sketch.add(value)
+
+        values.sort()
+        for percent in (5, 50, 95):
+            exact = values[int(percent / 100. * (len(values) - 1))]
+            assert isclose(sketch.percentile(percent), exact, rel_tol=.01)
+        assert sketch.percentile(0) == 0
+        assert iperf3.QuantileSketch().percentile(50) is None
+
+        other = iperf3.QuantileSketch(relative_accuracy=.01)
+        other.merge(sketch)
+        assert other.count == sketch.count
+        assert other.percentile(50) == sketch.percentile(50)
+        with pytest.raises(ValueError):
+            other.merge(iperf3.QuantileSketch())
+
+    def test_soak_test(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            text = f.read()
+        now = [0]
+
+        class FakeClient(object):
+            duration = 10
+            durations = []
+
+            def run(self, on_interval, keep_intervals):
+                assert not keep_intervals
+                self.durations.append(self.duration)
+                if len(self.durations) == 2:
+                    now[0] += 1
+                    return iperf3.TestResult('{"error": "busy"}')
+                for _ in range(self.duration):
+                    now[0] += 1
+                    bps = 1e9 if now[0] < 80 else 1e6
+                    on_interval({'sum': {
+                        'seconds': 1, 'bytes': int(bps / 8),
+                        'bits_per_second': bps, 'retransmits': 1,
+                    }})
+                return iperf3.TestResult(text)
+
+        reports = []
+        client = FakeClient()
+        soak = iperf3.SoakTest(client, windows=(10, 60), run_duration=30,
+                               report_interval=10, on_report=reports.append,
+                               retry_delay=0, clock=lambda: now[0])
+        summary = soak.run(100)
+
+        assert client.durations == [30, 30, 30, 30, 9]
+        assert client.duration == 10
+        assert soak.runs == 5 and soak.failed_runs == 1
+        assert summary['last_error'] == 'busy'
+        assert len(reports) == 10  # every 10 seconds from the start
+
+        minute, ten = summary['windows'][60], summary['windows'][10]
+        assert ten['intervals'] == 10
+        assert ten['median_bits_per_second'] == 1e6
+        assert ten['retransmits'] == 10
+        assert minute['min_bits_per_second'] == 1e6
+        assert minute['max_bits_per_second'] == 1e9
+        assert isclose(minute['p95_bits_per_second'], 1e9, rel_tol=.02)
+
+    def test_soak_test_failing(self):
+        """Failing tests are retried after a delay and still reported"""
+        now = [0]
+
+        class FakeClient(object):
+            duration = 10
+
+            def run(self, on_interval, keep_intervals):
+                now[0] += 1
+                return None
+
+        reports = []
+        soak = iperf3.SoakTest(FakeClient(), windows=(10,), report_interval=2,
+                               on_report=reports.append, retry_delay=.01,
+                               clock=lambda: now[0])
+        start = time()
+        soak.run(6)
+
+        assert soak.runs == 6 and soak.failed_runs == 6
+        assert time() - start >= .04  # waited after the failed tests
+        assert [report['runs'] for report in reports] == [2, 4, 6]
+        assert reports[0]['windows'][10]['intervals'] == 0
+
     def test_result(self):
         dirname = os.path.dirname(os.path.abspath(__file__))
         with open(os.path.join(dirname, 'results.json')) as f:
             json = f.read()
 
         result = iperf3.TestResult(json)
+        assert not result.stopped_early
         assert result.sent_bps  == 935992000
         assert result.sent_kbps == 935992
         assert result.sent_Mbps == 935.992
@@ -332,3 +1232,260 @@ class TestPyPerf:
         assert isclose(result.received_kB_s, 114046.387, rel_tol=0.01)
         assert isclose(result.received_MB_s, 111.373, rel_tol=0.01)
 
+    def test_result_lazy(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            text = f.read()
+
+        result = iperf3.TestResult(text)
+        assert not result._parsed
+        assert result.sent_bps == 935992000
+        assert result._parsed
+        assert result._json is None  # the summary doesn't keep the json
+
+        with pytest.raises(AttributeError):
+            result.jitter_ms  # UDP only
+
+        with pytest.raises(AttributeError):
+            result.unknown = 1  # results are slotted
+
+    def test_result_incomplete(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            text = f.read()
+
+        for broken in (text[:len(text) // 2], '{"start": {}}'):
+            result = iperf3.TestResult(broken)
+            for _ in range(2):  # fails the same way every time
+                with pytest.raises(ValueError):
+                    result.error
+                with pytest.raises(ValueError):
+                    result.sent_bps
+            assert not result._parsed
+
+            results = iperf3.ResultSet()
+            with pytest.raises(ValueError):
+                results.append(result)
+            assert len(results) == 0
+
+    def test_result_drop_text(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            text = f.read()
+
+        result = iperf3.TestResult(text, keep_text=False)
+        assert result.text is None
+        assert result.json is None
+        assert result.sent_Mbps == 935.992
+        assert result.remote_port == 9987
+        assert not result.reverse
+        assert result.type == 'client'
+        assert len(result.intervals) == len(json.loads(text)['intervals'])
+        assert repr(result).startswith('<TestResult')
+
+        result = iperf3.TestResult(text, keep_text=False, keep_intervals=False)
+        assert result.intervals is None
+
+    def test_result_intervals(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            text = f.read()
+        document = json.loads(text)
+
+        intervals = iperf3.TestResult(text).intervals
+        assert len(intervals) == len(document['intervals'])
+        assert list(intervals.bytes) == [
+            interval['sum']['bytes'] for interval in document['intervals']]
+        assert intervals.bits_per_second[0] == 9.50062e+08
+        assert intervals.snd_cwnd[0] == 573408
+        assert intervals.retransmits[0] == 0
+        assert intervals.jitter_ms is None  # TCP test
+        assert intervals.lost_packets is None
+
+    def test_result_streams(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            text = f.read()
+
+        streams = iperf3.TestResult(text).streams
+        assert len(streams) == 1
+        assert list(streams.local_port) == [60166]
+        assert list(streams.sent_bytes) == [1520994808]
+        assert list(streams.received_bps) == [934268000]
+        assert list(streams.retransmits) == [0]
+        assert streams.max_rtt is None  # not reported by iperf 3.0
+        assert streams.jitter_ms is None
+        assert streams.jain_index() == 1
+        assert streams.min_mean_ratio() == 1
+
+    def test_streams_fairness(self):
+        streams = iperf3.Streams(local_host=['a'] * 4,
+                                 received_bps=[100., 0, 0, 0])
+        assert streams.jain_index() == .25
+        assert streams.min_mean_ratio() == 0
+
+        streams = iperf3.Streams(local_host=['a'] * 2,
+                                 sent_bps=[100., 50.])
+        assert isclose(streams.jain_index(), .9)
+        assert isclose(streams.min_mean_ratio(), 50 / 75.)
+
+    def test_result_set(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            text = f.read()
+
+        results = iperf3.ResultSet([iperf3.TestResult(text)] * 3)
+        results.append(iperf3.TestResult('{"error": "busy"}'))
+        assert len(results) == 4
+        assert list(results.column('failed')) == [0, 0, 0, 1]
+        assert list(results.column('error')) == [None, None, None, 'busy']
+        assert results.count('sent_Mbps') == 3
+        assert isclose(results.mean('sent_Mbps'), 935.992)
+        assert results.confidence_interval('bps') != results.mean('bps')
+
+        groups = results.groupby('protocol')
+        assert sorted(groups, key=str) == [None, 'TCP']
+        assert len(groups['TCP']) == 3
+
+    def test_result_set_aggregates(self):
+        results = iperf3.ResultSet.from_columns(
+            remote_host=['a', 'b', 'a', 'b'],
+            num_streams=[1, 1, 2, 2],
+            sent_bps=[1e6, 2e6, 3e6, float('nan')],
+        )
+        assert results.mean('sent_Mbps') == 2
+        assert results.percentile('sent_Mbps', [0, 50, 100]) == [1, 2, 3]
+        assert results.percentile('sent_Mbps', 25) == 1.5
+
+        low, high = results.confidence_interval('sent_Mbps')
+        assert isclose(low, 2 - 1.959964 / 3 ** .5, rel_tol=1e-6)
+        assert isclose(high, 2 + 1.959964 / 3 ** .5, rel_tol=1e-6)
+
+        groups = results.groupby('remote_host', 'num_streams')
+        assert sorted(groups) == [('a', 1), ('a', 2), ('b', 1), ('b', 2)]
+        assert list(groups['a', 2].column('sent_bps')) == [3e6]
+        assert groups['b', 2].count('sent_bps') == 0
+
+    def test_result_bytes(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json'), 'rb') as f:
+            data = f.read()
+
+        result = iperf3.TestResult(data)
+        assert result.sent_bps == 935992000
+        assert result.text == data.decode('utf-8')
+        assert repr(result) == result.text
+        assert len(result.intervals) == 13
+
+    @pytest.mark.parametrize('parser', ['orjson', 'ujson', 'json'])
+    def test_load_json(self, monkeypatch, parser):
+        for module in ('orjson', 'ujson'):
+            if module != parser:
+                monkeypatch.setattr(iperf3.iperf3, module, None)
+
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json'), 'rb') as f:
+            data = f.read()
+        document = json.loads(data.decode('utf-8'))
+
+        load_json = iperf3.iperf3._load_json
+        assert load_json(data) == document
+        assert load_json(data.decode('utf-8')) == document
+
+        del document['intervals']
+        assert load_json(data, intervals=False) == document
+        assert load_json(data.decode('utf-8'), intervals=False) == document
+
+        # text not formatted by libiperf is parsed in full
+        assert 'intervals' in load_json(b'{"intervals": [], "end": {}}',
+                                        intervals=False)
+
+    def test_result_dict(self):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            result = iperf3.TestResult(f.read())
+
+        summary = result.to_dict()
+        assert summary['sent_bps'] == result.sent_bps
+        assert summary['type'] == 'client'
+        assert 'text' not in summary and 'jitter_ms' not in summary
+
+        copy = iperf3.TestResult.from_dict(summary)
+        assert copy.to_dict() == summary
+        assert copy.sent_Mbps == result.sent_Mbps
+        assert copy.text is None and copy.intervals is None
+
+    def test_archive(self, tmpdir):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            text = f.read()
+        result = iperf3.TestResult(text)
+        path = str(tmpdir.join('results.ipa'))
+
+        with iperf3.ArchiveWriter(path) as archive:
+            archive.write(result)
+            archive.write(iperf3.TestResult('{"error": "busy"}'))
+        with iperf3.ArchiveWriter(path) as archive:
+            archive.write(result)
+        assert os.path.getsize(path) < len(text) / 2
+
+        # a partially written record is ignored
+        with open(path, 'ab') as f:
+            f.write(b'\xff\x00\x00')
+
+        with iperf3.ArchiveReader(path) as archive:
+            assert len(archive) == 3
+            assert archive[0].to_dict() == result.to_dict()
+            assert archive[1].error == 'busy'
+            assert archive[-1].sent_bps == result.sent_bps
+            assert archive.read(0, intervals=False).intervals is None
+
+            intervals = archive[0].intervals
+            assert list(intervals.start) == list(result.intervals.start)
+            assert list(intervals.end) == list(result.intervals.end)
+            assert list(intervals.bytes) == list(result.intervals.bytes)
+            assert list(intervals.snd_cwnd) == list(result.intervals.snd_cwnd)
+            assert intervals.jitter_ms is None
+
+            assert [r.error for r in archive] == [None, 'busy', None]
+
+    def test_json_lines(self, tmpdir):
+        dirname = os.path.dirname(os.path.abspath(__file__))
+        with open(os.path.join(dirname, 'results.json')) as f:
+            result = iperf3.TestResult(f.read())
+        path = str(tmpdir.join('results.jsonl'))
+
+        with iperf3.JSONLinesWriter(path, sync='flush') as out:
+            out.write(result)
+            out.write(iperf3.TestResult('{"error": "busy"}'))
+        with iperf3.JSONLinesWriter(path, intervals=False) as out:
+            out.write(result)
+
+        # a partially written line is ignored
+        with open(path, 'a') as f:
+            f.write('{"error": "bu')
+
+        with iperf3.JSONLinesReader(path) as results:
+            results = list(results)
+        assert [r.error for r in results] == [None, 'busy', None]
+        assert results[0].to_dict() == result.to_dict()
+        assert list(results[0].intervals.bytes) == list(result.intervals.bytes)
+        assert results[0].intervals.rtt is None
+        assert results[2].intervals is None
+
+        with iperf3.JSONLinesReader(path) as results:
+            records = list(results.records())
+        assert len(records) == 3
+        assert records[0]['sent_bps'] == result.sent_bps
+
+    def test_json_lines_writer_sync(self):
+        with pytest.raises(ValueError):
+            iperf3.JSONLinesWriter('results.jsonl', sync='always')
+
+    def test_archive_not_an_archive(self, tmpdir):
+        path = tmpdir.join('results.json')
+        path.write('{"error": "busy"}')
+        with pytest.raises(ValueError):
+            iperf3.ArchiveReader(str(path))
+        with pytest.raises(ValueError):
+            iperf3.ArchiveWriter(str(path))
@@ -0,0 +1,115 @@
+import iperf3
+import pytest
+import subprocess
+import threading
+import asyncio
+from time import sleep, time
+
+from test_iperf3 import fake_library
+
+
+class TestPyPerfAsync:
+
+    def test_client_run_async(self):
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5216
+        client.duration = 1
+
+        server = subprocess.Popen(["iperf3", "-s", "-p", "5216"])
+        sleep(.3)  # give the server some time to start
+
+        async def main():
+            return await client.run_async(timeout=5)
+
+        response = asyncio.run(main())
+        server.kill()
+
+        assert response.remote_port == 5216
+
+    def test_client_run_async_cancel(self):
+        """Running into the timeout stops the test"""
+        client = iperf3.Client()
+        client.server_hostname = '127.0.0.1'
+        client.port = 5217
+        client.duration = 10
+
+        server = subprocess.Popen(["iperf3", "-s", "-p", "5217"])
+        sleep(.3)  # give the server some time to start
+        start = time()
+
+        async def main():
+            return await client.run_async(timeout=1.5)
+
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(main())
+        server.kill()
+
+        assert time() - start < 5
+
+    def test_run_off_loop_concurrency(self):
+        """Hundreds of tests wait concurrently without stalling the loop"""
+        class FakeTest(object):
+            def _abort(self):
+                pass
+
+            def run(self):
+                sleep(.5)
+                return 'result'
+
+        async def main():
+            stalls = []
+
+            async def ticker():
+                while True:
+                    before = time()
+                    await asyncio.sleep(.01)
+                    stalls.append(time() - before)
+
+            tick = asyncio.ensure_future(ticker())
+            tests = [FakeTest() for _ in range(300)]
+            start = time()
+            results = await asyncio.gather(*[
+                iperf3.iperf3._run_off_loop(test, test.run) for test in tests
+            ])
+            elapsed = time() - start
+            tick.cancel()
+            return results, elapsed, max(stalls)
+
+        results, elapsed, stall = asyncio.run(main())
+        assert results == ['result'] * 300
+        assert elapsed < 3
+        assert stall < .25
+
+    def test_server_async(self, monkeypatch):
+        fake_library(monkeypatch)
+        server = iperf3.Server(lib_name='fake')
+        threads = []
+        aborted = threading.Event()
+
+        def run_once():
+            threads.append(threading.current_thread())
+            if len(threads) == 1:
+                aborted.wait(5)  # a client that never comes
+            return len(threads)
+
+        server._run_once = run_once
+        server._abort = lambda: aborted.set() or True
+
+        async def cancelled():
+            return await server.run_async(timeout=.2)
+
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(cancelled())
+        assert aborted.is_set()
+
+        async def main():
+            first = await server.run_async(timeout=5)
+            return first, [result async for result in server.serve_async(3)]
+
+        # the test stopped by the timeout is not handed out afterwards
+        assert asyncio.run(main()) == (2, [3, 4, 5])
+        # every test ran on the worker thread of the server
+        assert len(set(threads)) == 1
+        assert threads[0] is not threading.current_thread()
+        server.close()